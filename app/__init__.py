@@ -1,14 +1,27 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from flask_migrate import Migrate
 from config import config
+from app.utils.compression import Compression
+from app.utils.db_pool import build_engine_options, instrument_engine
+from app.utils.log import setup_logging
+from app.utils.tracing import init_tracing
+from app.utils.profiler import init_profiler
+from app.utils.tasks import background
+from app.utils.streams import streams
+from app.utils.semantic_cache import semantic_cache
+from app.utils.health import health
+from app.utils.text_compression import text_compressor
+from app.utils.json_provider import json_codec
 import os
 
+# 迁移脚本目录（使用绝对路径，不依赖启动时的工作目录）
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
 # 扩展实例
 db = SQLAlchemy()
 login_manager = LoginManager()
-migrate = Migrate()
+compression = Compression()
 
 def create_app(config_name=None):
     """应用工厂函数"""
@@ -18,10 +31,31 @@ def create_app(config_name=None):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
     
+    # 日志：队列异步输出、结构化字段与 request_id
+    setup_logging(app)
+    
+    # 未显式配置引擎参数时按环境变量生成连接池配置
+    if not app.config.get('SQLALCHEMY_ENGINE_OPTIONS'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(app.config)
+    
     # 初始化扩展
+    json_codec.init_app(app)
     db.init_app(app)
     login_manager.init_app(app)
-    migrate.init_app(app, db)
+    compression.init_app(app)
+    background.init_app(app)
+    streams.init_app(app)
+    semantic_cache.init_app(app)
+    health.init_app(app)
+    text_compressor.init_app(app)
+    
+    # 连接池与慢查询监控、请求链路追踪
+    with app.app_context():
+        instrument_engine(db.engine, app.config['DB_SLOW_QUERY_MS'])
+        init_tracing(app, db.engine)
+    
+    # 按需采样分析（管理后台开启）
+    init_profiler(app)
     
     # 配置登录管理器
     login_manager.login_view = 'admin.login'
@@ -38,21 +72,12 @@ def create_app(config_name=None):
     from app.views.admin import admin as admin_blueprint
     app.register_blueprint(admin_blueprint, url_prefix='/admin')
     
-    # 在应用上下文中创建数据库表
-    with app.app_context():
-        from app.models import user, conversation, message, config_model
-        db.create_all()
-        
-        # 创建默认管理员账号
-        from app.models.user import User
-        admin_user = User.query.filter_by(username=app.config['ADMIN_USERNAME']).first()
-        if not admin_user:
-            admin_user = User(
-                username=app.config['ADMIN_USERNAME'],
-                is_admin=True
-            )
-            admin_user.set_password(app.config['ADMIN_PASSWORD'])
-            db.session.add(admin_user)
-            db.session.commit()
-    
-    return app
\ No newline at end of file
+    # 存活/就绪探针（/healthz、/readyz）
+    from app.views.health import health as health_blueprint
+    app.register_blueprint(health_blueprint)
+    
+    # 注册命令行命令（数据库初始化见 flask bootstrap；flask db 执行时才导入 Flask-Migrate）
+    from app.cli import register_commands
+    register_commands(app)
+    
+    return app
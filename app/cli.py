@@ -0,0 +1,278 @@
+"""
+命令行工具
+
+    flask bootstrap    初始化或升级数据库结构，并创建默认管理员账号
+    flask prune-users  清理没有任何对话的匿名用户
+    flask partitions   消息表按月分区的转换、补建与按保留期删除（仅 PostgreSQL）
+    flask compress-messages  压缩启用正文压缩之前写入的长消息
+
+数据库初始化不再放在 create_app 中，部署时在启动 gunicorn 之前执行一次即可，
+worker 启动时不访问数据库。后续表结构变更通过 migrations/ 下的迁移脚本发布，
+也可以直接使用 Flask-Migrate 提供的 ``flask db upgrade``。
+
+Flask-Migrate（及 alembic）导入约需 0.1 秒，只有迁移相关的命令用到，执行这些命令时才导入，
+worker 启动时不导入。
+"""
+import click
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import inspect
+
+from app import db, MIGRATIONS_DIR
+from app.utils import partitioning
+
+# 引入迁移之前由 create_all 建出的数据库：按已存在的表与列判断对应的迁移版本。
+# 增量同步（0002 的内容）先于迁移发布，期间 create_all 只会给已有的库补建删除记录表、不会加列，
+# 这样的库按列判断为 0001，由 0002 补齐
+LEGACY_REVISIONS = (
+    ('users', 'sync_version', '0002_sync_and_paging'),
+    ('users', None, '0001_baseline')
+)
+
+logger = logging.getLogger(__name__)
+
+
+def init_migrate(app):
+    """注册 Flask-Migrate 扩展（已注册时跳过）"""
+    if 'migrate' not in app.extensions:
+        from flask_migrate import Migrate
+        Migrate(app, db, directory=MIGRATIONS_DIR)
+    return app.extensions['migrate']
+
+
+class LazyMigrateGroup(click.Group):
+    """``flask db`` 命令组：解析子命令时才注册 Flask-Migrate 并交给它的命令组"""
+
+    def _target(self):
+        init_migrate(current_app._get_current_object())
+        from flask_migrate.cli import db as db_group
+        return db_group
+
+    def list_commands(self, ctx):
+        return self._target().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._target().get_command(ctx, name)
+
+
+def _alembic_config():
+    config = init_migrate(current_app._get_current_object()).migrate.get_config()
+    # 在应用进程内执行迁移时不重新配置日志（见 migrations/env.py）
+    config.attributes['configure_logger'] = False
+    return config
+
+
+def bootstrap_database():
+    """初始化或升级数据库并确保默认管理员存在，需在应用上下文中调用
+
+    - 空库：按当前模型建表并标记为最新迁移版本
+    - 没有迁移记录的旧库：先标记为对应的迁移版本，再升级
+    - 已有迁移记录：升级到最新版本
+    """
+    from alembic import command
+
+    config = _alembic_config()
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+
+    if not tables:
+        from app import models  # noqa: F401  注册全部模型
+        db.create_all()
+        command.stamp(config, 'head')
+    else:
+        if 'alembic_version' not in tables:
+            for table, column, revision in LEGACY_REVISIONS:
+                if table in tables and (column is None or
+                                        column in {c['name'] for c in inspector.get_columns(table)}):
+                    command.stamp(config, revision)
+                    break
+        command.upgrade(config, 'head')
+
+    if current_app.config['MESSAGES_PARTITIONING']:
+        with db.engine.begin() as conn:
+            if partitioning.is_postgresql(conn):
+                partitioning.setup(conn, current_app.config['MESSAGES_PARTITION_MONTHS_AHEAD'])
+            else:
+                logger.warning("MESSAGES_PARTITIONING 仅支持 PostgreSQL，已忽略")
+
+    ensure_admin_user()
+
+
+def ensure_admin_user():
+    """创建默认管理员账号（已存在时跳过）"""
+    from app.models.user import User
+    username = current_app.config['ADMIN_USERNAME']
+    if User.query.filter_by(username=username).first():
+        return False
+
+    admin_user = User(username=username, is_admin=True)
+    admin_user.set_password(current_app.config['ADMIN_PASSWORD'])
+    db.session.add(admin_user)
+    db.session.commit()
+    return True
+
+
+@click.command('bootstrap')
+def bootstrap_command():
+    """初始化/升级数据库并创建默认管理员"""
+    bootstrap_database()
+    click.echo('数据库初始化完成')
+
+
+def prune_empty_users(min_age=timedelta(hours=1), batch_size=1000, dry_run=False):
+    """删除没有任何对话的匿名用户，需在应用上下文中调用
+
+    旧版本在首次访问时就创建用户，只浏览、爬虫与健康检查都会留下空用户。只清理创建时间
+    早于 min_age 的用户，避免删除刚创建、正在新建第一个对话的用户；其删除记录与幂等键一并删除。
+    会话仍指向被删除用户的访问者按新访问者处理。
+
+    Returns:
+        int: 删除（dry_run 时为符合条件）的用户数
+    """
+    from app.models import User, Conversation, ConversationTombstone, IdempotencyKey
+
+    empty = db.select(User.id).where(
+        User.username.is_(None),
+        User.is_admin.is_(False),
+        User.created_at < datetime.utcnow() - min_age,
+        ~db.select(Conversation.id).where(Conversation.user_id == User.id).exists()
+    )
+    if dry_run:
+        return db.session.execute(db.select(db.func.count()).select_from(empty.subquery())).scalar()
+
+    total = 0
+    while True:
+        ids = db.session.execute(empty.order_by(User.id).limit(batch_size)).scalars().all()
+        if not ids:
+            break
+        for model in (ConversationTombstone, IdempotencyKey):
+            db.session.execute(db.delete(model).where(model.user_id.in_(ids)))
+        db.session.execute(db.delete(User).where(User.id.in_(ids)))
+        db.session.commit()
+        total += len(ids)
+    return total
+
+
+@click.command('prune-users')
+@click.option('--min-age-hours', default=1.0, show_default=True, help='只清理创建时间早于该时长的用户')
+@click.option('--batch-size', default=1000, show_default=True, help='每个事务删除的用户数')
+@click.option('--dry-run', is_flag=True, help='只统计，不删除')
+def prune_users_command(min_age_hours, batch_size, dry_run):
+    """清理没有任何对话的匿名用户"""
+    count = prune_empty_users(timedelta(hours=min_age_hours), batch_size, dry_run)
+    if dry_run:
+        click.echo(f'符合条件的空用户: {count}')
+    else:
+        click.echo(f'已删除空用户: {count}')
+
+
+@click.command('compress-messages')
+@click.option('--batch-size', default=500, show_default=True, help='每个事务检查的消息数')
+@click.option('--restart', is_flag=True, help='从头重新检查（修改阈值或编码后使用）')
+def compress_messages_command(batch_size, restart):
+    """压缩启用正文压缩之前写入的长消息（与后台任务共用进度，可随时中断）"""
+    from app.models import Message
+    from app.utils.text_compression import text_compressor
+
+    if not text_compressor.enabled:
+        raise click.ClickException('MESSAGE_COMPRESSION_CODEC=none，未启用正文压缩')
+    total_scanned = total_compressed = 0
+    finished = False
+    while not finished:
+        scanned, compressed, finished = Message.compress_stored(batch_size, max_batches=20, restart=restart)
+        restart = False
+        total_scanned += scanned
+        total_compressed += compressed
+        click.echo(f'已检查 {total_scanned} 条，压缩 {total_compressed} 条')
+
+
+@click.group('partitions')
+def partitions_group():
+    """消息表按月分区（仅 PostgreSQL）"""
+
+
+def _partition_connection():
+    conn = db.engine.connect()
+    if not partitioning.is_postgresql(conn):
+        conn.close()
+        raise click.ClickException('消息表分区仅支持 PostgreSQL')
+    return conn
+
+
+@partitions_group.command('status')
+def partitions_status_command():
+    """显示分区状态"""
+    with _partition_connection() as conn:
+        status = partitioning.status(conn)
+    if status['partitioned']:
+        click.echo('messages 已是分区表')
+    elif status['converting']:
+        click.echo('转换中：分区表已创建并同步新写入，执行 flask partitions convert 完成转换')
+    else:
+        click.echo('messages 不是分区表')
+    if status['old_table']:
+        click.echo(f'转换前的原表仍保留为 {partitioning.OLD_TABLE}，确认无误后可手动删除')
+    for partition in status['partitions']:
+        rows = '-' if partition['rows'] is None else partition['rows']
+        click.echo(f"  {partition['name']:<24} 约 {rows} 行  {partition['size_bytes'] / 1048576:.1f} MB")
+
+
+@partitions_group.command('convert')
+@click.option('--batch-size', default=5000, show_default=True, help='每个事务复制的消息数')
+@click.option('--drop-old', is_flag=True, help='切换后直接删除原表（默认保留为 messages_unpartitioned）')
+def partitions_convert_command(batch_size, drop_old):
+    """在线把 messages 转换为按月分区的表，期间读写照常"""
+    _partition_connection().close()
+
+    def progress(total, last_id):
+        click.echo(f'已复制 {total} 条（ID 至 {last_id}）')
+
+    total = partitioning.convert(db.engine, current_app.config['MESSAGES_PARTITION_MONTHS_AHEAD'],
+                                 batch_size, keep_old=not drop_old, progress=progress)
+    if total is None:
+        click.echo('messages 已是分区表')
+    else:
+        click.echo(f'转换完成，共复制 {total} 条消息')
+
+
+@partitions_group.command('ensure')
+@click.option('--months-ahead', type=int, default=None, help='提前创建的月数，默认 MESSAGES_PARTITION_MONTHS_AHEAD')
+def partitions_ensure_command(months_ahead):
+    """创建当前及未来月份的分区"""
+    if months_ahead is None:
+        months_ahead = current_app.config['MESSAGES_PARTITION_MONTHS_AHEAD']
+    with _partition_connection() as conn, conn.begin():
+        if not partitioning.is_partitioned(conn):
+            raise click.ClickException('messages 不是分区表')
+        created = partitioning.ensure_partitions(conn, months_ahead)
+    click.echo(f"已创建分区: {', '.join(created)}" if created else '分区均已存在')
+
+
+@partitions_group.command('prune')
+@click.option('--retention-months', type=int, default=None,
+              help='保留的月数（含当前月），默认 MESSAGES_RETENTION_MONTHS')
+@click.option('--dry-run', is_flag=True, help='只列出，不删除')
+def partitions_prune_command(retention_months, dry_run):
+    """删除保留期之前的月分区（整月删除消息，对话本身保留）"""
+    if retention_months is None:
+        retention_months = current_app.config['MESSAGES_RETENTION_MONTHS']
+    if retention_months <= 0:
+        raise click.ClickException('请通过 --retention-months 或 MESSAGES_RETENTION_MONTHS 指定保留的月数')
+    cutoff = partitioning.add_months(partitioning.month_start(datetime.utcnow()), 1 - retention_months)
+    with _partition_connection() as conn, conn.begin():
+        if not partitioning.is_partitioned(conn):
+            raise click.ClickException('messages 不是分区表')
+        expired = partitioning.drop_partitions_before(conn, cutoff, dry_run)
+    names = ', '.join(partition['name'] for partition in expired) or '无'
+    click.echo(f'{cutoff} 之前的分区{"（未删除）" if dry_run else "已删除"}: {names}')
+
+
+def register_commands(app):
+    """注册命令行命令"""
+    app.cli.add_command(LazyMigrateGroup('db', help='数据库迁移（Flask-Migrate）'))
+    app.cli.add_command(bootstrap_command)
+    app.cli.add_command(prune_users_command)
+    app.cli.add_command(partitions_group)
+    app.cli.add_command(compress_messages_command)
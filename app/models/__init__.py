@@ -3,5 +3,9 @@ from .user import User
 from .conversation import Conversation
 from .message import Message
 from .config_model import Config
+from .conversation_tombstone import ConversationTombstone
+from .idempotency_key import IdempotencyKey, IdempotencyConflictError
+from .usage_daily import UsageDaily
 
-__all__ = ['User', 'Conversation', 'Message', 'Config']
\ No newline at end of file
+__all__ = ['User', 'Conversation', 'Message', 'Config', 'ConversationTombstone', 'IdempotencyKey', 'IdempotencyConflictError',
+           'UsageDaily']
\ No newline at end of file
@@ -1,22 +1,35 @@
 from app import db
-from app import db
+from app.models.user import User
 from datetime import datetime
 
+# 新建对话的默认标题，收到第一条消息后在后台替换（见 app/services/title_service.py）
+DEFAULT_TITLE = '新对话'
+# 截取第一条消息作为标题时的最大长度
+TRUNCATED_TITLE_CHARS = 30
+
+
+def title_from_message(content):
+    """截取消息开头作为标题"""
+    content = (content or '').strip()
+    return content[:TRUNCATED_TITLE_CHARS] + ('...' if len(content) > TRUNCATED_TITLE_CHARS else '')
+
 class Conversation(db.Model):
     """对话模型"""
     __tablename__ = 'conversations'
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    title = db.Column(db.String(200), nullable=False, default='新对话')
+    title = db.Column(db.String(200), nullable=False, default=DEFAULT_TITLE)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # 最近一次变化时用户的同步版本号，用于侧边栏增量同步
+    sync_version = db.Column(db.Integer, default=0, nullable=False, index=True)
     
     # 关系
     messages = db.relationship('Message', backref='conversation', lazy='dynamic', 
                               cascade='all, delete-orphan', order_by='Message.created_at')
     
-    def __init__(self, user_id, title='新对话'):
+    def __init__(self, user_id, title=DEFAULT_TITLE):
         self.user_id = user_id
         self.title = title
     
@@ -24,23 +37,41 @@ class Conversation(db.Model):
         """根据第一条消息自动生成标题"""
         first_message = self.messages.filter_by(role='user').first()
         if first_message and len(first_message.content) > 0:
-            # 取前30个字符作为标题
-            self.title = first_message.content[:30] + ('...' if len(first_message.content) > 30 else '')
+            self.title = title_from_message(first_message.content)
             self.updated_at = datetime.utcnow()
+            self.sync_version = User.next_sync_version(self.user_id)
             db.session.commit()
     
+    @staticmethod
+    def touch(conversation_id):
+        """标记对话已变化（有新消息等），刷新更新时间与同步版本号（不提交）
+        
+        Returns:
+            int or None: 对话所属用户ID，对话不存在时返回None
+        """
+        user_id = db.session.execute(
+            db.select(Conversation.user_id).where(Conversation.id == conversation_id)
+        ).scalar()
+        if user_id is None:
+            return None
+        version = User.next_sync_version(user_id)
+        db.session.execute(
+            db.update(Conversation).where(Conversation.id == conversation_id)
+            .values(sync_version=version, updated_at=datetime.utcnow())
+        )
+        return user_id
+    
     def get_message_count(self):
         """获取消息数量"""
         return self.messages.count()
     
     def get_last_message_time(self):
         """获取最后一条消息时间"""
-        # 直接使用关系查询，防止循环导入问题
-        messages = self.messages.all()
-        if messages:
-            return max(msg.created_at for msg in messages)
-        else:
-            return self.created_at
+        # 在数据库中聚合，避免加载整个对话的消息；函数内导入防止循环导入问题
+        from app.models.message import Message
+        last_time = db.session.query(db.func.max(Message.created_at))\
+            .filter(Message.conversation_id == self.id, *Message.partition_window(self.created_at)).scalar()
+        return last_time or self.created_at
     
     def to_dict(self):
         """转换为字典"""
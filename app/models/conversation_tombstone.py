@@ -0,0 +1,40 @@
+from app import db
+from datetime import datetime
+
+class ConversationTombstone(db.Model):
+    """对话删除记录，用于侧边栏增量同步时告知客户端哪些对话已被删除"""
+    __tablename__ = 'conversation_tombstones'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    conversation_id = db.Column(db.Integer, nullable=False)
+    sync_version = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __init__(self, user_id, conversation_id, sync_version):
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.sync_version = sync_version
+    
+    @staticmethod
+    def get_deleted_since(user_id, since):
+        """获取指定版本之后删除的对话ID列表"""
+        rows = db.session.query(ConversationTombstone.conversation_id)\
+            .filter(ConversationTombstone.user_id == user_id,
+                    ConversationTombstone.sync_version > since).all()
+        return [row.conversation_id for row in rows]
+    
+    @staticmethod
+    def prune(user_id, older_than):
+        """清理过期的删除记录（不提交），返回被清理记录中的最大版本号"""
+        expired = ConversationTombstone.query.filter(
+            ConversationTombstone.user_id == user_id,
+            ConversationTombstone.deleted_at < older_than
+        )
+        floor = expired.with_entities(db.func.max(ConversationTombstone.sync_version)).scalar()
+        if floor is not None:
+            expired.delete(synchronize_session=False)
+        return floor
+    
+    def __repr__(self):
+        return f'<ConversationTombstone {self.conversation_id}@{self.sync_version}>'
@@ -0,0 +1,143 @@
+from app import db
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+
+
+class IdempotencyConflictError(ValueError):
+    """幂等键无法登记：同一个键已用于内容不同的请求，或并发登记多次失败（retryable 为真，可重试）"""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class IdempotencyKey(db.Model):
+    """发送消息的幂等键
+
+    客户端每次发送生成一个键（请求头 Idempotency-Key）。双击、浏览器或代理重试时同一用户的
+    同一个键只执行一次：执行中的重复请求接到原来的流上，已完成的重复请求直接返回保存的结果。
+    """
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_key'),
+    )
+
+    STATUS_PENDING = 'pending'
+    STATUS_COMPLETED = 'completed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    # 请求内容摘要：同一个键用于不同的请求时拒绝
+    request_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_PENDING)
+    # 流式请求的 stream_id，重复请求据此接到原来的流上
+    stream_id = db.Column(db.String(32), nullable=True)
+    response = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __init__(self, user_id, key, request_hash, expires_at, stream_id=None):
+        self.user_id = user_id
+        self.key = key
+        self.request_hash = request_hash
+        self.expires_at = expires_at
+        self.stream_id = stream_id
+        self.status = IdempotencyKey.STATUS_PENDING
+        self.created_at = datetime.utcnow()
+
+    def to_dict(self):
+        """转换为字典"""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stream_id': self.stream_id,
+            'response': self.response
+        }
+
+    @staticmethod
+    def acquire(user_id, key, request_hash, ttl, lock_timeout, stream_id=None):
+        """登记幂等键
+
+        已过期的键，或执行方超过 lock_timeout 仍未完成（进程已退出）的键由本次请求接管。
+
+        Args:
+            ttl: 键的保留时长（timedelta）
+            lock_timeout: 执行中状态的最长时长（timedelta）
+            stream_id: 本次请求的 stream_id（流式请求）
+
+        Returns:
+            tuple: (已序列化的记录, 是否由本次请求执行)
+
+        Raises:
+            IdempotencyConflictError: 同一个键已用于内容不同的请求，或登记多次失败
+        """
+        for _ in range(3):
+            now = datetime.utcnow()
+            record = IdempotencyKey(user_id, key, request_hash, now + ttl, stream_id)
+            db.session.add(record)
+            try:
+                db.session.commit()
+                return record.to_dict(), True
+            except IntegrityError:
+                db.session.rollback()
+
+            existing = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+            if existing is None:
+                # 恰好被清理，重新登记
+                continue
+
+            abandoned = existing.status == IdempotencyKey.STATUS_PENDING and existing.created_at < now - lock_timeout
+            if existing.expires_at < now or abandoned:
+                # 按原来的创建时间条件更新，并发接管时只有一个请求成功
+                taken = IdempotencyKey.query.filter_by(id=existing.id, created_at=existing.created_at).update({
+                    'request_hash': request_hash,
+                    'status': IdempotencyKey.STATUS_PENDING,
+                    'stream_id': stream_id,
+                    'response': None,
+                    'created_at': now,
+                    'expires_at': now + ttl
+                }, synchronize_session=False)
+                db.session.commit()
+                if taken:
+                    return {'id': existing.id, 'status': IdempotencyKey.STATUS_PENDING,
+                            'stream_id': stream_id, 'response': None}, True
+                continue
+
+            if existing.request_hash != request_hash:
+                raise IdempotencyConflictError('Idempotency-Key 已用于其他请求')
+            return existing.to_dict(), False
+        raise IdempotencyConflictError('Idempotency-Key 登记失败，请重试', retryable=True)
+
+    @staticmethod
+    def get_record(record_id):
+        """读取记录，不存在时返回None"""
+        record = db.session.get(IdempotencyKey, record_id)
+        return record.to_dict() if record is not None else None
+
+    @staticmethod
+    def complete(record_id, response):
+        """保存执行结果"""
+        IdempotencyKey.query.filter_by(id=record_id).update({
+            'status': IdempotencyKey.STATUS_COMPLETED,
+            'response': response
+        }, synchronize_session=False)
+        db.session.commit()
+
+    @staticmethod
+    def release(record_id):
+        """执行失败时删除记录，之后使用同一个键的重试会重新执行"""
+        IdempotencyKey.query.filter_by(id=record_id).delete(synchronize_session=False)
+        db.session.commit()
+
+    @staticmethod
+    def prune(now=None):
+        """清理已过期的键，返回清理条数"""
+        count = IdempotencyKey.query.filter(
+            IdempotencyKey.expires_at < (now or datetime.utcnow())
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return count
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.user_id}:{self.key} {self.status}>'
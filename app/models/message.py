@@ -1,21 +1,70 @@
 from app import db
-from app import db
-from datetime import datetime
+from app.models.config_model import Config
+from app.models.conversation import Conversation
+from app.models.types import CompressedText
+from app.models.usage_daily import UsageDaily
+from app.utils.markdown import render_markdown, RENDER_VERSION
+from app.utils.text_compression import text_compressor
+from datetime import datetime, timedelta
+from flask import current_app
+import html
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 按对话创建时间限定消息 created_at 下界时留出的余量，容忍多实例之间的时钟偏差
+PARTITION_WINDOW_MARGIN = timedelta(days=1)
+# 压缩旧消息的进度（已检查到的消息ID），保存在 configs 表中
+COMPRESS_CURSOR_KEY = 'message_compression_cursor'
+
+def _render_html(content):
+    """渲染AI回复；渲染器出错时退回转义后的纯文本，不影响保存回复与读取消息"""
+    try:
+        return render_markdown(content)
+    except Exception:
+        logger.exception("渲染消息失败，按纯文本显示: 长度=%d", len(content))
+        return '<p>%s</p>' % html.escape(content, quote=False).replace('\n', '<br>\n')
+
 
 class Message(db.Model):
     """消息模型"""
     __tablename__ = 'messages'
     
     id = db.Column(db.Integer, primary_key=True)
-    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False, index=True)
     role = db.Column(db.String(20), nullable=False)  # 'user' 或 'assistant'
-    content = db.Column(db.Text, nullable=False)
+    # 超过阈值的正文压缩存储，读写时透明编解码，见 app/utils/text_compression.py
+    content = db.Column(CompressedText, nullable=False)
+    # AI回复的各阶段耗时（毫秒），来自请求链路追踪，见 app/utils/tracing.py
+    timings = db.Column(db.JSON, nullable=True)
+    # 回复状态：complete 正常完成；cancelled 用户停止或连接断开；error 上游出错时保存的部分内容
+    status = db.Column(db.String(20), nullable=False, default='complete', server_default='complete')
+    # AI回复的用量：token 数（上游返回或本地估算）、模型、上游耗时（毫秒）、发送端点（send / send-stream）
+    # 与来源（upstream 上游返回 / estimate 本地估算 / cache 命中语义缓存）；用户消息为空
+    prompt_tokens = db.Column(db.Integer, nullable=True)
+    completion_tokens = db.Column(db.Integer, nullable=True)
+    model = db.Column(db.String(100), nullable=True)
+    upstream_ms = db.Column(db.Integer, nullable=True)
+    endpoint = db.Column(db.String(20), nullable=True)
+    usage_source = db.Column(db.String(10), nullable=True)
+    # AI回复渲染后的 HTML 与渲染器版本（见 app/utils/markdown.py），保存时渲染；用户消息为空
+    content_html = db.Column(CompressedText, nullable=True)
+    render_version = db.Column(db.SmallInteger, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    def __init__(self, conversation_id, role, content):
+    def __init__(self, conversation_id, role, content, timings=None, status='complete', usage=None):
         self.conversation_id = conversation_id
         self.role = role
         self.content = content
+        self.timings = timings
+        self.status = status
+        if usage:
+            self.prompt_tokens = usage.get('prompt_tokens')
+            self.completion_tokens = usage.get('completion_tokens')
+            self.model = usage.get('model')
+            self.upstream_ms = usage.get('upstream_ms')
+            self.endpoint = usage.get('endpoint')
+            self.usage_source = usage.get('source')
     
     def to_dict(self):
         """转换为字典"""
@@ -23,34 +72,193 @@ class Message(db.Model):
             'id': self.id,
             'role': self.role,
             'content': self.content,
+            'content_html': self.rendered_html(),
+            'status': self.status or 'complete',
             'created_at': self.created_at.isoformat()
         }
     
+    @property
+    def render_stale(self):
+        """AI回复尚未渲染或渲染器版本已更新"""
+        return self.role == 'assistant' and self.render_version != RENDER_VERSION
+    
+    def render(self):
+        """渲染AI回复并记录渲染器版本（随会话提交）"""
+        self.content_html = _render_html(self.content)
+        self.render_version = RENDER_VERSION
+    
+    def rendered_html(self):
+        """AI回复的 HTML，用户消息返回None
+        
+        版本落后时即时渲染但不修改对象（读取接口不提交会话），由调用方提交后台任务写回，见 render_stored。
+        """
+        if self.role != 'assistant':
+            return None
+        if self.render_stale:
+            return _render_html(self.content)
+        return self.content_html
+    
+    def usage_dict(self):
+        """用量信息（管理后台显示），没有记录用量时返回None"""
+        if self.usage_source is None:
+            return None
+        return {
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'model': self.model,
+            'upstream_ms': self.upstream_ms,
+            'endpoint': self.endpoint,
+            'source': self.usage_source
+        }
+    
     @staticmethod
-    def get_conversation_messages(conversation_id, limit=None):
-        """获取对话的消息列表"""
-        query = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.created_at)
+    def partition_window(since):
+        """对话消息的 created_at 下界条件（since 为对话创建时间）
+        
+        消息表按月分区（MESSAGES_PARTITIONING，见 app/utils/partitioning.py）时，
+        加上该条件的查询只扫描对话创建之后的分区；未启用分区时为空，不改变查询。
+        """
+        if since is None or not current_app.config['MESSAGES_PARTITIONING']:
+            return ()
+        return (Message.created_at >= since - PARTITION_WINDOW_MARGIN,)
+    
+    @staticmethod
+    def get_conversation_messages(conversation_id, limit=None, since=None):
+        """获取对话的消息列表（since 为对话创建时间，见 partition_window）"""
+        query = Message.query.filter(Message.conversation_id == conversation_id,
+                                     *Message.partition_window(since)).order_by(Message.created_at)
         if limit:
             query = query.limit(limit)
         return query.all()
     
     @staticmethod
-    def create_message(conversation_id, role, content):
-        """创建新消息"""
-        try:
-            from flask import current_app
-            current_app.logger.info(f"创建消息: conversation_id={conversation_id}, role={role}, content_length={len(content)}")
+    def get_message_page(conversation_id, before=None, limit=50, since=None):
+        """按游标分页获取消息，从最新的一页开始
+        
+        Args:
+            conversation_id: 对话ID
+            before: 游标，只返回ID小于该值的消息；为None时返回最新一页
+            limit: 每页条数
+            since: 对话创建时间（可选），见 partition_window
             
-            message = Message(conversation_id=conversation_id, role=role, content=content)
+        Returns:
+            tuple: (按时间正序排列的消息列表, 是否还有更早的消息)
+        """
+        query = Message.query.filter(Message.conversation_id == conversation_id,
+                                     *Message.partition_window(since))
+        if before is not None:
+            query = query.filter(Message.id < before)
+        # 多取一条用于判断是否还有更早的消息
+        rows = query.order_by(Message.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        messages = rows[:limit]
+        messages.reverse()
+        return messages, has_more
+    
+    @staticmethod
+    def create_message(conversation_id, role, content, timings=None, status='complete', usage=None):
+        """创建新消息
+        
+        传入 usage（见 UsageService.complete）时同时在同一事务中累加当天的用量汇总。
+        """
+        try:
+            message = Message(conversation_id=conversation_id, role=role, content=content,
+                              timings=timings, status=status, usage=usage)
+            if role == 'assistant':
+                message.render()
             db.session.add(message)
+            
+            # 新消息会改变侧边栏中的消息数和最后消息时间
+            user_id = Conversation.touch(conversation_id)
+            if usage and user_id is not None:
+                UsageDaily.record(user_id, usage)
             db.session.commit()
             
-            current_app.logger.info(f"消息创建成功: message_id={message.id}")
+            logger.debug("消息已保存: message_id=%s, role=%s, 长度=%d", message.id, role, len(content))
             return message
         except Exception as e:
-            current_app.logger.error(f"创建消息失败: {str(e)}", exc_info=True)
+            logger.error("创建消息失败: conversation_id=%s, %s", conversation_id, e, exc_info=True)
             db.session.rollback()
             raise
     
+    @staticmethod
+    def delete_conversation_messages(conversation_id, since=None):
+        """批量删除对话的全部消息（不提交）
+        
+        删除对话前调用，避免级联删除逐条加载并按ID删除消息（分区表上每条都要探查所有分区）。
+        """
+        db.session.execute(
+            db.delete(Message).where(Message.conversation_id == conversation_id,
+                                     *Message.partition_window(since))
+            .execution_options(synchronize_session=False)
+        )
+    
+    @staticmethod
+    def compress_stored(batch_size=500, max_batches=None, restart=False):
+        """压缩已存储但未压缩的长消息（启用压缩之前或调低阈值之前写入的），从上次检查到的位置继续
+        
+        每批一个事务，进度保存在 configs 表中，可以随时中断；新消息写入时已按当前配置压缩。
+        
+        Args:
+            batch_size: 每批检查的消息数
+            max_batches: 本次最多处理的批数，None 表示直到最新的消息
+            restart: 从头重新检查（修改阈值或编码后使用）
+            
+        Returns:
+            tuple: (检查的消息数, 压缩的消息数, 是否已检查到最新的消息)
+        """
+        if not text_compressor.enabled:
+            return 0, 0, True
+        
+        table = Message.__table__
+        # 按原始存储值读取，不经过解压
+        stored_content = db.type_coerce(table.c.content, db.LargeBinary)
+        update = db.update(table).where(table.c.id == db.bindparam('message_id'))\
+            .values(content=db.bindparam('text'))
+        cursor = 0 if restart else int(Config.get_value(COMPRESS_CURSOR_KEY) or 0)
+        scanned = compressed = batches = 0
+        
+        while max_batches is None or batches < max_batches:
+            rows = db.session.execute(
+                db.select(table.c.id, stored_content).where(table.c.id > cursor)
+                .order_by(table.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                return scanned, compressed, True
+            
+            pending = []
+            for message_id, stored in rows:
+                if stored is None or text_compressor.is_compressed(stored):
+                    continue
+                text = text_compressor.decode(stored)
+                if len(text.encode('utf-8')) >= text_compressor.min_bytes:
+                    pending.append({'message_id': message_id, 'text': text})
+            if pending:
+                db.session.execute(update, pending)
+            
+            cursor = rows[-1][0]
+            # 与本批的更新在同一事务中提交
+            Config.set_value(COMPRESS_CURSOR_KEY, str(cursor), '压缩旧消息的进度（消息ID）')
+            scanned += len(rows)
+            compressed += len(pending)
+            batches += 1
+            if len(rows) < batch_size:
+                return scanned, compressed, True
+        return scanned, compressed, False
+    
+    @staticmethod
+    def render_stored(message_ids):
+        """重新渲染并保存版本落后的AI回复（读取时发现的，见 rendered_html）
+        
+        Returns:
+            int: 重新渲染的消息数
+        """
+        messages = Message.query.filter(Message.id.in_(message_ids), Message.role == 'assistant').all()
+        stale = [message for message in messages if message.render_stale]
+        for message in stale:
+            message.render()
+        db.session.commit()
+        return len(stale)
+    
     def __repr__(self):
         return f'<Message {self.id}: {self.role}>'
\ No newline at end of file
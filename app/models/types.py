@@ -0,0 +1,23 @@
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+from app.utils.text_compression import text_compressor
+
+
+class CompressedText(TypeDecorator):
+    """按长度透明压缩的文本列
+
+    Python 侧始终是 str，数据库中为二进制列（PostgreSQL bytea、SQLite BLOB），
+    编码格式见 app/utils/text_compression.py。不能在 SQL 中按内容比较或搜索。
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return text_compressor.encode(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return text_compressor.decode(value)
@@ -0,0 +1,82 @@
+from app import db
+from datetime import datetime
+from sqlalchemy.dialects import postgresql, sqlite
+
+class UsageDaily(db.Model):
+    """按天（UTC）、用户与模型汇总的用量
+
+    每保存一条带用量的AI回复就在同一事务中累加一行，管理后台的按天/按用户统计与
+    每日配额检查只读本表，不扫描消息表。用户ID不设外键：删除用户后保留历史用量。
+    """
+    __tablename__ = 'usage_daily'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'user_id', 'model', name='uq_usage_daily_day_user_model'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    model = db.Column(db.String(100), nullable=False, default='')
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    completion_tokens = db.Column(db.BigInteger, nullable=False, default=0)
+    # 其中用量为本地估算的请求数、命中语义缓存（不计 token）的请求数
+    estimated_requests = db.Column(db.Integer, nullable=False, default=0)
+    cached_requests = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def increments(usage):
+        """一次请求对各计数列的增量"""
+        cached = usage.get('source') == 'cache'
+        return {
+            'requests': 1,
+            'prompt_tokens': 0 if cached else usage.get('prompt_tokens') or 0,
+            'completion_tokens': 0 if cached else usage.get('completion_tokens') or 0,
+            'estimated_requests': 1 if usage.get('source') == 'estimate' else 0,
+            'cached_requests': 1 if cached else 0
+        }
+
+    @staticmethod
+    def record(user_id, usage, day=None):
+        """累加一次请求的用量（不提交，随调用方的事务一起提交）
+
+        PostgreSQL 与 SQLite 使用 INSERT ... ON CONFLICT DO UPDATE 一条语句完成；
+        其他数据库先 UPDATE，没有对应行时再 INSERT。
+        """
+        key = {
+            'day': day or datetime.utcnow().date(),
+            'user_id': user_id,
+            'model': (usage.get('model') or '')[:100]
+        }
+        values = UsageDaily.increments(usage)
+        table = UsageDaily.__table__
+        dialect = db.session.get_bind().dialect.name
+
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            stmt = insert(table).values(**key, **values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['day', 'user_id', 'model'],
+                set_={name: table.c[name] + stmt.excluded[name] for name in values}
+            )
+            db.session.execute(stmt)
+            return
+
+        updated = db.session.execute(
+            db.update(table).where(*(table.c[name] == value for name, value in key.items()))
+            .values({name: table.c[name] + value for name, value in values.items()})
+        ).rowcount
+        if not updated:
+            db.session.execute(table.insert().values(**key, **values))
+
+    @staticmethod
+    def totals(user_id, day):
+        """用户某一天的请求数与 token 数（所有模型合计）"""
+        row = db.session.query(
+            db.func.coalesce(db.func.sum(UsageDaily.requests), 0),
+            db.func.coalesce(db.func.sum(UsageDaily.prompt_tokens + UsageDaily.completion_tokens), 0)
+        ).filter(UsageDaily.day == day, UsageDaily.user_id == user_id).one()
+        return {'requests': int(row[0]), 'tokens': int(row[1])}
+
+    def __repr__(self):
+        return f'<UsageDaily {self.day} user={self.user_id} model={self.model}>'
@@ -2,9 +2,13 @@ from app import db, login_manager
 from app import db, login_manager
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from app.utils.tasks import background
+from datetime import datetime, timedelta
 import uuid
 
+# 最后活跃时间的精度：距上次记录不足该时长时不再写入
+LAST_ACTIVE_RESOLUTION = timedelta(seconds=60)
+
 class User(UserMixin, db.Model):
     """用户模型"""
     __tablename__ = 'users'
@@ -16,6 +20,10 @@ class User(UserMixin, db.Model):
     is_admin = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_active = db.Column(db.DateTime, default=datetime.utcnow)
+    # 侧边栏同步版本号：用户的任意对话发生变化时递增
+    sync_version = db.Column(db.Integer, default=0, nullable=False)
+    # 早于该版本的删除记录已被清理，更早的增量请求需要全量同步
+    sync_floor = db.Column(db.Integer, default=0, nullable=False)
     
     # 关系
     conversations = db.relationship('Conversation', backref='user', lazy='dynamic', cascade='all, delete-orphan')
@@ -37,9 +45,25 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
     
     def update_last_active(self):
-        """更新最后活跃时间"""
-        self.last_active = datetime.utcnow()
-        db.session.commit()
+        """更新最后活跃时间
+        
+        在后台任务中写入，不在请求线程中提交；同一用户的重复提交会被合并，
+        距上次记录不足 LAST_ACTIVE_RESOLUTION 时直接跳过。
+        """
+        if self.last_active and datetime.utcnow() - self.last_active < LAST_ACTIVE_RESOLUTION:
+            return
+        background.submit('user.touch', (self.id,), key='user.touch:%d' % self.id)
+    
+    @staticmethod
+    def next_sync_version(user_id):
+        """递增并返回用户的同步版本号（不提交，随调用方的事务一起提交）"""
+        db.session.execute(
+            db.update(User).where(User.id == user_id)
+            .values(sync_version=User.sync_version + 1)
+        )
+        return db.session.execute(
+            db.select(User.sync_version).where(User.id == user_id)
+        ).scalar()
     
     @staticmethod
     def get_or_create_by_session(session_id):
@@ -56,6 +80,14 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username or self.session_id}>'
 
+@background.task('user.touch')
+def touch_user_task(user_id):
+    """后台任务：记录用户最后活跃时间"""
+    db.session.execute(
+        db.update(User).where(User.id == user_id).values(last_active=datetime.utcnow())
+    )
+    db.session.commit()
+
 @login_manager.user_loader
 def load_user(user_id):
     """Flask-Login 用户加载器"""
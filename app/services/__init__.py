@@ -2,5 +2,8 @@
 from .api_service import api_service, APIService
 from .chat_service import ChatService
 from .user_service import UserService
+from .title_service import title_service, TitleService
+from .usage_service import UsageService, QuotaExceededError
 
-__all__ = ['api_service', 'APIService', 'ChatService', 'UserService']
\ No newline at end of file
+__all__ = ['api_service', 'APIService', 'ChatService', 'UserService', 'title_service', 'TitleService',
+           'UsageService', 'QuotaExceededError']
\ No newline at end of file
@@ -1,7 +1,46 @@
 import requests
 import json
+import logging
+import socket
+import time
 from flask import current_app
 from app.models.config_model import Config
+from app.utils.sse import iter_sse_payloads, extract_delta_content, extract_usage
+from app.utils import tracing
+from app.utils.semantic_cache import semantic_cache
+
+logger = logging.getLogger(__name__)
+
+# 语义缓存命中时按该长度切分缓存的回答，以流式事件输出
+CACHED_CHUNK_CHARS = 16
+
+
+class UpstreamAborted(Exception):
+    """上游流式响应已被调用方断开（停止生成、客户端断开、排空）"""
+
+
+class _ResponseAbort:
+    """立即断开流式上游响应，可在任意线程中调用
+
+    读取线程可能正阻塞在套接字上：只关闭响应不会唤醒它，先 shutdown 套接字使阻塞中的读取
+    立即结束，响应由生成器在自己的线程中关闭。
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.aborted = False
+
+    def __call__(self):
+        if self.aborted:
+            return
+        self.aborted = True
+        connection = getattr(self.response.raw, '_connection', None)
+        sock = getattr(connection, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
 class APIService:
     """API服务类，处理与大模型的交互"""
@@ -9,6 +48,15 @@ class APIService:
     def __init__(self):
         self.session = requests.Session()
     
+    def reset_session(self):
+        """重建 HTTP 会话
+        
+        gunicorn --preload 时模块在主进程中导入，fork 出的 worker 不应共用
+        主进程中的连接，由 gunicorn.conf.py 的 post_fork 钩子调用。
+        """
+        self.session.close()
+        self.session = requests.Session()
+    
     def get_api_config(self):
         """获取API配置"""
         # 优先从数据库获取配置，否则使用应用配置
@@ -22,21 +70,33 @@ class APIService:
         
         return config
     
-    def send_chat_request(self, messages, stream=False):
+    def send_chat_request(self, messages, stream=False, config=None, options=None, cacheable=False, usage=None,
+                          abort_hooks=None):
         """
         发送聊天请求到API
         
         Args:
             messages: 消息列表，格式为 [{"role": "user", "content": "..."}]
             stream: 是否使用流式响应
+            config: 预先读取的API配置（可选），传入后不再访问数据库
+            options: 覆盖默认请求参数（如 temperature、max_tokens）
+            cacheable: 是否使用语义缓存（仅对新对话第一条消息生效，见 app/utils/semantic_cache.py）
+            usage: 用于接收用量的字典（可选）。写入 model；上游返回用量时写入 prompt_tokens、
+                completion_tokens；实际请求上游时写入 upstream_ms；命中语义缓存时 source 为 cache。
+                流式请求在生成器结束（或被关闭）时才写入
+            abort_hooks: 列表（可选）。流式请求上游时追加一个可在任意线程中调用的函数，
+                调用后立即断开上游连接，阻塞中的读取随之结束（生成器抛出 UpstreamAborted）
             
         Returns:
             dict or generator: API响应结果或流式生成器
         """
-        config = self.get_api_config()
+        if config is None:
+            config = self.get_api_config()
+        if usage is not None:
+            usage['model'] = config['model']
         
         if not config['api_key']:
-            current_app.logger.warning("模拟流式输出：API密钥未配置")
+            logger.warning("API密钥未配置，返回模拟回复")
             # 返回模拟流式生成器，传入None作为响应
             if stream:
                 return self._stream_response_generator(None)
@@ -50,6 +110,22 @@ class APIService:
                     }]
                 }
         
+        # 自定义请求参数时回答可能不同，不使用缓存
+        cacheable = cacheable and not options and semantic_cache.enabled
+        if cacheable:
+            with tracing.span('semantic_cache.lookup') as cache_span:
+                cached = semantic_cache.lookup(messages, config['model'])
+                cache_span.set('hit', cached is not None)
+            if cached is not None:
+                if usage is not None:
+                    usage['source'] = 'cache'
+                if stream:
+                    return self._cached_stream_generator(cached)
+                return {
+                    'choices': [{'message': {'role': 'assistant', 'content': cached}}],
+                    'cached': True
+                }
+        
         headers = {
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {config["api_key"]}'
@@ -62,44 +138,71 @@ class APIService:
             'temperature': 0.7,
             'max_tokens': 2000
         }
+        if stream and current_app.config['UPSTREAM_STREAM_USAGE']:
+            # 请求在流的最后一个事件中返回用量
+            payload['stream_options'] = {'include_usage': True}
+        if options:
+            payload.update(options)
         
+        started = time.perf_counter()
         try:
-            response = self.session.post(
-                config['api_url'],
-                headers=headers,
-                json=payload,
-                timeout=60,  # 增加超时时间到60秒
-                stream=stream
-            )
-            response.raise_for_status()
-            
-            if stream:
-                return self._stream_response_generator(response)
-            else:
-                return response.json()
+            # 流式请求只统计到收到响应头为止，生成阶段由调用方的 upstream.stream span 统计
+            with tracing.span('upstream.request', tracing.KIND_CLIENT, model=config['model'], stream=stream) as request_span:
+                response = self.session.post(
+                    config['api_url'],
+                    headers=headers,
+                    json=payload,
+                    timeout=60,  # 增加超时时间到60秒
+                    stream=stream
+                )
+                request_span.set('http.status_code', response.status_code)
+                response.raise_for_status()
+                
+                if stream:
+                    abort = _ResponseAbort(response)
+                    if abort_hooks is not None:
+                        abort_hooks.append(abort)
+                    generator = self._stream_response_generator(response, usage, started, abort)
+                    if cacheable:
+                        return self._caching_stream_generator(generator, messages, config['model'])
+                    return generator
+                else:
+                    result = response.json()
+                    if usage is not None:
+                        usage['upstream_ms'] = int((time.perf_counter() - started) * 1000)
+                        usage.update(extract_usage(result) or {})
+                    if cacheable:
+                        try:
+                            semantic_cache.store(messages, config['model'], result['choices'][0]['message']['content'])
+                        except (KeyError, IndexError, TypeError):
+                            pass
+                    return result
                 
         except requests.exceptions.Timeout as e:
-            current_app.logger.error(f"API请求超时: {str(e)}")
+            logger.error("API请求超时: %s", e)
             raise Exception("API请求超时，请稍后重试")
         except requests.exceptions.ConnectionError as e:
-            current_app.logger.error(f"API连接失败: {str(e)}")
+            logger.error("API连接失败: %s", e)
             raise Exception("无法连接到API服务，请检查网络连接")
         except requests.exceptions.RequestException as e:
-            current_app.logger.error(f"API请求失败: {str(e)}")
+            logger.error("API请求失败: %s", e)
             raise Exception(f"API请求失败: {str(e)}")
         except json.JSONDecodeError as e:
-            current_app.logger.error(f"API响应解析失败: {str(e)}")
+            logger.error("API响应解析失败: %s", e)
             raise Exception("API响应格式错误")
     
-    def _stream_response_generator(self, response):
-        """生成流式响应数据"""
+    def _stream_response_generator(self, response, usage=None, started=None, abort=None):
+        """生成流式响应数据
+        
+        传入 usage 时记录最后一个带用量的事件，正常结束后解析写入；
+        结束或被关闭时写入从发出请求起的上游耗时。被 abort 断开时抛出 UpstreamAborted。
+        """
+        usage_payload = None
         try:
-            current_app.logger.info("开始处理流式响应")
             chunk_count = 0
             
             # 如果没有response，使用模拟数据
             if response is None:
-                current_app.logger.warning("API密钥未配置，使用模拟数据")
                 # 模拟流式输出数据用于测试
                 demo_chunks = [
                     "您好！",
@@ -114,76 +217,81 @@ class APIService:
                     "我可以",
                     "帮助您的吗？"
                 ]
-                import time
                 for chunk in demo_chunks:
                     time.sleep(0.1)  # 模拟网络延迟
                     yield chunk
                 return
             
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    current_app.logger.debug(f"收到原始行: {line}")
-                    
-                    if line.startswith('data: '):
-                        data = line[6:]  # 移除 'data: ' 前缀
-                        if data.strip() == '[DONE]':
-                            current_app.logger.info("收到结束标记")
-                            break
-                        
-                        try:
-                            chunk = json.loads(data)
-                            current_app.logger.debug(f"解析的chunk: {chunk}")
-                            
-                            # 尝试不同的响应格式
-                            content = None
-                            
-                            # OpenAI格式
-                            if 'choices' in chunk:
-                                delta = chunk.get('choices', [{}])[0].get('delta', {})
-                                content = delta.get('content')
-                            
-                            # 硅基流动格式（可能直接包含content）
-                            elif 'content' in chunk:
-                                content = chunk.get('content')
-                            
-                            # 其他可能的格式
-                            elif 'text' in chunk:
-                                content = chunk.get('text')
-                            
-                            if content:
-                                chunk_count += 1
-                                current_app.logger.debug(f"第{chunk_count}个chunk: {content}")
-                                yield content
-                            
-                        except json.JSONDecodeError as e:
-                            current_app.logger.warning(f"JSON解析失败: {e}, 数据: {data}")
-                            continue
-                            
-            current_app.logger.info(f"流式响应处理完成，总共处理了 {chunk_count} 个chunk")
+            debug_enabled = logger.isEnabledFor(logging.DEBUG)
+            
+            # 直接消费原始字节块，由增量解码器切分事件，避免逐行解码
+            for payload in iter_sse_payloads(response.iter_content(chunk_size=None)):
+                if debug_enabled:
+                    logger.debug("收到SSE事件: %r", payload)
+                if usage is not None and b'"usage"' in payload:
+                    usage_payload = payload
+                
+                try:
+                    content = extract_delta_content(payload)
+                except ValueError as e:
+                    logger.warning("JSON解析失败: %s, 数据: %r", e, payload)
+                    continue
+                
+                if content:
+                    chunk_count += 1
+                    if debug_enabled:
+                        logger.debug("第%d个chunk: %s", chunk_count, content)
+                    yield content
+            
+            logger.debug("上游流式响应处理完成，共 %d 个chunk", chunk_count)
+            if usage_payload is not None:
+                usage.update(extract_usage(usage_payload) or {})
             
         except Exception as e:
-            current_app.logger.error(f"流式响应处理失败: {str(e)}", exc_info=True)
+            if abort is not None and abort.aborted:
+                # 调用方已断开上游，读取中断是预期的；抛出异常使语义缓存不保存不完整的回答
+                raise UpstreamAborted() from None
+            logger.error("流式响应处理失败: %s", e, exc_info=True)
             raise Exception(f"响应处理失败: {str(e)}")
+        finally:
+            # 正常结束、出错或被调用方提前关闭（停止生成）时都立即断开上游连接，
+            # 上游随之停止生成，不再消耗 token
+            if response is not None:
+                response.close()
+                if usage is not None and started is not None:
+                    usage['upstream_ms'] = int((time.perf_counter() - started) * 1000)
+    
+    def _cached_stream_generator(self, content):
+        """以流式块输出语义缓存中的回答"""
+        for start in range(0, len(content), CACHED_CHUNK_CHARS):
+            yield content[start:start + CACHED_CHUNK_CHARS]
+    
+    def _caching_stream_generator(self, generator, messages, model):
+        """透传上游流式块，完整结束后把回答写入语义缓存
+        
+        出错或被提前关闭（停止生成、客户端断开）时不缓存，并同时关闭上游生成器。
+        """
+        parts = []
+        try:
+            for chunk in generator:
+                parts.append(chunk)
+                yield chunk
+            semantic_cache.store(messages, model, ''.join(parts))
+        finally:
+            generator.close()
     
     def _handle_stream_response(self, response):
         """处理流式响应（遗留用于兼容性）"""
         try:
-            content = ""
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        data = line[6:]  # 移除 'data: ' 前缀
-                        if data.strip() == '[DONE]':
-                            break
-                        try:
-                            chunk = json.loads(data)
-                            delta = chunk.get('choices', [{}])[0].get('delta', {})
-                            if 'content' in delta:
-                                content += delta['content']
-                        except json.JSONDecodeError:
-                            continue
+            parts = []
+            for payload in iter_sse_payloads(response.iter_content(chunk_size=None)):
+                try:
+                    delta_content = extract_delta_content(payload)
+                except ValueError:
+                    continue
+                if delta_content:
+                    parts.append(delta_content)
+            content = ''.join(parts)
             
             return {
                 'choices': [{
@@ -194,7 +302,7 @@ class APIService:
                 }]
             }
         except Exception as e:
-            current_app.logger.error(f"流式响应处理失败: {str(e)}")
+            logger.error("流式响应处理失败: %s", e)
             raise Exception(f"响应处理失败: {str(e)}")
     
     def test_connection(self, api_url=None, api_key=None, model=None):
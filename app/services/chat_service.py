@@ -1,39 +1,145 @@
 from app import db
-from app import db
-from app.models import User, Conversation, Message
+from app.models import User, Conversation, Message, ConversationTombstone, IdempotencyKey, IdempotencyConflictError
+from app.models.conversation import DEFAULT_TITLE
 from app.services.api_service import api_service
+from app.services.title_service import title_service
+from app.services.usage_service import UsageService
+from app.utils.sse import ChunkCoalescer, encode_event, chunk_event, DONE_FRAME
+from app.utils.markdown import MarkdownStream
+from app.utils.streams import streams, record_completed, record_stopped, REASON_DISCONNECTED, KEEPALIVE_FRAME
+from app.utils.metrics import metrics
+from app.utils import tracing, partitioning
+from app.utils.tracing import traced
+from app.utils.tasks import background
+from app.utils.text_compression import text_compressor
 from flask import session, current_app
 import uuid
-import json
-from datetime import datetime
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# 重复请求等待原请求完成时查询结果的间隔（秒）
+IDEMPOTENCY_POLL_INTERVAL = 1.0
+# 清理过期幂等键的最短间隔（秒，每个进程）
+IDEMPOTENCY_PRUNE_INTERVAL = 60
+_last_idempotency_prune = 0.0
+# 消息表维护任务（提前创建未来月份的分区、压缩旧消息）的最短提交间隔（秒，每个进程）
+MAINTENANCE_INTERVAL = 3600
+_last_maintenance = 0.0
+# 压缩旧消息的后台任务每次最多处理的批数，未完成时重新提交自身
+COMPRESS_BATCHES_PER_TASK = 20
+
+# 会话中记录已创建用户ID的键
+SESSION_USER_KEY = 'chat_user_id'
+
+# 重放时的 ai_start 帧内容固定，预先编码
+_REPLAYED_AI_START = encode_event({
+    'type': 'ai_start',
+    'trace_id': None,
+    'replayed': True
+})
+
+
+def _request_hash(endpoint, conversation_id, user_message):
+    """幂等键对应的请求摘要"""
+    text = f'{endpoint}\n{conversation_id}\n{user_message}'
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _replay_frames(response):
+    """把已完成请求保存的结果重放为一次完整的流式响应"""
+    yield encode_event({
+        'type': 'user_message',
+        'message': response['user_message']
+    })
+    yield _REPLAYED_AI_START
+    ai_message = response.get('ai_message')
+    if ai_message and ai_message['content']:
+        yield chunk_event(ai_message['content'])
+    yield encode_event({
+        'type': 'ai_complete',
+        'message': ai_message,
+        'status': response.get('status', 'complete'),
+        'trace_id': None,
+        'title_pending': False,
+        'replayed': True
+    })
+    yield DONE_FRAME
+
+
+def _title_event(conversation_id):
+    """本进程内已为该对话生成标题时返回 title 事件，否则返回None"""
+    title = title_service.take_published(conversation_id)
+    if title is None:
+        return None
+    return encode_event({
+        'type': 'title',
+        'conversation_id': conversation_id,
+        'title': title
+    })
+
 
 class ChatService:
     """聊天服务类，处理对话相关的业务逻辑"""
     
+    @staticmethod
+    @traced('chat.get_user')
+    def get_current_user():
+        """获取当前会话对应的用户，不创建用户
+        
+        会话中没有用户时直接返回None、不访问数据库：只浏览的访问者、爬虫与健康检查
+        不会在 users 表中留下记录。用户在第一次写操作（新建对话、发送消息）时才创建。
+        """
+        user_id = session.get(SESSION_USER_KEY)
+        if user_id is not None:
+            user = db.session.get(User, user_id)
+        elif 'session_id' in session:
+            # 旧版本的会话只记录了 session_id
+            user = User.query.filter_by(session_id=session['session_id']).first()
+        else:
+            return None
+        
+        if user is not None and user.session_id != session.get('session_id'):
+            # 会话中的用户ID已属于其他用户：原用户被删除后，SQLite 会把被删除的最大 rowid 分配给新用户
+            logger.warning("会话中的用户ID %s 不属于当前会话，按新访问者处理", user_id)
+            user = None
+        if user is None:
+            # 用户已被清理（见 flask prune-users）或已被删除
+            session.pop(SESSION_USER_KEY, None)
+            return None
+        if user_id != user.id:
+            session[SESSION_USER_KEY] = user.id
+        user.update_last_active()
+        return user
+    
     @staticmethod
     def get_or_create_user():
-        """获取或创建当前用户"""
+        """获取或创建当前用户（仅用于写操作）"""
         try:
+            user = ChatService.get_current_user()
+            if user is not None:
+                return user
+            
             # 从session中获取用户ID，如果没有则创建新的会话ID
             if 'session_id' not in session:
                 session['session_id'] = str(uuid.uuid4())
-                current_app.logger.info(f"创建新的session_id: {session['session_id']}")
-            
-            session_id = session['session_id']
-            current_app.logger.info(f"使用session_id: {session_id}")
-            
-            user = User.get_or_create_by_session(session_id)
-            current_app.logger.info(f"用户创建/获取成功: {user.id}")
+                logger.debug("创建新的session_id")
             
+            user = User.get_or_create_by_session(session['session_id'])
+            session[SESSION_USER_KEY] = user.id
             return user
         except Exception as e:
-            current_app.logger.error(f"获取或创建用户失败: {str(e)}", exc_info=True)
+            logger.error("获取或创建用户失败: %s", e, exc_info=True)
             raise
     
     @staticmethod
-    def create_conversation(user_id, title='新对话'):
+    def create_conversation(user_id, title=DEFAULT_TITLE):
         """创建新对话"""
         conversation = Conversation(user_id=user_id, title=title)
+        conversation.sync_version = User.next_sync_version(user_id)
         db.session.add(conversation)
         db.session.commit()
         return conversation
@@ -46,20 +152,80 @@ class ChatService:
             .limit(limit).all()
         return conversations
     
+    @staticmethod
+    def serialize_conversations(conversations):
+        """批量序列化对话列表
+        
+        与逐个调用 to_dict() 的结果相同，但消息数和最后消息时间
+        通过一次分组聚合查询得到，而不是每个对话各查两次。
+        """
+        if not conversations:
+            return []
+        
+        ids = [conv.id for conv in conversations]
+        since = min((conv.created_at for conv in conversations if conv.created_at), default=None)
+        rows = db.session.query(
+            Message.conversation_id,
+            db.func.count(Message.id),
+            db.func.max(Message.created_at)
+        ).filter(Message.conversation_id.in_(ids), *Message.partition_window(since))\
+            .group_by(Message.conversation_id).all()
+        stats = {row[0]: (row[1], row[2]) for row in rows}
+        
+        result = []
+        for conv in conversations:
+            message_count, last_message_time = stats.get(conv.id, (0, None))
+            result.append({
+                'id': conv.id,
+                'title': conv.title,
+                'message_count': message_count,
+                'created_at': conv.created_at.isoformat(),
+                'updated_at': conv.updated_at.isoformat(),
+                'last_message_time': (last_message_time or conv.created_at).isoformat()
+            })
+        return result
+    
+    @staticmethod
+    def get_conversation_changes(user, since):
+        """获取指定同步版本之后发生变化的对话
+        
+        Args:
+            user: 当前用户
+            since: 客户端已同步到的版本号
+            
+        Returns:
+            dict or None: 包含变化的对话与已删除的对话ID；
+            版本过旧（删除记录已被清理）时返回None，客户端需要全量同步
+        """
+        if since < user.sync_floor or since > user.sync_version:
+            return None
+        
+        changed = Conversation.query.filter(
+            Conversation.user_id == user.id,
+            Conversation.sync_version > since
+        ).order_by(Conversation.updated_at.desc()).all()
+        
+        return {
+            'conversations': ChatService.serialize_conversations(changed),
+            'deleted': ConversationTombstone.get_deleted_since(user.id, since)
+        }
+    
     @staticmethod
     def get_conversation_messages(conversation_id, user_id=None):
         """获取对话的消息列表"""
         # 验证对话是否属于用户
+        since = None
         if user_id:
             conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id).first()
             if not conversation:
                 return None
+            since = conversation.created_at
         
-        messages = Message.get_conversation_messages(conversation_id)
+        messages = Message.get_conversation_messages(conversation_id, since=since)
         return messages
     
     @staticmethod
-    def send_message(conversation_id, user_message, user_id=None):
+    def send_message(conversation_id, user_message, user_id=None, idempotency_key=None):
         """
         发送消息并获取AI回复
         
@@ -67,9 +233,199 @@ class ChatService:
             conversation_id: 对话ID
             user_message: 用户消息内容
             user_id: 用户ID（用于验证权限）
+            idempotency_key: 幂等键（可选），重复请求返回第一次请求的结果
             
         Returns:
             dict: 包含用户消息和AI回复的结果
+        
+        Raises:
+            IdempotencyConflictError: 幂等键已用于内容不同的请求，由视图返回 422
+        """
+        record, created = ChatService._acquire_idempotency(
+            user_id, idempotency_key, 'send', conversation_id, user_message
+        )
+        record_id = None
+        try:
+            if not created:
+                response = ChatService._wait_for_result(record)
+                if response is None:
+                    raise Exception('相同的请求未能完成，请重新发送')
+                metrics.inc('idempotency.replayed')
+                return {
+                    'success': True,
+                    'user_message': response['user_message'],
+                    'ai_message': response['ai_message'],
+                    'replayed': True
+                }
+            if record is not None:
+                record_id = record['id']
+            
+            # 先完成所有数据库读写并释放连接，再调用上游API
+            prepared = ChatService._prepare_chat_turn(conversation_id, user_message, user_id)
+            
+            # 调用API获取回复
+            usage = {}
+            response = api_service.send_chat_request(prepared['api_messages'], config=prepared['api_config'],
+                                                     cacheable=True, usage=usage)
+            
+            # 提取AI回复内容
+            if 'choices' in response and len(response['choices']) > 0:
+                ai_message = response['choices'][0]['message']['content']
+            else:
+                logger.error("API返回格式错误: %.500r", response)
+                raise Exception("API返回格式错误")
+            
+            # 保存AI回复
+            ai_msg = ChatService._save_assistant_message(
+                conversation_id, ai_message,
+                usage=UsageService.complete(usage, prepared['api_messages'], ai_message, 'send')
+            )
+            logger.info("AI回复已保存: message_id=%s, 长度=%d", ai_msg['id'], len(ai_message))
+            
+            if record_id is not None:
+                ChatService._finish_idempotency(record_id, {
+                    'user_message': prepared['user_message'],
+                    'ai_message': ai_msg,
+                    'status': 'complete'
+                })
+                record_id = None
+            
+            return {
+                'success': True,
+                'user_message': prepared['user_message'],
+                'ai_message': ai_msg
+            }
+            
+        except Exception as e:
+            if record_id is not None:
+                ChatService._release_idempotency(record_id)
+            logger.error("发送消息失败: %s", e)
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    @staticmethod
+    def _acquire_idempotency(user_id, key, endpoint, conversation_id, user_message, stream_id=None):
+        """登记幂等键
+        
+        Returns:
+            tuple: (记录, 是否由本次请求执行)；未提供幂等键时为 (None, True)
+        """
+        if not key:
+            return None, True
+        
+        global _last_idempotency_prune
+        config = current_app.config
+        try:
+            record, created = IdempotencyKey.acquire(
+                user_id, key, _request_hash(endpoint, conversation_id, user_message),
+                ttl=timedelta(seconds=config['IDEMPOTENCY_TTL_SECONDS']),
+                lock_timeout=timedelta(seconds=config['IDEMPOTENCY_LOCK_SECONDS']),
+                stream_id=stream_id
+            )
+        except IdempotencyConflictError:
+            metrics.inc('idempotency.conflicts')
+            raise
+        
+        if created:
+            now = time.monotonic()
+            if now - _last_idempotency_prune >= IDEMPOTENCY_PRUNE_INTERVAL:
+                _last_idempotency_prune = now
+                background.submit('idempotency.prune', key='idempotency.prune')
+        else:
+            metrics.inc('idempotency.duplicates')
+            logger.info("重复请求: idempotency_key=%s, 原请求状态=%s", key, record['status'])
+            db.session.remove()
+        return record, created
+    
+    @staticmethod
+    def _finish_idempotency(record_id, response):
+        """保存幂等键对应的执行结果（失败只记录日志，不影响本次响应）"""
+        try:
+            IdempotencyKey.complete(record_id, response)
+        except Exception as e:
+            logger.error("保存幂等结果失败: %s", e)
+        finally:
+            db.session.remove()
+    
+    @staticmethod
+    def _release_idempotency(record_id):
+        """请求失败时删除幂等键，使用同一键的重试会重新执行"""
+        try:
+            IdempotencyKey.release(record_id)
+        except Exception as e:
+            logger.error("删除幂等键失败: %s", e)
+        finally:
+            db.session.remove()
+    
+    @staticmethod
+    def _poll_record(record_id):
+        try:
+            return IdempotencyKey.get_record(record_id)
+        finally:
+            db.session.remove()
+    
+    @staticmethod
+    def _wait_for_result(record):
+        """等待原请求完成，返回保存的结果；原请求失败或等待超时返回None"""
+        deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT_SECONDS']
+        while record is not None and record['status'] == IdempotencyKey.STATUS_PENDING:
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+            record = ChatService._poll_record(record['id'])
+        return record['response'] if record is not None else None
+    
+    @staticmethod
+    def _follow_stream(record):
+        """重复的流式请求：接到本进程内正在进行的同一个流上，或等待原请求完成后重放结果"""
+        app = current_app._get_current_object()
+        wait_seconds = app.config['IDEMPOTENCY_WAIT_SECONDS']
+        
+        def follow():
+            current = record
+            deadline = time.monotonic() + wait_seconds
+            with app.app_context():
+                while current is not None and current['status'] == IdempotencyKey.STATUS_PENDING:
+                    handle = streams.get(current['stream_id']) if current['stream_id'] else None
+                    if handle is not None and handle.frames is not None:
+                        metrics.inc('idempotency.reattached')
+                        yield from handle.follow()
+                        return
+                    if time.monotonic() >= deadline:
+                        yield encode_event({
+                            'type': 'error',
+                            'error': '相同的请求仍在处理中，请稍后刷新'
+                        })
+                        return
+                    # 原请求在其他 worker 上：等待其完成，期间发送注释帧保持连接
+                    time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+                    yield KEEPALIVE_FRAME
+                    current = ChatService._poll_record(current['id'])
+                
+                if current is None:
+                    yield encode_event({
+                        'type': 'error',
+                        'error': '相同的请求未能完成，请重新发送'
+                    })
+                    return
+                metrics.inc('idempotency.replayed')
+                yield from _replay_frames(current['response'])
+        
+        return follow()
+    
+    @staticmethod
+    @traced('chat.prepare')
+    def _prepare_chat_turn(conversation_id, user_message, user_id=None):
+        """在调用上游之前完成本轮对话的全部数据库读写
+        
+        保存用户消息、提交生成标题的后台任务、读取最近的历史与API配置，全部转成普通
+        字典后释放数据库会话，使后续的上游等待期间不占用连接池中的连接。
+        
+        Returns:
+            dict: user_message（已序列化）、api_messages、api_config，
+            以及是否已提交生成标题的任务（title_pending）
         """
         try:
             # 验证对话是否属于用户
@@ -84,13 +440,17 @@ class ChatService:
             
             # 保存用户消息
             user_msg = Message.create_message(conversation_id, 'user', user_message)
+            user_msg_data = user_msg.to_dict()
+            ChatService._schedule_maintenance()
             
-            # 如果是第一条消息，自动生成对话标题
-            if conversation.get_message_count() == 1:
-                conversation.update_title_from_first_message()
+            # 新对话的标题在后台根据第一条消息生成，不阻塞本次请求
+            title_pending = conversation.title == DEFAULT_TITLE
+            if title_pending:
+                background.submit('conversation.update_title', (conversation_id,),
+                                  key='conversation.title:%d' % conversation_id, durable=True)
             
-            # 获取对话历史（最近20条消息）
-            messages = Message.get_conversation_messages(conversation_id, limit=20)
+            # 获取对话历史（最近20条消息，按时间正序）
+            messages, _ = Message.get_message_page(conversation_id, limit=20, since=conversation.created_at)
             
             # 构建API请求的消息格式
             api_messages = []
@@ -100,36 +460,58 @@ class ChatService:
                     'content': msg.content
                 })
             
-            # 调用API获取回复
-            current_app.logger.info("开始调用API")
-            response = api_service.send_chat_request(api_messages)
-            current_app.logger.info(f"API调用完成，响应类型: {type(response)}")
-            
-            # 提取AI回复内容
-            if 'choices' in response and len(response['choices']) > 0:
-                ai_message = response['choices'][0]['message']['content']
-                current_app.logger.info(f"AI回复内容长度: {len(ai_message)}")
-            else:
-                current_app.logger.error(f"API返回格式错误: {response}")
-                raise Exception("API返回格式错误")
-            
-            # 保存AI回复
-            current_app.logger.info("开始保存AI回复")
-            ai_msg = Message.create_message(conversation_id, 'assistant', ai_message)
-            current_app.logger.info(f"AI消息保存成功，ID: {ai_msg.id}")
-            
-            return {
-                'success': True,
-                'user_message': user_msg.to_dict(),
-                'ai_message': ai_msg.to_dict()
-            }
-            
-        except Exception as e:
-            current_app.logger.error(f"发送消息失败: {str(e)}")
-            return {
-                'success': False,
-                'error': str(e)
-            }
+            api_config = api_service.get_api_config()
+        finally:
+            # 归还连接；之后不能再访问本次会话中加载的ORM对象
+            db.session.remove()
+        
+        return {
+            'user_message': user_msg_data,
+            'api_messages': api_messages,
+            'api_config': api_config,
+            'title_pending': title_pending
+        }
+    
+    @staticmethod
+    def _schedule_maintenance():
+        """每个进程每隔 MAINTENANCE_INTERVAL 提交一次消息表的维护任务"""
+        global _last_maintenance
+        now = time.monotonic()
+        if now - _last_maintenance < MAINTENANCE_INTERVAL:
+            return
+        _last_maintenance = now
+        if current_app.config['MESSAGES_PARTITIONING']:
+            background.submit('messages.ensure_partitions', key='messages.ensure_partitions')
+        if text_compressor.enabled:
+            background.submit('messages.compress', key='messages.compress')
+    
+    @staticmethod
+    def _schedule_render(messages):
+        """渲染器版本落后的AI回复（本次由 to_dict 即时渲染）提交后台任务重新渲染并写回"""
+        stale = [message.id for message in messages if message.render_stale]
+        if stale:
+            background.submit('messages.render', (stale,), key='messages.render:%d' % stale[0])
+    
+    @staticmethod
+    @traced('chat.save_reply')
+    def _save_assistant_message(conversation_id, content, status='complete', usage=None):
+        """用短生命周期的会话保存AI回复，写入后立即归还连接
+        
+        同时保存本次请求到此为止的各阶段耗时（启用追踪时）与用量，并累加当天的用量汇总。
+        
+        Args:
+            status: complete / cancelled（已停止的部分回复）/ error（出错前的部分回复）
+            usage: 本次请求的用量（见 UsageService.complete）
+        
+        Returns:
+            dict: 已序列化的消息
+        """
+        try:
+            message = Message.create_message(conversation_id, 'assistant', content,
+                                             timings=tracing.trace_timings(), status=status, usage=usage)
+            return message.to_dict()
+        finally:
+            db.session.remove()
     
     @staticmethod
     def delete_conversation(conversation_id, user_id):
@@ -138,6 +520,18 @@ class ChatService:
         if not conversation:
             return False
         
+        # 记录删除版本，供其他页面增量同步；顺带清理过期的删除记录
+        version = User.next_sync_version(user_id)
+        db.session.add(ConversationTombstone(user_id, conversation_id, version))
+        retention = timedelta(days=current_app.config['SYNC_TOMBSTONE_DAYS'])
+        floor = ConversationTombstone.prune(user_id, datetime.utcnow() - retention)
+        if floor is not None:
+            db.session.execute(
+                db.update(User).where(User.id == user_id, User.sync_floor < floor)
+                .values(sync_floor=floor)
+            )
+        
+        Message.delete_conversation_messages(conversation_id, since=conversation.created_at)
         db.session.delete(conversation)
         db.session.commit()
         return True
@@ -153,15 +547,52 @@ class ChatService:
         if not conversation:
             return None
         
-        messages = ChatService.get_conversation_messages(conversation_id)
+        messages = Message.get_conversation_messages(conversation_id, since=conversation.created_at)
+        ChatService._schedule_render(messages)
         
         return {
             'conversation': conversation.to_dict(),
-            'messages': [msg.to_dict() for msg in messages] if messages else []
+            'messages': [dict(msg.to_dict(), timings=msg.timings, usage=msg.usage_dict())
+                         for msg in messages] if messages else []
+        }
+    
+    @staticmethod
+    def get_conversation_page(conversation_id, user_id=None, before=None, limit=50):
+        """分页获取对话消息（最新的一页优先）
+        
+        Args:
+            conversation_id: 对话ID
+            user_id: 用户ID（用于验证权限）
+            before: 游标，只返回ID小于该值的消息
+            limit: 每页条数
+            
+        Returns:
+            dict or None: 消息页，对话不存在或无权限时返回None；
+            仅首页（before为None）附带对话信息
+        """
+        if user_id:
+            conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id).first()
+        else:
+            conversation = Conversation.query.get(conversation_id)
+        
+        if not conversation:
+            return None
+        
+        messages, has_more = Message.get_message_page(conversation_id, before=before, limit=limit,
+                                                      since=conversation.created_at)
+        ChatService._schedule_render(messages)
+        
+        page = {
+            'messages': [msg.to_dict() for msg in messages],
+            'has_more': has_more,
+            'next_before': messages[0].id if has_more else None
         }
+        if before is None:
+            page['conversation'] = conversation.to_dict()
+        return page
     
     @staticmethod
-    def send_message_stream(conversation_id, user_message, user_id=None):
+    def send_message_stream(conversation_id, user_message, user_id=None, idempotency_key=None):
         """
         发送消息并获取AI流式回复
         
@@ -169,44 +600,52 @@ class ChatService:
             conversation_id: 对话ID
             user_message: 用户消息内容
             user_id: 用户ID（用于验证权限）
+            idempotency_key: 幂等键（可选），重复请求接到原来的流上或重放已完成的结果
             
         Returns:
             generator: 流式生成器
-        """
-        import json
-        from flask import current_app
         
+        Raises:
+            IdempotencyConflictError: 幂等键已用于内容不同的请求，在开始响应之前抛出，由视图返回 422
+        """
+        stream_id = streams.new_stream_id()
+        record, created = ChatService._acquire_idempotency(
+            user_id, idempotency_key, 'send-stream', conversation_id, user_message, stream_id
+        )
         try:
-            # 验证对话是否属于用户
-            if user_id:
-                conversation = Conversation.query.filter_by(id=conversation_id, user_id=user_id).first()
-                if not conversation:
-                    raise ValueError("对话不存在或无权限访问")
-            else:
-                conversation = Conversation.query.get(conversation_id)
-                if not conversation:
-                    raise ValueError("对话不存在")
-            
-            # 保存用户消息
-            user_msg = Message.create_message(conversation_id, 'user', user_message)
-            
-            # 如果是第一条消息，自动生成对话标题
-            if conversation.get_message_count() == 1:
-                conversation.update_title_from_first_message()
+            if not created:
+                return ChatService._follow_stream(record)
+            record_id = record['id'] if record is not None else None
             
-            # 获取对话历史（最近20条消息）
-            messages = Message.get_conversation_messages(conversation_id, limit=20)
+            try:
+                # 先完成所有数据库读写并释放连接，流式期间不占用数据库连接
+                prepared = ChatService._prepare_chat_turn(conversation_id, user_message, user_id)
+                
+                # 调用API获取流式回复，并按时间窗口合并细碎的增量块
+                usage = {}
+                abort_hooks = []
+                stream_generator = api_service.send_chat_request(
+                    prepared['api_messages'], stream=True, config=prepared['api_config'], cacheable=True,
+                    usage=usage, abort_hooks=abort_hooks
+                )
+            except Exception:
+                if record_id is not None:
+                    ChatService._release_idempotency(record_id)
+                raise
+            user_msg_data = prepared['user_message']
+            title_pending = prepared['title_pending']
+            api_messages = prepared['api_messages']
             
-            # 构建 API 请求的消息格式
-            api_messages = []
-            for msg in messages:
-                api_messages.append({
-                    'role': msg.role,
-                    'content': msg.content
-                })
+            def abort_upstream():
+                for abort in abort_hooks:
+                    abort()
             
-            # 调用API获取流式回复
-            stream_generator = api_service.send_chat_request(api_messages, stream=True)
+            coalescer = ChunkCoalescer(
+                stream_generator,
+                window=current_app.config['STREAM_COALESCE_WINDOW_MS'] / 1000.0,
+                max_chars=current_app.config['STREAM_COALESCE_MAX_CHARS'],
+                abort=abort_upstream
+            )
             
             # 用于积累完整回复内容
             full_response = ""
@@ -215,80 +654,232 @@ class ChatService:
             # 获取应用实例
             app = current_app._get_current_object()
             
-            # 生成流式数据
+            def usage_for(reply):
+                # 上游生成器结束或被关闭后调用，此时已写入上游返回的用量与耗时
+                return UsageService.complete(usage, api_messages, reply, 'send-stream')
+            
+            # 生成流式数据（应用上下文仅用于日志等，不访问数据库，直到最终保存）
             def stream_with_save():
-                nonlocal full_response, ai_msg
+                nonlocal full_response, ai_msg, title_pending
+                # 登记取消句柄，stream_id 随 ai_start 下发，页面据此调用停止接口；
+                # 带幂等键时记录已发送的帧，供重复请求重放
+                handle = streams.register(user_id, conversation_id, stream_id, replayable=record_id is not None)
+                # 停止生成时立即断开上游并唤醒等待中的合并器，不等待下一个上游块
+                handle.on_cancel(lambda: coalescer.close(timeout=0))
+                # 上游停顿时合并器定期检查排空截止与其他 worker 的停止标记
+                coalescer.stop = handle.cancelled
+                finished = False
                 try:
                     with app.app_context():
-                        yield f"data: {json.dumps({
+                        yield handle.publish(encode_event({
                             'type': 'user_message',
-                            'message': user_msg.to_dict()
-                        }, ensure_ascii=False)}\n\n"
+                            'message': user_msg_data
+                        }))
                         
-                        yield f"data: {json.dumps({
-                            'type': 'ai_start'
-                        }, ensure_ascii=False)}\n\n"
+                        trace_id = tracing.current_trace_id()
+                        yield handle.publish(encode_event({
+                            'type': 'ai_start',
+                            'trace_id': trace_id,
+                            'stream_id': handle.stream_id
+                        }))
                         
-                        chunk_count = 0
-                        for chunk in stream_generator:
-                            full_response += chunk
-                            chunk_count += 1
-                            yield f"data: {json.dumps({
-                                'type': 'ai_chunk',
-                                'content': chunk
-                            }, ensure_ascii=False)}\n\n"
-                            
-                            # 每有50个chunk记录一次日志
-                            if chunk_count % 50 == 0:
-                                current_app.logger.info(f"已处理 {chunk_count} 个chunk，当前内容长度: {len(full_response)}")
+                        # 已完整的段落块渲染后随流下发（ai_block），页面只把末尾未完成的部分显示为纯文本
+                        markdown = MarkdownStream()
+                        with tracing.span('upstream.stream', tracing.KIND_CLIENT) as stream_span:
+                            for chunk in coalescer:
+                                if not full_response:
+                                    tracing.mark('first_token')
+                                full_response += chunk
+                                yield handle.publish(chunk_event(chunk))
+                                block = None
+                                if markdown is not None:
+                                    try:
+                                        block = markdown.feed(chunk)
+                                    except Exception:
+                                        # 渲染器出错不影响回复：之后只下发纯文本，完成时以保存的消息为准
+                                        logger.exception("流式渲染失败，改为只下发纯文本")
+                                        markdown = None
+                                if block:
+                                    yield handle.publish(encode_event({
+                                        'type': 'ai_block',
+                                        'html': block,
+                                        'consumed': markdown.consumed
+                                    }))
+                                # 后台生成的标题就绪后随流推送给页面
+                                if title_pending:
+                                    title_event = _title_event(conversation_id)
+                                    if title_event:
+                                        title_pending = False
+                                        yield handle.publish(title_event)
+                                # 用户已停止生成：不再读取上游
+                                if handle.cancelled():
+                                    break
+                            stream_span.set('events', coalescer.events)
+                            stream_span.set('upstream_chunks', coalescer.upstream_chunks)
+                            stream_span.set('cancelled', handle.reason is not None)
                         
-                        current_app.logger.info(f"流式输出完成，总共 {chunk_count} 个chunk，最终内容长度: {len(full_response)}")
+                        status = 'complete'
+                        if handle.reason is not None:
+                            # 关闭上游响应，上游随之停止生成
+                            coalescer.close()
+                            status = 'cancelled'
                         
-                        # 保存完整的AI回复
-                        if full_response.strip():  # 确保有内容才保存
-                            current_app.logger.info(f"保存AI回复，内容长度: {len(full_response)}")
-                            ai_msg = Message.create_message(conversation_id, 'assistant', full_response)
-                            current_app.logger.info(f"AI消息保存成功，ID: {ai_msg.id}")
+                        stats = coalescer.stats()
+                        logger.info(
+                            "流式输出%s，上游 %d 个chunk (%.1f/s)，下发 %d 个事件 (%.1f/s)，最终内容长度: %d",
+                            '已停止' if status == 'cancelled' else '完成',
+                            stats['upstream_chunks'], stats['upstream_per_sec'],
+                            stats['events'], stats['events_per_sec'], len(full_response),
+                            extra={
+                                'upstream_chunks': stats['upstream_chunks'],
+                                'events': stats['events'],
+                                'elapsed_ms': round(stats['elapsed'] * 1000, 1),
+                                'reply_chars': len(full_response),
+                                'status': status
+                            }
+                        )
+                        
+                        if status == 'cancelled':
+                            # 保存已生成的部分回复并标记为已停止；尚无内容时不保存
+                            record_stopped(handle.reason, full_response)
+                            if full_response.strip():
+                                ai_msg = ChatService._save_assistant_message(conversation_id, full_response,
+                                                                             status='cancelled',
+                                                                             usage=usage_for(full_response))
+                        elif full_response.strip():  # 确保有内容才保存
+                            record_completed(full_response)
+                            ai_msg = ChatService._save_assistant_message(conversation_id, full_response,
+                                                                         usage=usage_for(full_response))
                         else:
-                            current_app.logger.warning("没有收到AI回复内容")
+                            logger.warning("没有收到AI回复内容")
                             # 创建一个错误消息
-                            ai_msg = Message.create_message(conversation_id, 'assistant', '回复失败，请重试')
+                            ai_msg = ChatService._save_assistant_message(conversation_id, '回复失败，请重试',
+                                                                         usage=usage_for(''))
+                        finished = True
+                        if record_id is not None:
+                            ChatService._finish_idempotency(record_id, {
+                                'user_message': user_msg_data,
+                                'ai_message': ai_msg,
+                                'status': status
+                            })
+                        
+                        if title_pending:
+                            title_event = _title_event(conversation_id)
+                            if title_event:
+                                title_pending = False
+                                yield handle.publish(title_event)
                         
-                        yield f"data: {json.dumps({
+                        # title_pending 仍为真时页面稍后通过增量同步获取标题
+                        yield handle.publish(encode_event({
                             'type': 'ai_complete',
-                            'message': ai_msg.to_dict()
-                        }, ensure_ascii=False)}\n\n"
+                            'message': ai_msg,
+                            'status': status,
+                            'reason': handle.reason,
+                            'trace_id': trace_id,
+                            'title_pending': title_pending
+                        }))
                         
-                        yield "data: [DONE]\n\n"
+                        yield handle.publish(DONE_FRAME)
+                
+                except GeneratorExit:
+                    # 客户端断开连接（关闭页面、刷新、网络中断）：立即关闭上游响应并保存已生成的部分
+                    if not finished:
+                        handle.cancel(REASON_DISCONNECTED)
+                        coalescer.close()
+                        record_stopped(handle.reason, full_response)
+                        logger.info("客户端已断开，停止生成: 已生成长度=%d", len(full_response))
+                        try:
+                            with app.app_context():
+                                if full_response.strip():
+                                    ai_msg = ChatService._save_assistant_message(conversation_id, full_response,
+                                                                                 status='cancelled',
+                                                                                 usage=usage_for(full_response))
+                                if record_id is not None:
+                                    # 断开后的重试得到已停止的部分回复，不再重新生成
+                                    ChatService._finish_idempotency(record_id, {
+                                        'user_message': user_msg_data,
+                                        'ai_message': ai_msg,
+                                        'status': 'cancelled'
+                                    })
+                        except Exception as save_error:
+                            logger.error("保存部分内容失败: %s", save_error)
+                    raise
                         
                 except Exception as e:
-                    # 使用标准logging，避免应用上下文问题
-                    import logging
-                    logging.error(f"流式处理错误: {str(e)}", exc_info=True)
+                    logger.error("流式处理错误: %s", e, exc_info=True)
                     
                     # 如果有部分内容，尝试保存
                     if full_response.strip() and ai_msg is None:
                         try:
                             with app.app_context():
-                                logging.info(f"尝试保存部分内容，长度: {len(full_response)}")
-                                ai_msg = Message.create_message(conversation_id, 'assistant', full_response)
-                                logging.info(f"错误情况下保存部分内容成功，ID: {ai_msg.id}")
+                                ai_msg = ChatService._save_assistant_message(conversation_id, full_response,
+                                                                             status='error',
+                                                                             usage=usage_for(full_response))
+                                logger.info("已保存部分回复: message_id=%s, 长度=%d", ai_msg['id'], len(full_response))
                         except Exception as save_error:
-                            logging.error(f"保存部分内容失败: {str(save_error)}")
+                            logger.error("保存部分内容失败: %s", save_error)
+                    
+                    # 删除幂等键，使用同一键的重试会重新请求上游
+                    if record_id is not None and not finished:
+                        with app.app_context():
+                            ChatService._release_idempotency(record_id)
                     
-                    yield f"data: {json.dumps({
+                    yield handle.publish(encode_event({
                         'type': 'error',
                         'error': str(e)
-                    }, ensure_ascii=False)}\n\n"
+                    }))
+                
+                finally:
+                    streams.unregister(handle)
             
             return stream_with_save()
             
         except Exception as e:
-            import logging
-            logging.error(f"发送流式消息失败: {str(e)}")
+            logger.error("发送流式消息失败: %s", e, exc_info=True)
+            # except 块结束后 e 会被删除，生成器中只能引用提前取出的错误信息
+            error_message = str(e)
             def error_generator():
-                yield f"data: {json.dumps({
+                yield encode_event({
                     'type': 'error',
-                    'error': str(e)
-                }, ensure_ascii=False)}\n\n"
-            return error_generator()
\ No newline at end of file
+                    'error': error_message
+                })
+            return error_generator()
+
+
+@background.task('idempotency.prune')
+def prune_idempotency_keys_task():
+    """后台任务：清理过期的幂等键"""
+    count = IdempotencyKey.prune()
+    if count:
+        logger.info("已清理过期幂等键: %d 条", count)
+
+
+@background.task('messages.ensure_partitions')
+def ensure_message_partitions_task():
+    """后台任务：提前创建消息表未来月份的分区"""
+    with db.engine.begin() as conn:
+        if not partitioning.is_postgresql(conn) or not partitioning.is_partitioned(conn):
+            return
+        # 建分区需要短暂锁住父表，拿不到锁时放弃、下次再建，不阻塞消息写入
+        conn.execute(db.text("SET LOCAL lock_timeout = '2s'"))
+        created = partitioning.ensure_partitions(conn, current_app.config['MESSAGES_PARTITION_MONTHS_AHEAD'])
+    if created:
+        logger.info("已创建消息分区: %s", ', '.join(created))
+
+
+@background.task('messages.render')
+def render_messages_task(message_ids):
+    """后台任务：重新渲染并保存版本落后的AI回复"""
+    count = Message.render_stored(message_ids)
+    if count:
+        logger.debug("已重新渲染消息: %d 条", count)
+
+
+@background.task('messages.compress')
+def compress_messages_task():
+    """后台任务：分批压缩启用压缩之前写入的长消息"""
+    scanned, compressed, finished = Message.compress_stored(max_batches=COMPRESS_BATCHES_PER_TASK)
+    if compressed:
+        logger.info("已压缩旧消息: 检查 %d 条, 压缩 %d 条", scanned, compressed)
+    if not finished:
+        background.submit('messages.compress', key='messages.compress')
\ No newline at end of file
@@ -0,0 +1,231 @@
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app
+
+from app import db
+from app.models import User, Conversation, Message
+from app.models.conversation import DEFAULT_TITLE, title_from_message
+from app.services.api_service import api_service
+from app.utils.metrics import metrics
+from app.utils.tasks import background
+
+logger = logging.getLogger(__name__)
+
+TITLE_PROMPT = (
+    "你是对话标题生成器。下面每行是一段对话中用户的第一条消息，行首是编号。"
+    "请为每段对话生成一个概括主题的简短标题，使用与消息相同的语言，不超过{max_chars}个字，"
+    "不要引号和结尾标点。只输出一个 JSON 对象，键为编号，值为标题，例如 {{\"1\": \"标题\"}}。"
+)
+
+# 每条消息送入提示词的最大长度
+PROMPT_MESSAGE_CHARS = 300
+# 从模型输出的标题两端去掉的引号与结尾标点
+_TITLE_QUOTES = '"\'“”‘’「」《》'
+_TITLE_TRAILING = '。.!！?？,，;；:：'
+
+
+class TitleService:
+    """对话标题服务
+
+    新对话的第一条消息保存后，由后台任务把对话加入待生成列表；攒够
+    TITLE_BATCH_SIZE 个或等待 TITLE_BATCH_WAIT_MS 后，在一次上游请求中为
+    整批对话生成标题（可使用单独的低成本模型 TITLE_MODEL）。上游失败、未配置
+    密钥或关闭 TITLE_LLM_ENABLED 时退回为截取第一条消息。
+
+    生成的标题写入数据库（递增同步版本号，侧边栏增量同步可见），同时记录在
+    进程内，供仍在流式输出的请求以 ``title`` 事件推送给页面。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._batch = OrderedDict()
+        self._in_flight = set()
+        self._timer = None
+        # 最近生成的标题：conversation_id -> 标题，由流式请求取走
+        self._published = OrderedDict()
+        self._published_max = 1000
+
+    def request_title(self, conversation_id):
+        """为标题仍为默认值的对话安排生成标题（在后台任务中调用）"""
+        config = current_app.config
+        if not config['TITLE_LLM_ENABLED'] or not api_service.get_api_config()['api_key']:
+            self.apply_titles({conversation_id: None})
+            return
+
+        with self._lock:
+            if conversation_id in self._batch or conversation_id in self._in_flight:
+                return
+            self._batch[conversation_id] = True
+            if len(self._batch) >= config['TITLE_BATCH_SIZE']:
+                ids = self._take_batch()
+            else:
+                ids = None
+                if self._timer is None:
+                    self._timer = threading.Timer(config['TITLE_BATCH_WAIT_MS'] / 1000.0, self._flush_timer)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if ids:
+            self._submit(ids)
+
+    def _take_batch(self):
+        """取出当前批次（需持有锁）"""
+        ids = list(self._batch)
+        self._batch.clear()
+        self._in_flight.update(ids)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return ids
+
+    def _flush_timer(self):
+        with self._lock:
+            self._timer = None
+            ids = self._take_batch() if self._batch else None
+        if ids:
+            self._submit(ids)
+
+    def _submit(self, ids):
+        if not background.submit('conversation.generate_titles', (ids,), durable=True):
+            with self._lock:
+                self._in_flight.difference_update(ids)
+
+    def generate_titles(self, conversation_ids):
+        """为一批对话生成并保存标题（在后台任务中调用）"""
+        try:
+            rows = db.session.execute(
+                db.select(Conversation.id, Message.content)
+                .join(Message, Message.conversation_id == Conversation.id)
+                .where(Conversation.id.in_(conversation_ids),
+                       Conversation.title == DEFAULT_TITLE,
+                       Message.role == 'user')
+                .order_by(Message.id)
+            ).all()
+            first_messages = {}
+            for conversation_id, content in rows:
+                first_messages.setdefault(conversation_id, content)
+            if not first_messages:
+                return
+
+            titles = {}
+            try:
+                titles = self._summarize(list(first_messages.items()))
+                metrics.inc('titles.generated', len(titles))
+            except Exception as e:
+                metrics.inc('titles.errors')
+                logger.warning("生成标题失败，使用第一条消息作为标题: %s", e)
+            self.apply_titles({cid: titles.get(cid) for cid in first_messages}, first_messages)
+        finally:
+            with self._lock:
+                self._in_flight.difference_update(conversation_ids)
+
+    def _summarize(self, items):
+        """一次上游请求为多段对话生成标题
+
+        Args:
+            items: [(conversation_id, 第一条消息)]
+
+        Returns:
+            dict: conversation_id -> 标题（解析失败的对话不包含在内）
+        """
+        config = current_app.config
+        max_chars = config['TITLE_MAX_CHARS']
+        lines = []
+        for index, (_, content) in enumerate(items, 1):
+            text = ' '.join(content.split())[:PROMPT_MESSAGE_CHARS]
+            lines.append(f'{index}: {text}')
+        messages = [
+            {'role': 'system', 'content': TITLE_PROMPT.format(max_chars=max_chars)},
+            {'role': 'user', 'content': '\n'.join(lines)}
+        ]
+
+        api_config = dict(api_service.get_api_config())
+        if config['TITLE_MODEL']:
+            api_config['model'] = config['TITLE_MODEL']
+        response = api_service.send_chat_request(
+            messages, config=api_config,
+            options={'temperature': 0.3, 'max_tokens': 40 + len(items) * (max_chars * 2 + 10)}
+        )
+        content = response['choices'][0]['message']['content'] or ''
+
+        start, end = content.find('{'), content.rfind('}')
+        if start < 0 or end < start:
+            raise ValueError('标题响应不是JSON: %.200r' % content)
+        data = json.loads(content[start:end + 1])
+
+        titles = {}
+        for index, (conversation_id, _) in enumerate(items, 1):
+            title = _clean_title(data.get(str(index)), max_chars)
+            if title:
+                titles[conversation_id] = title
+        return titles
+
+    def apply_titles(self, titles, first_messages=None):
+        """保存标题；标题为None时使用第一条消息截取的标题
+
+        只更新标题仍为默认值的对话，可以重复执行。
+        """
+        conversations = Conversation.query.filter(
+            Conversation.id.in_(list(titles)),
+            Conversation.title == DEFAULT_TITLE
+        ).all()
+        updated = {}
+        for conversation in conversations:
+            title = titles[conversation.id]
+            if not title:
+                content = (first_messages or {}).get(conversation.id)
+                if content is None:
+                    first = conversation.messages.filter_by(role='user').first()
+                    content = first.content if first else ''
+                title = title_from_message(content)
+            if not title:
+                continue
+            conversation.title = title
+            conversation.updated_at = datetime.utcnow()
+            conversation.sync_version = User.next_sync_version(conversation.user_id)
+            updated[conversation.id] = title
+        if updated:
+            db.session.commit()
+            with self._lock:
+                for conversation_id, title in updated.items():
+                    self._published[conversation_id] = title
+                while len(self._published) > self._published_max:
+                    self._published.popitem(last=False)
+        return updated
+
+    def take_published(self, conversation_id):
+        """取走对话最近生成的标题（本进程内），没有时返回None"""
+        if not self._published:
+            return None
+        with self._lock:
+            return self._published.pop(conversation_id, None)
+
+
+def _clean_title(value, max_chars):
+    if not isinstance(value, str):
+        return None
+    title = re.sub(r'\s+', ' ', value)
+    title = title.lstrip(_TITLE_QUOTES + ' ').rstrip(_TITLE_QUOTES + _TITLE_TRAILING + ' ')
+    return title[:max_chars] or None
+
+
+# 全局标题服务实例
+title_service = TitleService()
+
+
+@background.task('conversation.update_title')
+def update_title_task(conversation_id):
+    """后台任务：标题仍为默认值时安排生成标题（可重复执行）"""
+    conversation = db.session.get(Conversation, conversation_id)
+    if conversation is not None and conversation.title == DEFAULT_TITLE:
+        title_service.request_title(conversation_id)
+
+
+@background.task('conversation.generate_titles')
+def generate_titles_task(conversation_ids):
+    """后台任务：批量生成标题"""
+    title_service.generate_titles(conversation_ids)
@@ -0,0 +1,195 @@
+from app import db
+from app.models import User, Conversation, Message, UsageDaily
+from app.utils.metrics import metrics
+from app.utils.streams import estimate_tokens
+from flask import current_app
+from datetime import datetime, timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 本地估算时每条消息的格式开销（角色标记、分隔符）与回复的起始标记，按 OpenAI 的计数方式取近似值
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+
+class QuotaExceededError(Exception):
+    """超出每日配额"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        # 距离配额重置（下一个 UTC 零点）的秒数
+        self.retry_after = retry_after
+
+
+class UsageService:
+    """用量服务类：补全每次请求的用量、检查每日配额、提供管理后台的用量统计"""
+
+    @staticmethod
+    def estimate_prompt_tokens(api_messages):
+        """本地估算请求消息的 token 数"""
+        return sum(estimate_tokens(msg['content']) + MESSAGE_OVERHEAD_TOKENS for msg in api_messages) \
+            + REPLY_PRIMING_TOKENS
+
+    @staticmethod
+    def complete(usage, api_messages, reply, endpoint):
+        """补全一次请求的用量，返回保存到消息上的字典
+
+        上游返回了用量时直接使用（source=upstream）；否则用本地估算补齐缺失的部分
+        （source=estimate），如停止生成、连接断开、上游不支持返回用量或未配置API密钥。
+        命中语义缓存的请求（source=cache）同样估算 token 数，但不计入每日用量。
+
+        Args:
+            usage: send_chat_request 写入的用量字典
+            api_messages: 发送给上游的消息列表
+            reply: 实际保存的回复内容（停止生成时为已生成的部分）
+            endpoint: send / send-stream
+        """
+        source = usage.get('source')
+        prompt_tokens = usage.get('prompt_tokens')
+        completion_tokens = usage.get('completion_tokens')
+        if source is None:
+            source = 'upstream' if prompt_tokens is not None and completion_tokens is not None else 'estimate'
+        if prompt_tokens is None:
+            prompt_tokens = UsageService.estimate_prompt_tokens(api_messages)
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens(reply)
+
+        if source != 'cache':
+            metrics.inc('usage.prompt_tokens', prompt_tokens)
+            metrics.inc('usage.completion_tokens', completion_tokens)
+        metrics.inc('usage.requests.' + source)
+        return {
+            'model': usage.get('model'),
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'upstream_ms': usage.get('upstream_ms'),
+            'endpoint': endpoint,
+            'source': source
+        }
+
+    @staticmethod
+    def check_quota(user_id):
+        """检查用户当天的配额，超出时抛出 QuotaExceededError
+
+        未配置配额时不访问数据库；配置后读取 usage_daily 中该用户当天的几行（按模型各一行）。
+        """
+        config = current_app.config
+        token_quota = config['USAGE_DAILY_TOKEN_QUOTA']
+        request_quota = config['USAGE_DAILY_REQUEST_QUOTA']
+        if not token_quota and not request_quota:
+            return
+
+        now = datetime.utcnow()
+        totals = UsageDaily.totals(user_id, now.date())
+        if request_quota and totals['requests'] >= request_quota:
+            message = '今日请求次数已达上限，请明天再试'
+        elif token_quota and totals['tokens'] >= token_quota:
+            message = '今日用量已达上限，请明天再试'
+        else:
+            return
+
+        metrics.inc('usage.quota_rejected')
+        logger.info("超出每日配额: user_id=%s, 请求 %d 次, %d tokens", user_id, totals['requests'], totals['tokens'])
+        tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        raise QuotaExceededError(message, int((tomorrow - now).total_seconds()) + 1)
+
+    @staticmethod
+    def _since(days):
+        return datetime.utcnow().date() - timedelta(days=max(1, days) - 1)
+
+    @staticmethod
+    def _sums():
+        return (
+            db.func.sum(UsageDaily.requests).label('requests'),
+            db.func.sum(UsageDaily.prompt_tokens).label('prompt_tokens'),
+            db.func.sum(UsageDaily.completion_tokens).label('completion_tokens'),
+            db.func.sum(UsageDaily.estimated_requests).label('estimated_requests'),
+            db.func.sum(UsageDaily.cached_requests).label('cached_requests')
+        )
+
+    @staticmethod
+    def _row_dict(row, **extra):
+        data = {
+            'requests': int(row.requests or 0),
+            'prompt_tokens': int(row.prompt_tokens or 0),
+            'completion_tokens': int(row.completion_tokens or 0),
+            'estimated_requests': int(row.estimated_requests or 0),
+            'cached_requests': int(row.cached_requests or 0)
+        }
+        data['total_tokens'] = data['prompt_tokens'] + data['completion_tokens']
+        data.update(extra)
+        return data
+
+    @staticmethod
+    def get_daily_usage(days=30, user_id=None):
+        """最近 days 天每天的用量（按日期倒序），可只统计一个用户"""
+        query = db.session.query(UsageDaily.day, *UsageService._sums())\
+            .filter(UsageDaily.day >= UsageService._since(days))
+        if user_id is not None:
+            query = query.filter(UsageDaily.user_id == user_id)
+        rows = query.group_by(UsageDaily.day).order_by(UsageDaily.day.desc()).all()
+        return [UsageService._row_dict(row, day=row.day.isoformat()) for row in rows]
+
+    @staticmethod
+    def get_model_usage(days=30, user_id=None):
+        """最近 days 天按模型汇总的用量"""
+        query = db.session.query(UsageDaily.model, *UsageService._sums())\
+            .filter(UsageDaily.day >= UsageService._since(days))
+        if user_id is not None:
+            query = query.filter(UsageDaily.user_id == user_id)
+        rows = query.group_by(UsageDaily.model).all()
+        result = [UsageService._row_dict(row, model=row.model or '-') for row in rows]
+        return sorted(result, key=lambda item: item['total_tokens'], reverse=True)
+
+    @staticmethod
+    def get_top_users(days=30, limit=20):
+        """最近 days 天用量最多的用户"""
+        total = db.func.sum(UsageDaily.prompt_tokens + UsageDaily.completion_tokens)
+        rows = db.session.query(UsageDaily.user_id, *UsageService._sums())\
+            .filter(UsageDaily.day >= UsageService._since(days))\
+            .group_by(UsageDaily.user_id)\
+            .order_by(total.desc())\
+            .limit(limit).all()
+
+        users = {}
+        if rows:
+            users = {user.id: user for user in User.query.filter(User.id.in_([row.user_id for row in rows]))}
+        return [
+            UsageService._row_dict(row, user_id=row.user_id, user=UsageService._user_label(users.get(row.user_id)))
+            for row in rows
+        ]
+
+    @staticmethod
+    def get_user_conversations(user_id, limit=20):
+        """用户用量最多的对话（按消息上记录的用量汇总）"""
+        total = db.func.sum(db.func.coalesce(Message.prompt_tokens, 0) + db.func.coalesce(Message.completion_tokens, 0))
+        rows = db.session.query(
+            Conversation.id, Conversation.title,
+            db.func.count(Message.id).label('requests'),
+            db.func.sum(Message.prompt_tokens).label('prompt_tokens'),
+            db.func.sum(Message.completion_tokens).label('completion_tokens'),
+            total.label('total_tokens')
+        ).join(Message, Message.conversation_id == Conversation.id)\
+            .filter(Conversation.user_id == user_id, Message.usage_source.in_(('upstream', 'estimate')))\
+            .group_by(Conversation.id, Conversation.title)\
+            .order_by(total.desc())\
+            .limit(limit).all()
+        return [{
+            'conversation_id': row.id,
+            'title': row.title,
+            'requests': row.requests,
+            'prompt_tokens': int(row.prompt_tokens or 0),
+            'completion_tokens': int(row.completion_tokens or 0),
+            'total_tokens': int(row.total_tokens or 0)
+        } for row in rows]
+
+    @staticmethod
+    def get_user_label(user_id):
+        return UsageService._user_label(User.query.get(user_id))
+
+    @staticmethod
+    def _user_label(user):
+        if user is None:
+            return '已删除用户'
+        return user.username or f'用户_{user.session_id[:8]}'
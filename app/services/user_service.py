@@ -1,5 +1,5 @@
 from app import db
-from app.models import User, Conversation, Message
+from app.models import User, Conversation, Message, ConversationTombstone, IdempotencyKey
 from flask import current_app
 from datetime import datetime, timedelta
 
@@ -83,6 +83,9 @@ class UserService:
             # 不允许删除管理员账号
             return False
         
+        # 删除记录与幂等键没有级联删除，与 flask prune-users 一样先删除
+        for model in (ConversationTombstone, IdempotencyKey):
+            db.session.execute(db.delete(model).where(model.user_id == user_id))
         db.session.delete(user)
         db.session.commit()
         return True
@@ -1,12 +1,40 @@
 // SimpleChat 前端JavaScript
 
+// 每次请求的消息条数
+const MESSAGE_PAGE_SIZE = 50;
+// DOM 中最多同时渲染的消息条数
+const MESSAGE_WINDOW_SIZE = 150;
+// 距离顶部/底部多少像素时开始加载或平移窗口
+const SCROLL_EDGE_PX = 200;
+
 class SimpleChat {
     constructor() {
         this.currentConversationId = null;
         this.isLoading = false;
+        // 正在进行的流式回复：服务端 stream_id 与用于断开连接的 AbortController
+        this.streamId = null;
+        this.streamAbort = null;
+        // 侧边栏状态：对话ID -> 对话数据，以及用于增量同步的版本号和ETag
+        this.conversations = new Map();
+        this.sidebarVersion = null;
+        this.sidebarEtag = null;
+        this.resetMessageState();
         this.initializeApp();
     }
 
+    resetMessageState() {
+        // 已加载的消息（从旧到新），DOM 只渲染其中 [windowStart, windowEnd) 区间
+        this.messageCache = [];
+        this.windowStart = 0;
+        this.windowEnd = 0;
+        this.messageElements = new Map();
+        this.hasMoreHistory = false;
+        this.historyCursor = null;
+        this.loadingHistory = false;
+        this.streamingElement = null;
+        this.pendingUserMessage = null;
+    }
+
     initializeApp() {
         this.loadConversations();
         this.setupEventListeners();
@@ -23,7 +51,14 @@ class SimpleChat {
         // 发送消息按钮
         const sendBtn = document.getElementById('sendBtn');
         if (sendBtn) {
-            sendBtn.addEventListener('click', () => this.sendMessage());
+            // 生成过程中按钮切换为“停止”
+            sendBtn.addEventListener('click', () => this.isLoading ? this.stopGeneration() : this.sendMessage());
+        }
+
+        // 滚动到顶部/底部附近时加载更早的消息或平移渲染窗口
+        const messagesContainer = document.getElementById('chatMessages');
+        if (messagesContainer) {
+            messagesContainer.addEventListener('scroll', () => this.onMessagesScroll());
         }
 
         // 输入框回车发送
@@ -59,6 +94,8 @@ class SimpleChat {
             const data = await response.json();
             
             if (data.success) {
+                this.sidebarEtag = response.headers.get('ETag');
+                this.sidebarVersion = data.version;
                 this.renderConversations(data.conversations);
                 
                 // 如果有对话，加载第一个
@@ -75,46 +112,147 @@ class SimpleChat {
         }
     }
 
+    async syncConversations() {
+        // 只拉取上次同步之后变化的对话，无变化时服务端返回304
+        if (this.sidebarVersion === null) {
+            return this.loadConversations();
+        }
+
+        try {
+            const headers = {};
+            if (this.sidebarEtag) {
+                headers['If-None-Match'] = this.sidebarEtag;
+            }
+            const response = await fetch(`/api/chat/conversations?since=${this.sidebarVersion}`, { headers });
+
+            if (response.status === 304) return;
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+            }
+
+            const data = await response.json();
+            if (!data.success) {
+                console.error('同步对话列表失败:', data.error);
+                return;
+            }
+
+            this.sidebarEtag = response.headers.get('ETag');
+            this.sidebarVersion = data.version;
+
+            if (data.full) {
+                this.renderConversations(data.conversations);
+                return;
+            }
+
+            (data.deleted || []).forEach(id => this.removeConversationItem(id));
+            data.conversations.forEach(conv => this.upsertConversationItem(conv));
+        } catch (error) {
+            console.error('同步对话列表失败:', error);
+        }
+    }
+
     renderConversations(conversations) {
         const conversationList = document.getElementById('conversationList');
         if (!conversationList) return;
 
         conversationList.innerHTML = '';
+        this.conversations = new Map();
 
         conversations.forEach(conv => {
-            const item = document.createElement('div');
-            item.className = 'conversation-item';
-            item.dataset.conversationId = conv.id;
-            
-            item.innerHTML = `
-                <div class="conversation-content">
-                    <div class="conversation-title">${this.escapeHtml(conv.title)}</div>
-                    <div class="conversation-time">${this.formatTime(conv.last_message_time)}</div>
-                </div>
-                <button class="conversation-delete-btn" title="删除对话">
-                    <svg viewBox="0 0 24 24" width="16" height="16" fill="currentColor">
-                        <path d="M19 7l-.867 12.142A2 2 0 0116.138 21H7.862a2 2 0 01-1.995-1.858L5 7m5 4v6m4-6v6m1-10V4a1 1 0 00-1-1h-4a1 1 0 00-1 1v3M4 7h16"/>
-                    </svg>
-                </button>
-            `;
-            
-            // 点击对话内容区域加载对话
-            const conversationContent = item.querySelector('.conversation-content');
-            conversationContent.addEventListener('click', () => {
-                this.loadConversation(conv.id);
-            });
-            
-            // 点击删除按钮
-            const deleteBtn = item.querySelector('.conversation-delete-btn');
-            deleteBtn.addEventListener('click', (e) => {
-                e.stopPropagation(); // 阻止事件冒泡
-                this.deleteConversation(conv.id, conv.title);
-            });
-            
-            conversationList.appendChild(item);
+            this.conversations.set(conv.id, conv);
+            conversationList.appendChild(this.createConversationItem(conv));
         });
     }
 
+    createConversationItem(conv) {
+        const item = document.createElement('div');
+        item.className = 'conversation-item';
+        item.dataset.conversationId = conv.id;
+        if (conv.id === this.currentConversationId) {
+            item.classList.add('active');
+        }
+        
+        item.innerHTML = `
+            <div class="conversation-content">
+                <div class="conversation-title">${this.escapeHtml(conv.title)}</div>
+                <div class="conversation-time">${this.formatTime(conv.last_message_time)}</div>
+            </div>
+            <button class="conversation-delete-btn" title="删除对话">
+                <svg viewBox="0 0 24 24" width="16" height="16" fill="currentColor">
+                    <path d="M19 7l-.867 12.142A2 2 0 0116.138 21H7.862a2 2 0 01-1.995-1.858L5 7m5 4v6m4-6v6m1-10V4a1 1 0 00-1-1h-4a1 1 0 00-1 1v3M4 7h16"/>
+                </svg>
+            </button>
+        `;
+        
+        // 点击对话内容区域加载对话
+        const conversationContent = item.querySelector('.conversation-content');
+        conversationContent.addEventListener('click', () => {
+            this.loadConversation(conv.id);
+        });
+        
+        // 点击删除按钮（标题可能在增量同步中更新，删除时读取最新值）
+        const deleteBtn = item.querySelector('.conversation-delete-btn');
+        deleteBtn.addEventListener('click', (e) => {
+            e.stopPropagation(); // 阻止事件冒泡
+            const latest = this.conversations.get(conv.id) || conv;
+            this.deleteConversation(conv.id, latest.title);
+        });
+        
+        return item;
+    }
+
+    upsertConversationItem(conv) {
+        const conversationList = document.getElementById('conversationList');
+        if (!conversationList) return;
+
+        this.conversations.set(conv.id, conv);
+
+        let item = conversationList.querySelector(`[data-conversation-id="${conv.id}"]`);
+        if (item) {
+            item.querySelector('.conversation-title').textContent = conv.title;
+            item.querySelector('.conversation-time').textContent = this.formatTime(conv.last_message_time);
+        } else {
+            item = this.createConversationItem(conv);
+        }
+
+        // 按更新时间倒序放到正确位置，只移动这一个节点
+        let next = null;
+        for (const other of conversationList.children) {
+            const otherConv = this.conversations.get(Number(other.dataset.conversationId));
+            if (other !== item && otherConv && otherConv.updated_at <= conv.updated_at) {
+                next = other;
+                break;
+            }
+        }
+        if (item.nextSibling !== next || item.parentNode !== conversationList) {
+            conversationList.insertBefore(item, next);
+        }
+    }
+
+    applyConversationTitle(conversationId, title) {
+        // 只更新标题文本，不重新加载列表
+        const conv = this.conversations.get(conversationId);
+        if (conv) {
+            conv.title = title;
+        }
+        const item = document.querySelector(`[data-conversation-id="${conversationId}"] .conversation-title`);
+        if (item) {
+            item.textContent = title;
+        }
+        const chatTitle = document.getElementById('chatTitle');
+        if (chatTitle && this.currentConversationId == conversationId) {
+            chatTitle.textContent = title;
+        }
+    }
+
+    removeConversationItem(conversationId) {
+        this.conversations.delete(conversationId);
+        const item = document.querySelector(`[data-conversation-id="${conversationId}"]`);
+        if (item) {
+            item.remove();
+        }
+    }
+
     async createNewConversation() {
         try {
             const response = await fetch('/api/chat/new', {
@@ -127,8 +265,8 @@ class SimpleChat {
             const data = await response.json();
             
             if (data.success) {
-                await this.loadConversations();
-                this.loadConversation(data.conversation_id);
+                await this.syncConversations();
+                await this.loadConversation(data.conversation_id);
             } else {
                 this.showError('创建新对话失败');
             }
@@ -153,12 +291,22 @@ class SimpleChat {
                 currentItem.classList.add('active');
             }
             
-            // 加载消息
-            const response = await fetch(`/api/chat/messages/${conversationId}`);
+            // 只加载最新的一页消息，更早的消息在向上滚动时再加载
+            const response = await fetch(`/api/chat/messages/${conversationId}?limit=${MESSAGE_PAGE_SIZE}`);
             const data = await response.json();
             
+            // 请求期间已切换到其他对话
+            if (this.currentConversationId !== conversationId) return;
+            
             if (data.success) {
-                this.renderMessages(data.messages);
+                this.resetMessageState();
+                this.messageCache = data.messages;
+                this.hasMoreHistory = data.has_more;
+                this.historyCursor = data.next_before;
+                this.windowEnd = this.messageCache.length;
+                this.windowStart = Math.max(0, this.windowEnd - MESSAGE_WINDOW_SIZE);
+                this.renderMessageWindow();
+                this.scrollToBottom();
                 
                 // 更新对话标题
                 const chatTitle = document.getElementById('chatTitle');
@@ -171,18 +319,145 @@ class SimpleChat {
         }
     }
 
-    renderMessages(messages) {
+    renderMessageWindow() {
         const messagesContainer = document.getElementById('chatMessages');
         if (!messagesContainer) return;
 
-        messagesContainer.innerHTML = '';
+        const fragment = document.createDocumentFragment();
+        this.messageElements = new Map();
 
-        messages.forEach(message => {
+        for (let i = this.windowStart; i < this.windowEnd; i++) {
+            const message = this.messageCache[i];
             const messageDiv = this.createMessageElement(message);
-            messagesContainer.appendChild(messageDiv);
-        });
+            this.messageElements.set(message, messageDiv);
+            fragment.appendChild(messageDiv);
+        }
 
-        this.scrollToBottom();
+        // 正在生成的回复始终位于最新消息之后
+        if (this.streamingElement && this.windowEnd === this.messageCache.length) {
+            fragment.appendChild(this.streamingElement);
+        }
+
+        messagesContainer.innerHTML = '';
+        messagesContainer.appendChild(fragment);
+    }
+
+    findScrollAnchor() {
+        // 找到当前可见区域内的第一条消息，记录其相对滚动位置
+        const messagesContainer = document.getElementById('chatMessages');
+        for (const [message, element] of this.messageElements) {
+            if (element.offsetTop + element.offsetHeight > messagesContainer.scrollTop) {
+                return { message, offset: element.offsetTop - messagesContainer.scrollTop };
+            }
+        }
+        return null;
+    }
+
+    setMessageWindow(start, end) {
+        if (start === this.windowStart && end === this.windowEnd) return;
+
+        const messagesContainer = document.getElementById('chatMessages');
+        const anchor = this.findScrollAnchor();
+
+        this.windowStart = start;
+        this.windowEnd = end;
+        this.renderMessageWindow();
+
+        // 重新渲染后保持锚点消息在原来的位置，避免滚动跳动
+        const anchorElement = anchor && this.messageElements.get(anchor.message);
+        if (anchorElement) {
+            messagesContainer.scrollTop = anchorElement.offsetTop - anchor.offset;
+        }
+    }
+
+    onMessagesScroll() {
+        const messagesContainer = document.getElementById('chatMessages');
+        if (!messagesContainer || !this.currentConversationId) return;
+
+        if (messagesContainer.scrollTop < SCROLL_EDGE_PX) {
+            this.shiftWindowUp();
+        } else if (messagesContainer.scrollHeight - messagesContainer.scrollTop
+                   - messagesContainer.clientHeight < SCROLL_EDGE_PX) {
+            this.shiftWindowDown();
+        }
+    }
+
+    async shiftWindowUp() {
+        if (this.loadingHistory) return;
+
+        if (this.windowStart === 0) {
+            if (!this.hasMoreHistory) return;
+            await this.loadOlderMessages();
+            if (this.windowStart === 0) return;
+        }
+
+        const start = Math.max(0, this.windowStart - MESSAGE_PAGE_SIZE);
+        const end = Math.min(this.windowEnd, start + MESSAGE_WINDOW_SIZE);
+        this.setMessageWindow(start, end);
+    }
+
+    shiftWindowDown() {
+        if (this.windowEnd >= this.messageCache.length) return;
+
+        const end = Math.min(this.messageCache.length, this.windowEnd + MESSAGE_PAGE_SIZE);
+        const start = Math.max(this.windowStart, end - MESSAGE_WINDOW_SIZE);
+        this.setMessageWindow(start, end);
+    }
+
+    async loadOlderMessages() {
+        const conversationId = this.currentConversationId;
+        this.loadingHistory = true;
+
+        try {
+            const response = await fetch(
+                `/api/chat/messages/${conversationId}?before=${this.historyCursor}&limit=${MESSAGE_PAGE_SIZE}`
+            );
+            const data = await response.json();
+
+            if (!data.success || this.currentConversationId !== conversationId) return;
+
+            // 更早的消息插入缓存头部，窗口下标随之平移
+            this.messageCache = data.messages.concat(this.messageCache);
+            this.windowStart += data.messages.length;
+            this.windowEnd += data.messages.length;
+            this.hasMoreHistory = data.has_more;
+            this.historyCursor = data.next_before;
+        } catch (error) {
+            console.error('加载历史消息失败:', error);
+        } finally {
+            this.loadingHistory = false;
+        }
+    }
+
+    appendMessage(message, element) {
+        // 新消息总是出现在最新位置；如果正在浏览历史，先跳回最新的窗口
+        if (this.windowEnd !== this.messageCache.length) {
+            this.windowEnd = this.messageCache.length;
+            this.windowStart = Math.max(0, this.windowEnd - MESSAGE_WINDOW_SIZE);
+            this.renderMessageWindow();
+        }
+
+        const messagesContainer = document.getElementById('chatMessages');
+        this.messageCache.push(message);
+        this.windowEnd = this.messageCache.length;
+        this.messageElements.set(message, element);
+        if (element.parentNode !== messagesContainer) {
+            if (this.streamingElement && this.streamingElement !== element
+                && this.streamingElement.parentNode === messagesContainer) {
+                messagesContainer.insertBefore(element, this.streamingElement);
+            } else {
+                messagesContainer.appendChild(element);
+            }
+        }
+
+        // 超出窗口大小时移除最旧的节点
+        while (this.windowEnd - this.windowStart > MESSAGE_WINDOW_SIZE) {
+            const oldest = this.messageCache[this.windowStart];
+            const oldestElement = this.messageElements.get(oldest);
+            if (oldestElement) oldestElement.remove();
+            this.messageElements.delete(oldest);
+            this.windowStart++;
+        }
     }
 
     createMessageElement(message) {
@@ -195,13 +470,19 @@ class SimpleChat {
         
         const content = document.createElement('div');
         content.className = 'message-content';
-        content.innerHTML = this.formatMessageContent(message.content);
+        // AI回复使用服务端渲染的 HTML（已转义），用户消息按纯文本显示
+        content.innerHTML = message.content_html
+            ? `<div class="markdown-body">${message.content_html}</div>`
+            : this.formatMessageContent(message.content);
         
         const time = document.createElement('div');
         time.className = 'message-time';
         time.textContent = this.formatTime(message.created_at);
         
         content.appendChild(time);
+        if (message.status === 'cancelled') {
+            content.appendChild(this.createStoppedMarker());
+        }
         messageDiv.appendChild(avatar);
         messageDiv.appendChild(content);
         
@@ -238,34 +519,49 @@ class SimpleChat {
         messageInput.value = '';
         messageInput.style.height = 'auto';
         
-        // 显示用户消息
-        this.addMessageToChat({
+        // 显示用户消息（收到服务端确认后补全ID等字段）
+        this.pendingUserMessage = {
             role: 'user',
             content: message,
             created_at: new Date().toISOString()
-        });
+        };
+        this.addMessageToChat(this.pendingUserMessage);
         
         // 创建流式AI消息容器
         const streamingMessage = this.createStreamingMessageElement();
         const messagesContainer = document.getElementById('chatMessages');
+        this.streamingElement = streamingMessage;
         messagesContainer.appendChild(streamingMessage);
         this.scrollToBottom();
         
         const contentElement = streamingMessage.querySelector('.streaming-content');
+        this.streamText = '';
         let streamCompleted = false;
+        this.streamAbort = new AbortController();
+        // 每次发送一个幂等键，浏览器或代理重试同一请求时服务端不会重复保存消息和请求上游
+        const idempotencyKey = this.newIdempotencyKey();
         
         try {
             const response = await fetch('/api/chat/send-stream', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': idempotencyKey
                 },
                 body: JSON.stringify({
                     conversation_id: this.currentConversationId,
                     message: message
-                })
+                }),
+                signal: this.streamAbort.signal
             });
             
+            if (response.status === 429 || response.status === 503) {
+                // 超出每日配额或服务正在重启，显示服务端返回的提示
+                const result = await response.json().catch(() => ({}));
+                const serviceError = new Error(result.error || '服务暂时不可用，请稍后重试');
+                serviceError.name = 'ServiceError';
+                throw serviceError;
+            }
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}: ${response.statusText}`);
             }
@@ -318,19 +614,38 @@ class SimpleChat {
                 this.restoreUIState();
             }
             
-            // 刷新对话列表（标题可能已更新）
-            await this.loadConversations();
+            // 增量同步对话列表（标题、消息时间可能已更新）
+            await this.syncConversations();
             
         } catch (error) {
+            // 停止接口不可用时直接断开连接，服务端会保存已生成的部分，重新加载即可看到
+            if (error.name === 'AbortError') {
+                if (streamingMessage && streamingMessage.parentNode) {
+                    streamingMessage.parentNode.removeChild(streamingMessage);
+                }
+                this.streamingElement = null;
+                this.restoreUIState();
+                const conversationId = this.currentConversationId;
+                setTimeout(() => {
+                    if (this.currentConversationId === conversationId) {
+                        this.loadConversation(conversationId);
+                    }
+                }, 500);
+                return;
+            }
+            
             console.error('发送消息失败:', error);
             
             // 移除流式消息元素
             if (streamingMessage && streamingMessage.parentNode) {
                 streamingMessage.parentNode.removeChild(streamingMessage);
             }
+            this.streamingElement = null;
             
             // 根据错误类型显示不同的提示
-            if (error.message.includes('timeout') || error.message.includes('Timeout')) {
+            if (error.name === 'ServiceError') {
+                this.showError(error.message);
+            } else if (error.message.includes('timeout') || error.message.includes('Timeout')) {
                 this.showError('请求超时，请稍后重试');
             } else if (error.message.includes('Failed to fetch')) {
                 this.showError('网络连接失败，请检查网络');
@@ -343,12 +658,57 @@ class SimpleChat {
         }
     }
 
+    newIdempotencyKey() {
+        // crypto.randomUUID 仅在 HTTPS 或 localhost 下可用
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        const bytes = new Uint8Array(16);
+        crypto.getRandomValues(bytes);
+        return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    createStoppedMarker(reason) {
+        const marker = document.createElement('div');
+        marker.className = 'message-status';
+        marker.textContent = reason === 'shutdown' ? '服务重启，回复已中断' : '已停止';
+        return marker;
+    }
+
+    async stopGeneration() {
+        if (!this.isLoading) return;
+        
+        const sendBtn = document.getElementById('sendBtn');
+        if (sendBtn) {
+            sendBtn.disabled = true;
+            sendBtn.textContent = '停止中...';
+        }
+        
+        // 还没收到 stream_id 时只能断开连接
+        if (!this.streamId) {
+            if (this.streamAbort) this.streamAbort.abort();
+            return;
+        }
+        
+        try {
+            const response = await fetch(`/api/chat/cancel/${this.streamId}`, { method: 'POST' });
+            const data = await response.json();
+            if (!data.success) {
+                throw new Error(data.error);
+            }
+            // 服务端停止后仍会发送 ai_complete，由正常流程收尾
+        } catch (error) {
+            console.warn('停止生成失败，断开连接:', error);
+            if (this.streamAbort) this.streamAbort.abort();
+        }
+    }
+
     addMessageToChat(message) {
         const messagesContainer = document.getElementById('chatMessages');
         if (!messagesContainer) return;
 
         const messageElement = this.createMessageElement(message);
-        messagesContainer.appendChild(messageElement);
+        this.appendMessage(message, messageElement);
         this.scrollToBottom();
     }
     
@@ -366,6 +726,14 @@ class SimpleChat {
         const streamingContent = document.createElement('div');
         streamingContent.className = 'streaming-content';
         
+        // 服务端已渲染的段落块（ai_block）与其后尚未渲染的纯文本
+        const rendered = document.createElement('div');
+        rendered.className = 'markdown-body';
+        const pending = document.createElement('span');
+        pending.className = 'streaming-text';
+        streamingContent.appendChild(rendered);
+        streamingContent.appendChild(pending);
+        
         const cursor = document.createElement('span');
         cursor.className = 'streaming-cursor';
         cursor.textContent = '|';
@@ -381,18 +749,37 @@ class SimpleChat {
     handleStreamChunk(chunk, contentElement, messageElement) {
         switch (chunk.type) {
             case 'user_message':
-                // 用户消息已经在前面显示了，这里不需要处理
+                // 用户消息已经在前面显示了，这里只补全服务端返回的字段
+                if (this.pendingUserMessage && chunk.message) {
+                    Object.assign(this.pendingUserMessage, chunk.message);
+                    this.pendingUserMessage = null;
+                }
                 break;
-            case 'ai_start':
-                // AI开始生成回复
+            case 'ai_start': {
+                // AI开始生成回复，此后可以停止生成
+                this.streamId = chunk.stream_id || null;
+                const sendBtn = document.getElementById('sendBtn');
+                if (sendBtn && this.streamId) {
+                    sendBtn.disabled = false;
+                    sendBtn.textContent = '停止';
+                    sendBtn.classList.add('stop-btn');
+                }
                 break;
+            }
             case 'ai_chunk':
-                // 添加文本块
+                // 添加文本块，渲染前按纯文本显示
                 if (chunk.content) {
-                    contentElement.textContent += chunk.content;
+                    this.streamText += chunk.content;
+                    contentElement.querySelector('.streaming-text').textContent += chunk.content;
                     this.scrollToBottom();
                 }
                 break;
+            case 'ai_block':
+                // 服务端渲染好的完整段落块，替换对应的纯文本（consumed 为已渲染部分的长度）
+                contentElement.querySelector('.markdown-body').insertAdjacentHTML('beforeend', chunk.html);
+                contentElement.querySelector('.streaming-text').textContent = this.streamText.slice(chunk.consumed);
+                this.scrollToBottom();
+                break;
             case 'ai_complete':
                 // AI完成回复
                 const cursor = messageElement.querySelector('.streaming-cursor');
@@ -401,21 +788,54 @@ class SimpleChat {
                 }
                 messageElement.classList.remove('streaming');
                 
+                // 停止时尚未生成任何内容，不保留空消息
+                if (!chunk.message) {
+                    if (messageElement.parentNode) {
+                        messageElement.parentNode.removeChild(messageElement);
+                    }
+                    this.streamingElement = null;
+                    this.restoreUIState();
+                    break;
+                }
+                
+                // 换成完整回复的渲染结果
+                if (chunk.message.content_html) {
+                    contentElement.querySelector('.markdown-body').innerHTML = chunk.message.content_html;
+                    contentElement.querySelector('.streaming-text').textContent = '';
+                }
+                
                 // 添加时间戳
                 const time = document.createElement('div');
                 time.className = 'message-time';
                 time.textContent = this.formatTime(chunk.message.created_at);
                 contentElement.parentElement.appendChild(time);
+                if (chunk.message.status === 'cancelled') {
+                    contentElement.parentElement.appendChild(this.createStoppedMarker(chunk.reason));
+                }
+                
+                // 流式元素转为普通消息，纳入消息窗口
+                this.streamingElement = null;
+                this.appendMessage(chunk.message, messageElement);
+                
+                // 标题仍在后台生成时，稍后再增量同步一次
+                if (chunk.title_pending) {
+                    setTimeout(() => this.syncConversations(), 3000);
+                }
                 
                 // 恢复界面状态
                 this.restoreUIState();
                 break;
+            case 'title':
+                // 后台生成的对话标题
+                this.applyConversationTitle(chunk.conversation_id, chunk.title);
+                break;
             case 'error':
                 // 处理错误
                 console.error('流式错误:', chunk.error);
                 if (messageElement && messageElement.parentNode) {
                     messageElement.parentNode.removeChild(messageElement);
                 }
+                this.streamingElement = null;
                 this.showError(chunk.error);
                 // 错误时也要恢复界面状态
                 this.restoreUIState();
@@ -428,6 +848,8 @@ class SimpleChat {
     restoreUIState() {
         // 恢复输入和按钮状态
         this.isLoading = false;
+        this.streamId = null;
+        this.streamAbort = null;
         
         const messageInput = document.getElementById('messageInput');
         const sendBtn = document.getElementById('sendBtn');
@@ -440,6 +862,7 @@ class SimpleChat {
         if (sendBtn) {
             sendBtn.disabled = false;
             sendBtn.textContent = '发送';
+            sendBtn.classList.remove('stop-btn');
         }
     }
 
@@ -543,8 +966,8 @@ class SimpleChat {
                     this.clearChatArea();
                 }
                 
-                // 重新加载对话列表
-                await this.loadConversations();
+                // 增量同步对话列表
+                await this.syncConversations();
                 
                 // 简单的成功提示
                 this.showSuccess('对话删除成功');
@@ -562,6 +985,8 @@ class SimpleChat {
         const chatMessages = document.getElementById('chatMessages');
         const chatTitle = document.getElementById('chatTitle');
         
+        this.resetMessageState();
+        
         if (chatMessages) {
             chatMessages.innerHTML = `
                 <div class="welcome-message" style="text-align: center; padding: 2rem; color: #666;">
@@ -0,0 +1,4 @@
+# 导入常用工具，便于其他模块使用
+from .sse import SSEDecoder, ChunkCoalescer, extract_delta_content
+
+__all__ = ['SSEDecoder', 'ChunkCoalescer', 'extract_delta_content']
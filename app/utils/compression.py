@@ -0,0 +1,143 @@
+"""
+响应压缩
+
+根据 Accept-Encoding 协商 br / gzip，对 JSON 等普通响应整体压缩；
+对 ``text/event-stream`` 流式响应逐事件压缩并同步刷新（sync flush），
+保证每个事件都能立即被浏览器解压显示。
+"""
+import zlib
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖
+    brotli = None
+
+# 默认参与压缩的响应类型
+DEFAULT_MIMETYPES = (
+    'application/json',
+    'text/event-stream',
+    'text/html',
+    'text/css',
+    'text/plain',
+    'application/javascript'
+)
+
+
+class _GzipStream:
+    """gzip 增量压缩器"""
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliStream:
+    """brotli 增量压缩器"""
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class Compression:
+    """响应压缩扩展
+
+    配置项：
+        COMPRESS_ENABLED: 是否启用
+        COMPRESS_MIN_SIZE: 普通响应的最小压缩字节数，更小的响应原样返回
+        COMPRESS_GZIP_LEVEL / COMPRESS_BR_QUALITY: 压缩级别
+        COMPRESS_MIMETYPES: 参与压缩的响应类型
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BR_QUALITY', 4)
+        app.config.setdefault('COMPRESS_MIMETYPES', DEFAULT_MIMETYPES)
+        app.after_request(self.after_request)
+
+    @staticmethod
+    def supported_encodings(streaming=False):
+        """服务端支持的编码，按优先级排列
+
+        逐事件同步刷新时 brotli 的压缩率和 CPU 开销都不如 gzip
+        （见 benchmarks/bench_compression.py），因此流式响应优先 gzip。
+        """
+        if brotli is None:
+            return ('gzip',)
+        return ('gzip', 'br') if streaming else ('br', 'gzip')
+
+    def choose_encoding(self, accept_encodings, streaming=False):
+        """根据 Accept-Encoding 选择编码，不接受任何支持的编码时返回 None"""
+        return accept_encodings.best_match(self.supported_encodings(streaming))
+
+    def after_request(self, response):
+        config = current_app.config
+        if not config['COMPRESS_ENABLED']:
+            return response
+
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in config['COMPRESS_MIMETYPES']):
+            return response
+
+        streaming = response.is_streamed
+        if streaming and response.mimetype != 'text/event-stream':
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = self.choose_encoding(request.accept_encodings, streaming)
+        if encoding is None:
+            return response
+
+        if streaming:
+            response.response = self._compress_stream(response.response, self._new_stream(encoding))
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < config['COMPRESS_MIN_SIZE']:
+                return response
+            stream = self._new_stream(encoding)
+            # set_data 会同步更新 Content-Length
+            response.set_data(stream.compress(data) + stream.finish())
+
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def _new_stream(encoding):
+        if encoding == 'br':
+            return _BrotliStream(current_app.config['COMPRESS_BR_QUALITY'])
+        return _GzipStream(current_app.config['COMPRESS_GZIP_LEVEL'])
+
+    @staticmethod
+    def _compress_stream(iterable, stream):
+        """逐事件压缩并同步刷新，压缩上下文在整个流内共享"""
+        try:
+            for chunk in iterable:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                if chunk:
+                    yield stream.compress(chunk)
+            yield stream.finish()
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
@@ -0,0 +1,111 @@
+"""
+数据库连接池配置与监控
+
+根据配置生成 ``SQLALCHEMY_ENGINE_OPTIONS``：
+
+* ``DB_POOL_MODE=session``（默认）：应用内 QueuePool，连接池大小、溢出数、
+  等待超时、pre-ping 与回收时间均由环境变量控制；
+* ``DB_POOL_MODE=transaction``：前置 PgBouncer 事务池时使用 NullPool，
+  每次签出都向 PgBouncer 建立新连接、归还即关闭，由 PgBouncer 负责复用；
+* SQLite 不设置任何连接池参数，沿用 SQLAlchemy 的默认行为。
+
+``instrument_engine`` 通过连接池与游标事件把签出等待时间、使用中连接数、
+溢出连接数以及慢查询写入 ``app.utils.metrics``。
+"""
+import logging
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """记录签出等待时间与溢出连接数的 QueuePool"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            metrics.inc('db.pool.checkout_timeouts')
+            raise
+        metrics.observe('db.pool.checkout_wait_ms', (time.perf_counter() - start) * 1000)
+        metrics.set_gauge('db.pool.overflow', max(self.overflow(), 0))
+        return connection
+
+
+def build_engine_options(config):
+    """根据应用配置生成引擎参数"""
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        return {}
+
+    if config['DB_POOL_MODE'] == 'transaction':
+        # PgBouncer 事务池模式：连接复用交给 PgBouncer，应用侧不保留连接
+        return {'poolclass': NullPool}
+
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE']
+    }
+
+
+def instrument_engine(engine, slow_query_ms=0):
+    """为引擎注册连接池与慢查询监控
+
+    Args:
+        engine: SQLAlchemy 引擎
+        slow_query_ms: 慢查询阈值（毫秒），0 表示不记录慢查询日志
+    """
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.inc('db.pool.checkouts')
+        metrics.add_gauge('db.pool.in_use', 1)
+
+    @event.listens_for(engine, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        metrics.add_gauge('db.pool.in_use', -1)
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        metrics.inc('db.pool.connects')
+
+    @event.listens_for(engine, 'invalidate')
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.inc('db.pool.invalidated')
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - context._query_start) * 1000
+        metrics.observe('db.query_ms', elapsed_ms)
+        if slow_query_ms and elapsed_ms >= slow_query_ms:
+            metrics.inc('db.slow_queries')
+            # 只记录语句本身，不记录参数，避免把用户消息写入日志
+            logger.warning('慢查询 %.1fms: %s', elapsed_ms, ' '.join(statement.split())[:1000])
+
+
+def describe_pool(pool):
+    """返回连接池当前状态"""
+    info = {'class': type(pool).__name__, 'status': pool.status()}
+    if isinstance(pool, QueuePool):
+        info.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0)
+        })
+    return info
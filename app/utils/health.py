@@ -0,0 +1,112 @@
+"""
+健康检查（/healthz、/readyz）
+
+探针请求频繁（负载均衡与容器编排通常每隔几秒一次，且每个实例都会被探测），检查结果按项缓存：
+数据库每 HEALTH_CACHE_SECONDS 秒执行一次 ``SELECT 1``，上游每 HEALTH_UPSTREAM_CACHE_SECONDS 秒
+发送一次 HEAD 请求（只确认能建立连接并收到响应，不消耗 token；4xx 与 501 也视为可达）。
+缓存期内的探针直接返回上次结果；同一项同时只有一个线程在检查，其余线程等待该结果。
+
+结果只代表当前 worker 进程。
+"""
+import logging
+import threading
+import time
+
+import requests
+
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Check:
+    """一项带缓存的检查"""
+
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+        self.ttl = 10.0
+        self.result = None
+        self.expires = 0.0
+        self.lock = threading.Lock()
+
+    def get(self):
+        if time.monotonic() < self.expires:
+            return self.result
+        with self.lock:
+            # 等锁期间其他线程可能已完成检查
+            if time.monotonic() < self.expires:
+                return self.result
+            start = time.perf_counter()
+            try:
+                result = dict(self.func() or {}, ok=True)
+            except Exception as e:
+                result = {'ok': False, 'error': str(e)[:200]}
+                metrics.inc('health.%s.failures' % self.name)
+                logger.warning("健康检查失败: %s, %s", self.name, e)
+            result['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            result['checked_at'] = time.time()
+            self.result = result
+            self.expires = time.monotonic() + self.ttl
+            return result
+
+
+class HealthChecker:
+    """数据库与上游的可达性检查"""
+
+    def __init__(self):
+        self.upstream_timeout = 2.0
+        self.database = _Check('database', self._check_database)
+        self.upstream = _Check('upstream', self._check_upstream)
+
+    def init_app(self, app):
+        self.database.ttl = app.config['HEALTH_CACHE_SECONDS']
+        self.upstream.ttl = app.config['HEALTH_UPSTREAM_CACHE_SECONDS']
+        self.upstream_timeout = app.config['HEALTH_UPSTREAM_TIMEOUT']
+        self.database.expires = self.upstream.expires = 0.0
+        app.extensions['health'] = self
+
+    @staticmethod
+    def _check_database():
+        from app import db
+        try:
+            db.session.execute(db.text('SELECT 1'))
+        finally:
+            db.session.remove()
+
+    def _check_upstream(self):
+        from flask import current_app
+        from app import db
+        from app.services import api_service
+
+        try:
+            config = api_service.get_api_config()
+        except Exception:
+            # 数据库不可用时退回应用配置，上游检查不受影响
+            config = {'api_url': current_app.config['OPENAI_API_URL'], 'api_key': current_app.config['OPENAI_API_KEY']}
+        finally:
+            db.session.remove()
+        if not config['api_key']:
+            return {'skipped': '未配置API密钥（模拟回复）'}
+
+        response = requests.head(config['api_url'], timeout=self.upstream_timeout, allow_redirects=False)
+        response.close()
+        # 501 表示不支持 HEAD 方法，同样说明上游可达
+        if response.status_code >= 500 and response.status_code != 501:
+            raise Exception('上游返回 %d' % response.status_code)
+        return {'status_code': response.status_code}
+
+    def status(self):
+        """全部检查项的结果（可能来自缓存）"""
+        checks = {'database': self.database.get(), 'upstream': self.upstream.get()}
+        return {
+            'ok': all(check['ok'] for check in checks.values()),
+            'checks': {
+                name: dict(check, age_s=round(time.time() - check['checked_at'], 1))
+                for name, check in checks.items()
+            }
+        }
+
+
+# 全局健康检查
+health = HealthChecker()
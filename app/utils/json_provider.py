@@ -0,0 +1,99 @@
+"""
+JSON 序列化（API 响应与下游 SSE 帧）
+
+安装 orjson 时使用 orjson，否则使用标准库 json（JSON_BACKEND=auto / orjson / stdlib）。
+两种后端的输出一致：紧凑格式、非 ASCII 字符按 UTF-8 原样输出（不转义为 \\uXXXX）、
+保持字典的插入顺序；datetime / date 序列化为与 ``isoformat()`` 相同的 ISO 8601 字符串，
+Decimal 与 UUID 转为字符串。
+
+``app.json`` 替换为 ``AppJSONProvider``：``jsonify`` 直接生成字节，不经过 str 再编码；
+``request.get_json`` 同样使用所选后端解析。SSE 帧的编码见 ``app/utils/sse.py`` 的 ``encode_event``。
+"""
+import dataclasses
+import decimal
+import json
+import logging
+import uuid
+from datetime import date
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('auto', 'orjson', 'stdlib')
+
+
+def _default(value):
+    """两种后端都不能直接序列化的类型"""
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+_stdlib_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default)
+
+
+class JSONCodec:
+    """进程内共享的 JSON 编解码（后端见 init_app）"""
+
+    def __init__(self):
+        self.backend = 'orjson' if orjson is not None else 'stdlib'
+
+    def init_app(self, app):
+        backend = app.config['JSON_BACKEND']
+        if backend not in BACKENDS:
+            raise ValueError('JSON_BACKEND 只能是 %s: %r' % (' / '.join(BACKENDS), backend))
+        if backend == 'orjson' and orjson is None:
+            logger.warning("未安装 orjson，JSON 序列化改用标准库")
+        self.backend = 'orjson' if backend != 'stdlib' and orjson is not None else 'stdlib'
+        app.json = AppJSONProvider(app)
+        app.extensions['json_codec'] = self
+
+    def dumps_bytes(self, obj):
+        """序列化为 UTF-8 字节"""
+        if self.backend == 'orjson':
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        return _stdlib_encoder.encode(obj).encode('utf-8')
+
+    def dumps(self, obj):
+        if self.backend == 'orjson':
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        return _stdlib_encoder.encode(obj)
+
+    def loads(self, data):
+        if self.backend == 'orjson':
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+# 全局 JSON 编解码
+json_codec = JSONCodec()
+
+
+class AppJSONProvider(JSONProvider):
+    """使用 json_codec 的 Flask JSON provider
+
+    关键字参数（indent、sort_keys 等）被忽略，输出格式固定。
+    """
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return json_codec.dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return json_codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_codec.dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,276 @@
+"""
+日志
+
+* 请求线程只把日志记录放入有界队列（QueueHandler），格式化与输出由后台
+  QueueListener 线程完成；队列满时直接丢弃并计数（``log.dropped``），不阻塞请求；
+* 每条记录附带 request_id / conversation_id（contextvars），按 JSON 或文本格式输出，
+  ``extra`` 中的字段作为结构化字段写入 JSON；
+* 按 logger 名称前缀配置采样率（只作用于 WARNING 以下的记录）与每秒条数上限。
+
+应用代码统一使用 ``logging.getLogger(__name__)`` 的模块级 logger 和 %-style 参数，
+被禁用级别的日志不会产生任何格式化开销。
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import request
+
+from .metrics import metrics
+
+# 所有应用 logger 的公共前缀（模块 logger 与 Flask 的 app.logger 均在其下）
+APP_LOGGER = 'app'
+REQUEST_ID_HEADER = 'X-Request-ID'
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s %(name)s [%(request_id)s] %(message)s'
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+conversation_id_var = contextvars.ContextVar('conversation_id', default=None)
+
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+_EXC_FORMATTER = logging.Formatter()
+_RESERVED_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {
+    'message', 'asctime', 'request_id', 'conversation_id'
+}
+
+# 当前生效的队列处理器与后台监听线程
+_state = {'handler': None, 'listener': None}
+
+
+def bind_conversation(conversation_id):
+    """把对话ID绑定到当前请求的日志上下文"""
+    conversation_id_var.set(conversation_id)
+
+
+def get_request_id():
+    return request_id_var.get()
+
+
+def parse_prefix_map(value):
+    """解析 ``app.models=0.1,app.views.chat=0.5`` 形式的配置"""
+    result = {}
+    for item in (value or '').split(','):
+        name, sep, number = item.partition('=')
+        if sep and name.strip():
+            result[name.strip()] = float(number)
+    return result
+
+
+class _PrefixTable:
+    """按 logger 名称查找最长匹配前缀，结果按名称缓存"""
+
+    def __init__(self, table):
+        self.table = dict(table)
+        self._cache = {}
+
+    def match(self, name):
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        best = None
+        for prefix in self.table:
+            if (name == prefix or name.startswith(prefix + '.')) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        self._cache[name] = best
+        return best
+
+
+class ContextFilter(logging.Filter):
+    """在请求线程中记录 request_id / conversation_id"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get() or '-'
+        record.conversation_id = conversation_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """按 logger 前缀对 WARNING 以下的记录随机采样"""
+
+    def __init__(self, rates, rng=random.random):
+        super().__init__()
+        self._rates = _PrefixTable(rates)
+        self._random = rng
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        prefix = self._rates.match(record.name)
+        if prefix is None:
+            return True
+        rate = self._rates.table[prefix]
+        if rate >= 1 or self._random() < rate:
+            return True
+        metrics.inc('log.sampled_out')
+        return False
+
+
+class RateLimitFilter(logging.Filter):
+    """按 logger 前缀限制每秒条数（令牌桶，允许突发到每秒上限）"""
+
+    def __init__(self, limits, clock=time.monotonic):
+        super().__init__()
+        self._limits = _PrefixTable(limits)
+        self._clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        prefix = self._limits.match(record.name)
+        if prefix is None:
+            return True
+        limit = self._limits.table[prefix]
+        now = self._clock()
+        with self._lock:
+            tokens, last = self._buckets.get(prefix, (limit, now))
+            tokens = min(limit, tokens + (now - last) * limit)
+            allowed = tokens >= 1
+            self._buckets[prefix] = (tokens - 1 if allowed else tokens, now)
+        if not allowed:
+            metrics.inc('log.rate_limited')
+        return allowed
+
+
+class DroppingQueueHandler(QueueHandler):
+    """写入有界队列的日志处理器，队列满时丢弃记录而不是阻塞请求线程"""
+
+    def prepare(self, record):
+        # 消息在请求线程中拼接（参数对象之后可能变化），异常堆栈单独保存以便结构化输出；
+        # 应用 logger 只有这一个处理器且不向上传播，直接修改记录而不复制
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _EXC_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc('log.dropped')
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出为一行 JSON"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        request_id = getattr(record, 'request_id', '-')
+        if request_id != '-':
+            data['request_id'] = request_id
+        conversation_id = getattr(record, 'conversation_id', None)
+        if conversation_id is not None:
+            data['conversation_id'] = conversation_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(app):
+    """为应用 logger 配置队列处理器，并注册 request_id 钩子
+
+    配置项：
+        LOG_LEVEL: 应用日志级别
+        LOG_FORMAT: json 或 text
+        LOG_QUEUE_SIZE: 日志队列容量，队列满时丢弃
+        LOG_SAMPLE_RATES: 按 logger 前缀的采样率，如 ``app.models=0.1``
+        LOG_RATE_LIMITS: 按 logger 前缀的每秒条数上限，如 ``app=200``
+    """
+    config = app.config
+    _stop_listener()
+
+    output = logging.StreamHandler()
+    if config['LOG_FORMAT'] == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    handler = DroppingQueueHandler(queue.Queue(config['LOG_QUEUE_SIZE']))
+    handler.addFilter(ContextFilter())
+    sample_rates = parse_prefix_map(config['LOG_SAMPLE_RATES'])
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+    rate_limits = parse_prefix_map(config['LOG_RATE_LIMITS'])
+    if rate_limits:
+        handler.addFilter(RateLimitFilter(rate_limits))
+
+    logger = logging.getLogger(APP_LOGGER)
+    for old in [h for h in logger.handlers if isinstance(h, DroppingQueueHandler)]:
+        logger.removeHandler(old)
+    logger.addHandler(handler)
+    logger.setLevel(config['LOG_LEVEL'])
+    logger.propagate = False
+
+    _state['handler'] = handler
+    _state['listener'] = QueueListener(handler.queue, output)
+    _state['listener'].start()
+
+    app.before_request(_bind_request)
+    app.after_request(_send_request_id)
+
+
+def _bind_request():
+    """为每个请求设置 request_id（优先使用上游代理传入的 X-Request-ID）"""
+    incoming = request.headers.get(REQUEST_ID_HEADER)
+    request_id_var.set(incoming if incoming and _REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex)
+    conversation_id_var.set(None)
+
+
+def _send_request_id(response):
+    request_id = request_id_var.get()
+    if request_id:
+        response.headers[REQUEST_ID_HEADER] = request_id
+    # 流式响应在视图返回后才输出，直到响应关闭时才清除日志上下文
+    response.call_on_close(_clear_request)
+    return response
+
+
+def _clear_request():
+    request_id_var.set(None)
+    conversation_id_var.set(None)
+
+
+def _stop_listener():
+    listener = _state['listener']
+    if listener is not None:
+        _state['listener'] = None
+        listener.stop()
+
+
+def _restart_after_fork():
+    """fork 出的子进程中没有后台线程，用新的队列重新启动监听线程"""
+    handler = _state['handler']
+    listener = _state['listener']
+    if handler is None or listener is None:
+        return
+    handler.queue = queue.Queue(handler.queue.maxsize)
+    _state['listener'] = QueueListener(handler.queue, *listener.handlers)
+    _state['listener'].start()
+
+
+# 进程退出前输出队列中剩余的日志
+atexit.register(_stop_listener)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
@@ -0,0 +1,415 @@
+"""
+AI 回复的 Markdown 渲染
+
+AI 回复保存时渲染一次（``Message.create_message``），HTML 与渲染器版本随消息存储，
+消息接口直接返回，页面不再解析 Markdown。支持的语法：
+
+    段落（单个换行保留为 <br>）、# 标题、``` / ~~~ 代码块、`行内代码`、**粗体**、*斜体*、~~删除线~~、
+    [链接](url)、裸 http(s) 网址、- / 1. 列表（可嵌套）、> 引用、| 表格 |、--- 分隔线
+
+输出只包含这里生成的标签：原文先整体转义再套用语法，不透传任何 HTML；链接只允许 http、https、mailto
+与站内相对地址，图片按链接显示。代码块在安装 Pygments 时按标注的语言高亮（``hl-`` 前缀的 class）。
+
+文档按「空行 + 顶格的下一行」切分为互相独立的段，逐段渲染后拼接。流式回复用 ``MarkdownStream``
+逐段渲染已完整的部分，得到的 HTML 与整体渲染的结果一致。
+
+修改渲染结果时增加 RENDERER_REVISION：版本落后的消息在读取时重新渲染，并由后台任务写回。
+"""
+import html
+import re
+
+try:
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+except ImportError:  # Pygments 为可选依赖
+    highlight = None
+
+# 渲染器修订号，输出有变化时加 1
+RENDERER_REVISION = 2
+# 存储的渲染版本：是否高亮代码也会改变输出，安装或卸载 Pygments 后同样会重新渲染
+RENDER_VERSION = RENDERER_REVISION * 10 + (1 if highlight is not None else 0)
+
+# 引用、列表的最大嵌套层数，更深的内容按段落渲染
+MAX_DEPTH = 8
+
+_FENCE_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})[ \t]*([^`\s]*)[^`]*$')
+_HEADING_RE = re.compile(r'^ {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$')
+_HR_RE = re.compile(r'^ {0,3}([-*_])(?:[ \t]*\1){2,}[ \t]*$')
+_LIST_RE = re.compile(r'^( *)([-*+]|\d{1,9}[.)])[ \t]+(\S.*)$')
+_QUOTE_RE = re.compile(r'^ {0,3}> ?(.*)$')
+_TABLE_SEP_RE = re.compile(r'^ *\|? *:?-+:? *(?:\| *:?-+:? *)*\|? *$')
+_LANG_RE = re.compile(r'[^\w+#.-]')
+
+_CODE_SPAN_RE = re.compile(r'(`+)(.+?)(?<!`)\1(?!`)', re.S)
+# \u5730\u5740\u4e2d\u4e0d\u80fd\u5305\u542b\u5360\u4f4d\u7b26\uff08\x00\uff09\uff0c\u5426\u5219\u4ee3\u7801\u7b49\u7247\u6bb5\u4f1a\u88ab\u8fd8\u539f\u5230 href \u4e2d
+_LINK_RE = re.compile(r'(!?)\[([^\[\]\n]+)\]\(\s*<?([^\s()<>\x00]+)>?(?:\s+"[^"\n]*")?\s*\)')
+_AUTOLINK_RE = re.compile(r'(?<![\w/])https?://[^\s<>"\'\x00\u3000-\u303f\uff00-\uffef]+')
+# 强调的内容限制长度，未闭合的标记不会扫描到段落末尾
+_STRONG_RE = re.compile(r'(\*\*|__)(?=\S)(.{1,500}?)(?<=\S)\1', re.S)
+_STRIKE_RE = re.compile(r'~~(?=\S)(.{1,500}?)(?<=\S)~~', re.S)
+_EM_RE = re.compile(r'(?<![*\w])\*(?=[^\s*])(.{1,500}?)(?<=[^\s*])\*(?!\*)'
+                    r'|(?<![_\w])_(?=[^\s_])(.{1,500}?)(?<=[^\s_])_(?!\w)', re.S)
+_STASH_RE = re.compile('\x00(\\d+)\x00')
+_SAFE_SCHEMES = ('http', 'https', 'mailto')
+
+
+def render_markdown(text):
+    """Markdown → HTML（内容均已转义，可直接插入页面）"""
+    segmenter = _Segmenter()
+    segments = [[]]
+    for line in _normalize(text).split('\n'):
+        if segmenter.feed(line):
+            segments.append([])
+        segments[-1].append(line)
+    return '\n'.join(html_ for html_ in (_render_segment(lines) for lines in segments) if html_)
+
+
+def utf16_length(text):
+    """字符串在页面（JavaScript）中的长度"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+class MarkdownStream:
+    """流式回复的增量渲染
+
+    每次 ``feed`` 一个文本块，返回新完成的段渲染出的 HTML（没有时为 None）；``consumed`` 为这些段
+    在原文中的总长度（UTF-16 单位，与页面中的字符串下标一致），之后的部分页面按纯文本显示。
+    """
+
+    def __init__(self):
+        self._segmenter = _Segmenter()
+        self._lines = []
+        self._pending = 0
+        self._partial = ''
+        self.consumed = 0
+
+    def feed(self, chunk):
+        if '\n' not in chunk:
+            self._partial += chunk
+            return None
+        lines = (self._partial + chunk).split('\n')
+        self._partial = lines.pop()
+        rendered = []
+        for raw in lines:
+            line = _normalize(raw)
+            if self._segmenter.feed(line) and self._lines:
+                segment = _render_segment(self._lines)
+                if segment:
+                    rendered.append(segment)
+                self.consumed += self._pending
+                self._lines = []
+                self._pending = 0
+            self._lines.append(line)
+            self._pending += utf16_length(raw) + 1
+        return '\n'.join(rendered) if rendered else None
+
+
+def _normalize(text):
+    return text.replace('\r', '').replace('\x00', '\ufffd').expandtabs(4)
+
+
+class _Segmenter:
+    """按行判断是否开始新的段：段外空行之后的第一个顶格行（代码块内的空行不算），
+    空行隔开的同类列表项仍属于同一个列表"""
+
+    def __init__(self):
+        self._fence = None
+        self._blank = False
+        self._content = False
+        self._list = None
+
+    def feed(self, line):
+        if self._fence is not None:
+            if _closes_fence(line, self._fence):
+                self._fence = None
+            return False
+        if not line.strip():
+            self._blank = self._content
+            return False
+        top = not line.startswith(' ')
+        kind = _list_kind(line) if top else None
+        starts = self._blank and top and (kind is None or kind != self._list)
+        if top:
+            self._list = kind
+        self._blank = False
+        self._content = True
+        match = _FENCE_RE.match(line)
+        if match:
+            self._fence = match.group(1)
+        return starts
+
+
+def _list_kind(line):
+    match = _LIST_RE.match(line)
+    if match is None:
+        return None
+    return 'ol' if match.group(2)[-1] in '.)' else 'ul'
+
+
+def _closes_fence(line, fence):
+    stripped = line.strip()
+    return stripped.startswith(fence) and not stripped.strip(fence[0])
+
+
+def _render_segment(lines):
+    return '\n'.join(_parse_blocks(lines, 0))
+
+
+def _starts_block(lines, i):
+    """该行是否开始段落以外的块（会打断段落）"""
+    line = lines[i]
+    return bool(_FENCE_RE.match(line) or _HEADING_RE.match(line) or _HR_RE.match(line)
+                or _QUOTE_RE.match(line) or _LIST_RE.match(line) or _is_table(lines, i))
+
+
+def _is_table(lines, i):
+    return ('|' in lines[i] and i + 1 < len(lines) and '|' in lines[i + 1]
+            and '-' in lines[i + 1] and bool(_TABLE_SEP_RE.match(lines[i + 1])))
+
+
+def _parse_blocks(lines, depth):
+    blocks = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not line.strip():
+            i += 1
+            continue
+
+        match = _FENCE_RE.match(line)
+        if match:
+            fence, lang = match.group(1), match.group(2)
+            indent = len(line) - len(line.lstrip(' '))
+            code = []
+            i += 1
+            while i < len(lines) and not _closes_fence(lines[i], fence):
+                code.append(_strip_indent(lines[i], indent))
+                i += 1
+            i += 1
+            blocks.append(_code_block('\n'.join(code), lang))
+            continue
+
+        match = _HEADING_RE.match(line)
+        if match:
+            level = len(match.group(1))
+            blocks.append('<h%d>%s</h%d>' % (level, _inline(match.group(2) or ''), level))
+            i += 1
+            continue
+
+        if _HR_RE.match(line):
+            blocks.append('<hr>')
+            i += 1
+            continue
+
+        if depth < MAX_DEPTH and _QUOTE_RE.match(line):
+            quoted = []
+            while i < len(lines):
+                match = _QUOTE_RE.match(lines[i])
+                if not match:
+                    break
+                quoted.append(match.group(1))
+                i += 1
+            blocks.append('<blockquote>%s</blockquote>' % '\n'.join(_parse_blocks(quoted, depth + 1)))
+            continue
+
+        if _is_table(lines, i):
+            html_, i = _parse_table(lines, i)
+            blocks.append(html_)
+            continue
+
+        if depth < MAX_DEPTH and _LIST_RE.match(line):
+            html_, i = _parse_list(lines, i, depth)
+            blocks.append(html_)
+            continue
+
+        paragraph = [line.strip()]
+        i += 1
+        while i < len(lines) and lines[i].strip() and not _starts_block(lines, i):
+            paragraph.append(lines[i].strip())
+            i += 1
+        blocks.append('<p>%s</p>' % _inline('\n'.join(paragraph)))
+    return blocks
+
+
+def _strip_indent(line, count):
+    """去掉行首至多 count 个空格"""
+    stripped = line.lstrip(' ')
+    return line[min(count, len(line) - len(stripped)):]
+
+
+def _code_block(code, lang):
+    lang = _LANG_RE.sub('', lang)[:32]
+    body = None
+    if lang and highlight is not None:
+        try:
+            lexer = get_lexer_by_name(lang)
+        except ClassNotFound:
+            lexer = None
+        if lexer is not None:
+            body = highlight(code, lexer, HtmlFormatter(nowrap=True, classprefix='hl-')).rstrip('\n')
+    if body is None:
+        body = html.escape(code, quote=False)
+    if lang:
+        return '<pre><code class="language-%s">%s</code></pre>' % (html.escape(lang), body)
+    return '<pre><code>%s</code></pre>' % body
+
+
+def _parse_list(lines, i, depth):
+    first = _LIST_RE.match(lines[i])
+    indent = len(first.group(1))
+    ordered = first.group(2)[-1] in '.)'
+    items = []
+    while i < len(lines):
+        match = _LIST_RE.match(lines[i])
+        if not match or len(match.group(1)) > indent + 1 or (match.group(2)[-1] in '.)') != ordered:
+            break
+        content_indent = len(lines[i]) - len(match.group(3))
+        content = [match.group(3)]
+        i += 1
+        loose = False
+        while i < len(lines):
+            line = lines[i]
+            if not line.strip():
+                # 空行之后缩进的行仍属于本项
+                j = i + 1
+                while j < len(lines) and not lines[j].strip():
+                    j += 1
+                if j < len(lines) and len(lines[j]) - len(lines[j].lstrip(' ')) > indent:
+                    content.extend([''] * (j - i))
+                    loose = True
+                    i = j
+                    continue
+                break
+            leading = len(line) - len(line.lstrip(' '))
+            if leading > indent:
+                content.append(_strip_indent(line, content_indent))
+            elif _starts_block(lines, i):
+                break
+            else:
+                # 段落的延续行
+                content.append(line.strip())
+            i += 1
+        blocks = _parse_blocks(content, depth + 1)
+        if not loose:
+            blocks = [b[3:-4] if b.startswith('<p>') and b.endswith('</p>') else b for b in blocks]
+        items.append('<li>%s</li>' % '\n'.join(blocks))
+        # 项之间的空行
+        j = i
+        while j < len(lines) and not lines[j].strip():
+            j += 1
+        if j > i and j < len(lines) and _LIST_RE.match(lines[j]):
+            i = j
+
+    if ordered:
+        start = int(first.group(2)[:-1])
+        tag = '<ol>' if start == 1 else '<ol start="%d">' % start
+        return '%s\n%s\n</ol>' % (tag, '\n'.join(items)), i
+    return '<ul>\n%s\n</ul>' % '\n'.join(items), i
+
+
+def _split_row(line):
+    line = line.strip()
+    if line.startswith('|'):
+        line = line[1:]
+    if line.endswith('|') and not line.endswith('\\|'):
+        line = line[:-1]
+    return [cell.strip().replace('\\|', '|') for cell in re.split(r'(?<!\\)\|', line)]
+
+
+def _parse_table(lines, i):
+    header = _split_row(lines[i])
+    aligns = []
+    for cell in _split_row(lines[i + 1]):
+        if cell.startswith(':') and cell.endswith(':'):
+            aligns.append(' style="text-align:center"')
+        elif cell.endswith(':'):
+            aligns.append(' style="text-align:right"')
+        elif cell.startswith(':'):
+            aligns.append(' style="text-align:left"')
+        else:
+            aligns.append('')
+    width = len(header)
+    aligns = (aligns + [''] * width)[:width]
+
+    def row(cells, tag):
+        cells = (cells + [''] * width)[:width]
+        return '<tr>%s</tr>' % ''.join('<%s%s>%s</%s>' % (tag, align, _inline(cell), tag)
+                                       for cell, align in zip(cells, aligns))
+
+    rows = []
+    i += 2
+    while i < len(lines) and lines[i].strip() and '|' in lines[i]:
+        rows.append(row(_split_row(lines[i]), 'td'))
+        i += 1
+    body = '<tbody>%s</tbody>' % ''.join(rows) if rows else ''
+    return '<table><thead>%s</thead>%s</table>' % (row(header, 'th'), body), i
+
+
+def _safe_url(url):
+    """允许的链接地址（已反转义），不允许时返回 None"""
+    url = html.unescape(url)
+    probe = re.sub(r'[\x00-\x20\x7f]', '', url).lower()
+    if ':' in probe.split('/', 1)[0].split('?', 1)[0].split('#', 1)[0]:
+        if probe.split(':', 1)[0] not in _SAFE_SCHEMES:
+            return None
+    return url
+
+
+def _link(url, label_html):
+    return '<a href="%s" target="_blank" rel="noopener noreferrer nofollow">%s</a>' % (
+        html.escape(url), label_html)
+
+
+def _inline(text, stash=None, links=True):
+    """行内语法；代码与链接先替换为占位符，其余文本转义后再处理强调
+
+    链接文字递归渲染时传入外层的 stash（其中已有外层代码的占位符），返回未还原的文本，由外层统一还原；
+    链接文字中不再识别链接，避免嵌套的 <a>。
+    """
+    nested = stash is not None
+    if not nested:
+        stash = []
+
+    def keep(fragment):
+        stash.append(fragment)
+        return '\x00%d\x00' % (len(stash) - 1)
+
+    def code_span(match):
+        code = match.group(2)
+        if code.startswith(' ') and code.endswith(' ') and code.strip():
+            code = code[1:-1]
+        return keep('<code>%s</code>' % html.escape(code.replace('\n', ' '), quote=False))
+
+    def link(match):
+        url = _safe_url(match.group(3))
+        if url is None:
+            return keep(html.escape(match.group(0), quote=False))
+        return keep(_link(url, _inline(match.group(2), stash, links=False)))
+
+    def autolink(match):
+        url = match.group(0)
+        trailing = ''
+        while url and (url[-1] in '.,;:!?*_~' or (url[-1] == ')' and url.count('(') < url.count(')'))):
+            trailing = url[-1] + trailing
+            url = url[:-1]
+        return keep(_link(url, html.escape(url, quote=False))) + trailing
+
+    text = _CODE_SPAN_RE.sub(code_span, text)
+    if links:
+        text = _LINK_RE.sub(link, text)
+        text = _AUTOLINK_RE.sub(autolink, text)
+    text = html.escape(text, quote=False)
+    text = _STRONG_RE.sub(r'<strong>\2</strong>', text)
+    text = _STRIKE_RE.sub(r'<del>\1</del>', text)
+    text = _EM_RE.sub(lambda m: '<em>%s</em>' % (m.group(1) or m.group(2)), text)
+    text = text.replace('\n', '<br>\n')
+    if nested:
+        return text
+
+    def restore(match):
+        # 占位符的内容中可能还有占位符（链接文字中的代码）
+        return _STASH_RE.sub(restore, stash[int(match.group(1))])
+
+    return _STASH_RE.sub(restore, text)
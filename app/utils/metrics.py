@@ -0,0 +1,117 @@
+"""
+进程内指标
+
+提供计数器（counter）、瞬时值（gauge）与直方图（histogram）三类指标，
+线程安全，供连接池、流式输出等模块记录运行数据，
+由管理后台 ``/admin/metrics`` 以 JSON 输出。
+
+指标保存在当前进程内，多 worker 部署时每个 worker 各自统计。
+"""
+import bisect
+import threading
+
+# 直方图默认分桶上界（毫秒）
+DEFAULT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """固定分桶直方图，记录次数、总和、最大值与各分桶计数"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """按分桶估算分位数，返回所在分桶的上界（超出最大分桶时返回最大值）"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return float(self.buckets[i]) if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        buckets = {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'avg': round(self.total / self.count, 3) if self.count else 0.0,
+            'max': round(self.max, 3),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': buckets
+        }
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1):
+        """计数器累加"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """设置瞬时值"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def add_gauge(self, name, delta):
+        """瞬时值增减"""
+        with self._lock:
+            self._gauges[name] = self._gauges.get(name, 0) + delta
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS):
+        """记录一次直方图观测值"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def get(self, name, default=0):
+        """读取计数器或瞬时值"""
+        with self._lock:
+            if name in self._counters:
+                return self._counters[name]
+            return self._gauges.get(name, default)
+
+    def snapshot(self):
+        """导出全部指标"""
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'histograms': {name: h.snapshot() for name, h in self._histograms.items()}
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+# 全局指标注册表
+metrics = MetricsRegistry()
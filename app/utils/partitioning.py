@@ -0,0 +1,342 @@
+"""
+消息表按月分区（仅 PostgreSQL，MESSAGES_PARTITIONING=true 时启用）
+
+消息表只增不改，按 created_at 做原生范围分区（每月一个分区，另有一个 DEFAULT 分区
+兜底）后：
+
+* 带时间条件的查询（今日消息数、对话内按对话创建时间限定下界的查询，见
+  ``Message.partition_window``）只扫描相关分区；
+* 按保留期清理历史消息只需 DETACH + DROP 整个分区，不产生大量删除与膨胀。
+
+分区表的主键为 (id, created_at)，ORM 中仍以 id 作为主键，查询与写入方式不变。
+
+已有数据的 messages 表在线转换为分区表，分三步：
+
+1. ``prepare``：创建结构相同的分区表 messages_partitioned 及所需分区，并在原表上安装
+   触发器，把之后的插入、修改与删除同步到新表；
+2. ``backfill``：按 ID 分批复制已有数据，每批单独提交（FOR SHARE 锁住本批源行，
+   避免与并发修改交错），期间读写照常；
+3. ``swap``：在一个短事务内锁表、改名互换并移交 ID 序列，原表改名为
+   messages_unpartitioned（去掉外键）保留备查，确认无误后手动删除。
+
+空表在 ``setup`` 中直接完成转换；有数据时由 ``flask partitions convert`` 执行第 2、3 步。
+未来月份的分区由 ``ensure_partitions`` 提前创建（部署时与运行中每小时一次的后台任务），
+漏建期间写入的消息落在 DEFAULT 分区，建分区时移入对应的月分区。
+"""
+import logging
+import re
+from datetime import date, datetime
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'messages'
+SHADOW_TABLE = 'messages_partitioned'
+OLD_TABLE = 'messages_unpartitioned'
+DEFAULT_PARTITION = 'messages_pdefault'
+MIRROR_TRIGGER = 'messages_partition_mirror'
+
+_PARTITION_NAME = re.compile(r'^messages_p(\d{4})_(\d{2})$')
+
+
+def month_start(value):
+    """value 所在月份的第一天"""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    """月份（每月第一天）加减 count 个月"""
+    years, index = divmod(month.month - 1 + count, 12)
+    return date(month.year + years, index + 1, 1)
+
+
+def partition_name(month):
+    return 'messages_p%04d_%02d' % (month.year, month.month)
+
+
+def is_postgresql(conn):
+    return conn.dialect.name == 'postgresql'
+
+
+def _relkind(conn, name):
+    return conn.execute(
+        text('SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)'), {'name': name}
+    ).scalar()
+
+
+def is_partitioned(conn):
+    """messages 是否已是分区表"""
+    return _relkind(conn, TABLE) == 'p'
+
+
+def message_tables(conn):
+    """修改消息表结构的迁移需处理的表
+
+    分区转换进行中（``prepare`` 之后、``swap`` 之前）时同时返回分区表：同步触发器按整行复制，
+    两表的结构需保持一致。
+    """
+    tables = [TABLE]
+    if is_postgresql(conn) and _relkind(conn, SHADOW_TABLE):
+        tables.append(SHADOW_TABLE)
+    return tables
+
+
+def list_partitions(conn, parent=TABLE):
+    """分区列表（按名称排序），month 为分区对应月份的第一天，DEFAULT 分区为 None
+
+    rows 为统计信息中的估算行数（尚未 ANALYZE 时为 None）。
+    """
+    rows = conn.execute(text(
+        'SELECT c.relname, c.reltuples::bigint, pg_total_relation_size(c.oid) '
+        'FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = to_regclass(:parent) ORDER BY c.relname'
+    ), {'parent': parent}).all()
+    partitions = []
+    for name, estimate, size in rows:
+        match = _PARTITION_NAME.match(name)
+        partitions.append({
+            'name': name,
+            'month': date(int(match.group(1)), int(match.group(2)), 1) if match else None,
+            'rows': estimate if estimate >= 0 else None,
+            'size_bytes': size
+        })
+    return partitions
+
+
+def create_partition(conn, month, parent=TABLE):
+    """创建 month 所在月份的分区，已存在时跳过
+
+    DEFAULT 分区中已有该月的消息时（漏建期间写入），先建成普通表并把这些消息移入，
+    再挂载为分区。
+
+    Returns:
+        bool: 是否新建了分区
+    """
+    name = partition_name(month)
+    if _relkind(conn, name):
+        return False
+
+    bounds = "FOR VALUES FROM ('%s') TO ('%s')" % (month.isoformat(), add_months(month, 1).isoformat())
+    in_range = {'start': month, 'end': add_months(month, 1)}
+    stray = _relkind(conn, DEFAULT_PARTITION) and conn.execute(text(
+        'SELECT EXISTS (SELECT 1 FROM %s WHERE created_at >= :start AND created_at < :end)' % DEFAULT_PARTITION
+    ), in_range).scalar()
+
+    if stray:
+        conn.execute(text('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)' % (name, parent)))
+        moved = conn.execute(text(
+            'WITH moved AS (DELETE FROM %s WHERE created_at >= :start AND created_at < :end RETURNING *) '
+            'INSERT INTO %s SELECT * FROM moved' % (DEFAULT_PARTITION, name)
+        ), in_range).rowcount
+        conn.execute(text('ALTER TABLE %s ATTACH PARTITION %s %s' % (parent, name, bounds)))
+        logger.warning("已从默认分区移入 %d 条消息: %s", moved, name)
+    else:
+        conn.execute(text('CREATE TABLE %s PARTITION OF %s %s' % (name, parent, bounds)))
+    logger.info("已创建消息分区: %s", name)
+    return True
+
+
+def ensure_partitions(conn, months_ahead, parent=TABLE, today=None):
+    """确保当前月份及之后 months_ahead 个月的分区存在
+
+    Returns:
+        list: 新建的分区名
+    """
+    current = month_start(today or datetime.utcnow())
+    return [
+        partition_name(add_months(current, offset))
+        for offset in range(months_ahead + 1)
+        if create_partition(conn, add_months(current, offset), parent)
+    ]
+
+
+def drop_partitions_before(conn, cutoff, dry_run=False):
+    """删除结束时间不晚于 cutoff（某月第一天）的月分区，即 cutoff 之前的全部消息
+
+    Returns:
+        list: 删除（dry_run 时为将要删除）的分区
+    """
+    expired = [p for p in list_partitions(conn) if p['month'] and add_months(p['month'], 1) <= cutoff]
+    if dry_run:
+        return expired
+    for partition in expired:
+        conn.execute(text('ALTER TABLE %s DETACH PARTITION %s' % (TABLE, partition['name'])))
+        conn.execute(text('DROP TABLE %s' % partition['name']))
+        logger.info("已删除消息分区: %s", partition['name'])
+    return expired
+
+
+def prepare(conn, months_ahead):
+    """创建分区表与同步触发器（转换第 1 步），已完成时跳过
+
+    Returns:
+        bool: 是否执行了本步骤
+    """
+    if _relkind(conn, SHADOW_TABLE):
+        return False
+
+    inspector = inspect(conn)
+    # 分区键不能为空；应用写入时总会设置 created_at，这里只处理极早期可能遗留的空值
+    conn.execute(text(
+        "UPDATE %s SET created_at = now() AT TIME ZONE 'utc' WHERE created_at IS NULL" % TABLE
+    ))
+    conn.execute(text(
+        'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (created_at)'
+        % (SHADOW_TABLE, TABLE)
+    ))
+    conn.execute(text('ALTER TABLE %s ALTER COLUMN created_at SET NOT NULL' % SHADOW_TABLE))
+    conn.execute(text('ALTER TABLE %s ADD CONSTRAINT %s_pkey PRIMARY KEY (id, created_at)'
+                      % (SHADOW_TABLE, SHADOW_TABLE)))
+    for fk in inspector.get_foreign_keys(TABLE):
+        conn.execute(text('ALTER TABLE %s ADD CONSTRAINT %s FOREIGN KEY (%s) REFERENCES %s (%s)' % (
+            SHADOW_TABLE, fk['name'], ', '.join(fk['constrained_columns']),
+            fk['referred_table'], ', '.join(fk['referred_columns'])
+        )))
+    for index in inspector.get_indexes(TABLE):
+        # 唯一索引必须包含分区键，表达式索引无法按列重建，均需手动处理
+        if index['unique'] or None in index['column_names']:
+            logger.warning("分区表未复制索引: %s", index['name'])
+            continue
+        conn.execute(text('CREATE INDEX %s_part ON %s (%s)' % (
+            index['name'], SHADOW_TABLE, ', '.join(index['column_names'])
+        )))
+
+    # 覆盖已有数据的全部月份，之前的落入 DEFAULT 分区
+    earliest = conn.execute(text('SELECT min(created_at) FROM %s' % TABLE)).scalar()
+    month = month_start(earliest or datetime.utcnow())
+    while month <= month_start(datetime.utcnow()):
+        create_partition(conn, month, SHADOW_TABLE)
+        month = add_months(month, 1)
+    ensure_partitions(conn, months_ahead, SHADOW_TABLE)
+    conn.execute(text('CREATE TABLE %s PARTITION OF %s DEFAULT' % (DEFAULT_PARTITION, SHADOW_TABLE)))
+
+    conn.execute(text('''
+        CREATE FUNCTION %(trigger)s() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM %(shadow)s WHERE id = OLD.id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO %(shadow)s SELECT (NEW).* ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    ''' % {'trigger': MIRROR_TRIGGER, 'shadow': SHADOW_TABLE}))
+    conn.execute(text(
+        'CREATE TRIGGER %(trigger)s AFTER INSERT OR UPDATE OR DELETE ON %(table)s '
+        'FOR EACH ROW EXECUTE FUNCTION %(trigger)s()' % {'trigger': MIRROR_TRIGGER, 'table': TABLE}
+    ))
+    logger.info("已创建消息分区表并开始同步写入: %s", SHADOW_TABLE)
+    return True
+
+
+def backfill(engine, batch_size=5000, progress=None):
+    """按 ID 分批把原表数据复制到分区表（转换第 2 步），每批一个事务
+
+    可以中断后重新执行：已复制的行因主键冲突被跳过。
+
+    Returns:
+        int: 处理的行数
+    """
+    total = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            row = conn.execute(text(
+                'WITH batch AS (SELECT * FROM %(table)s WHERE id > :last_id ORDER BY id LIMIT :limit FOR SHARE), '
+                'copied AS (INSERT INTO %(shadow)s SELECT * FROM batch ON CONFLICT DO NOTHING) '
+                'SELECT max(id), count(*) FROM batch' % {'table': TABLE, 'shadow': SHADOW_TABLE}
+            ), {'last_id': last_id, 'limit': batch_size}).one()
+        if not row[1]:
+            return total
+        last_id = row[0]
+        total += row[1]
+        if progress:
+            progress(total, last_id)
+
+
+def swap(conn, keep_old=True):
+    """在当前事务中用分区表替换原表（转换第 3 步）
+
+    原表改名为 messages_unpartitioned 并去掉外键（之后删除对话不再受其约束），
+    keep_old 为 False 时直接删除。
+    """
+    # 等锁期间后续的读写都会排在后面，拿不到锁时放弃本次切换
+    conn.execute(text("SET LOCAL lock_timeout = '10s'"))
+    conn.execute(text('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' % TABLE))
+
+    inspector = inspect(conn)
+    foreign_keys = inspector.get_foreign_keys(TABLE)
+    indexes = [index['name'] for index in inspector.get_indexes(TABLE)]
+    pkey = inspector.get_pk_constraint(TABLE)['name']
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {'table': TABLE}).scalar()
+
+    conn.execute(text('DROP TRIGGER %s ON %s' % (MIRROR_TRIGGER, TABLE)))
+    conn.execute(text('DROP FUNCTION %s()' % MIRROR_TRIGGER))
+    for fk in foreign_keys:
+        conn.execute(text('ALTER TABLE %s DROP CONSTRAINT %s' % (TABLE, fk['name'])))
+    conn.execute(text('ALTER TABLE %s RENAME TO %s' % (TABLE, OLD_TABLE)))
+    for name in indexes + [pkey]:
+        conn.execute(text('ALTER INDEX %s RENAME TO %s_old' % (name, name)))
+
+    conn.execute(text('ALTER TABLE %s RENAME TO %s' % (SHADOW_TABLE, TABLE)))
+    conn.execute(text('ALTER INDEX %s_pkey RENAME TO %s' % (SHADOW_TABLE, pkey)))
+    for name in indexes:
+        if _relkind(conn, '%s_part' % name):
+            conn.execute(text('ALTER INDEX %s_part RENAME TO %s' % (name, name)))
+    if sequence:
+        conn.execute(text('ALTER SEQUENCE %s OWNED BY %s.id' % (sequence, TABLE)))
+
+    if not keep_old:
+        conn.execute(text('DROP TABLE %s' % OLD_TABLE))
+    conn.execute(text('SET LOCAL lock_timeout TO DEFAULT'))
+    logger.info("消息表已切换为分区表%s", '' if keep_old else '，原表已删除')
+
+
+def convert(engine, months_ahead, batch_size=5000, keep_old=True, progress=None):
+    """在线把 messages 转换为分区表（prepare → backfill → swap），已转换时跳过
+
+    Returns:
+        int or None: 复制的行数；已是分区表时为 None
+    """
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            return None
+        prepare(conn, months_ahead)
+    total = backfill(engine, batch_size, progress)
+    with engine.begin() as conn:
+        swap(conn, keep_old)
+    return total
+
+
+def setup(conn, months_ahead):
+    """部署时调用（迁移与 flask bootstrap），在当前事务中执行
+
+    已是分区表时补建未来月份的分区；否则创建分区表与同步触发器，原表为空时直接完成切换，
+    有数据时需另行执行 ``flask partitions convert``。
+
+    Returns:
+        bool: messages 是否已是分区表
+    """
+    if is_partitioned(conn):
+        ensure_partitions(conn, months_ahead)
+        return True
+    prepare(conn, months_ahead)
+    if conn.execute(text('SELECT EXISTS (SELECT 1 FROM %s)' % TABLE)).scalar():
+        logger.warning("消息表已有数据，分区表会同步新写入，请执行 flask partitions convert 完成转换")
+        return False
+    swap(conn, keep_old=False)
+    return True
+
+
+def status(conn):
+    """当前的分区状态（管理命令显示）"""
+    partitioned = is_partitioned(conn)
+    return {
+        'partitioned': partitioned,
+        'converting': not partitioned and bool(_relkind(conn, SHADOW_TABLE)),
+        'old_table': bool(_relkind(conn, OLD_TABLE)),
+        'partitions': list_partitions(conn, TABLE if partitioned else SHADOW_TABLE)
+    }
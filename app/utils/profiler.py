@@ -0,0 +1,398 @@
+"""
+采样分析器
+
+管理员按需在线上 worker 中开启的统计采样分析器：后台线程按固定间隔读取
+``sys._current_frames()``，把各线程的调用栈累计为 flame graph 的折叠栈格式
+（``根;调用者;被调用者 次数``，可直接用于 flamegraph.pl / speedscope），
+不需要在进程外附加分析器。
+
+两种模式：
+
+* ``duration``: 对当前 worker 的全部线程采样 N 秒，以线程名为根；默认去掉处于
+  等待状态的样本（等待锁/队列、select、读取 socket 等），只保留占用 CPU 的调用栈；
+* ``requests``: 只对接下来 N 个匹配路由的请求所在线程采样（包括流式输出阶段，
+  直到响应关闭），以 ``方法 路由`` 为根，保留等待上游的样本。
+
+开销限制：同一 worker 同时只允许一个会话；时长、请求数、采样间隔、栈深度与不同栈
+的数量均有上限；采样线程自身的 CPU 时间超过预算（PROFILER_MAX_OVERHEAD，按单核
+比例）时自动加大采样间隔。未开启会话时请求钩子只读取一次属性。
+
+结果写入 PROFILER_DIR（折叠栈 ``.collapsed`` 与元数据 ``.json``），任何 worker 都
+可以列出和下载。采样基于线程，适用于 sync / gthread worker。
+"""
+import collections
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from flask import g, request
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MODE_DURATION = 'duration'
+MODE_REQUESTS = 'requests'
+
+MIN_INTERVAL_MS = 5
+MAX_INTERVAL_MS = 200
+MAX_DEPTH = 100
+
+# 栈顶（最内层 Python 帧）为这些函数时视为线程在等待而不是占用 CPU
+IDLE_LEAVES = frozenset([
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),
+    ('socketserver.py', 'serve_forever'),
+    ('socket.py', 'accept'),
+    ('socket.py', 'readinto'),
+    ('ssl.py', 'read'),
+    ('sync.py', 'wait'),
+])
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _short_path(filename):
+    """项目内文件使用相对路径，第三方包去掉 site-packages 之前的部分"""
+    if filename.startswith(_ROOT_DIR + os.sep):
+        return os.path.relpath(filename, _ROOT_DIR)
+    marker = 'site-packages' + os.sep
+    index = filename.rfind(marker)
+    if index >= 0:
+        return filename[index + len(marker):]
+    return os.path.basename(filename)
+
+
+class ProfileSession:
+    """一次采样会话，样本只在采样线程中累计"""
+
+    def __init__(self, mode, seconds, interval_ms, route=None, requests=0,
+                 include_idle=False, max_stacks=5000):
+        self.id = '%s-%03d-%d' % (time.strftime('%Y%m%d-%H%M%S'), int(time.time() * 1000) % 1000, os.getpid())
+        self.mode = mode
+        self.seconds = seconds
+        self.interval_ms = interval_ms
+        self.route = route
+        self.requests = requests
+        self.include_idle = include_idle
+        self.max_stacks = max_stacks
+        self.started_at = time.time()
+        self.ended_at = None
+        self.end_reason = None
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self.overflow_samples = 0
+        self.throttled = 0
+        self.completed = 0
+        # 采样线程自身消耗的 CPU 时间
+        self.cpu_ms = None
+        # requests 模式：线程 ident -> 根节点名称
+        self.targets = {}
+        self._remaining = requests
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    # ---- requests 模式 ----
+
+    def matches(self, endpoint, rule):
+        """路由可以是端点名（chat.send_message）、URL 规则（/api/chat/send）或以 * 结尾的路径前缀"""
+        route = self.route
+        if route.endswith('*'):
+            return rule.startswith(route[:-1])
+        return route == endpoint or route == rule
+
+    def claim(self, ident, root):
+        with self._lock:
+            if self._remaining <= 0 or self._stop.is_set():
+                return False
+            self._remaining -= 1
+            self.targets[ident] = root
+            return True
+
+    def release(self, ident):
+        with self._lock:
+            if self.targets.pop(ident, None) is None:
+                return
+            self.completed += 1
+            if self._remaining <= 0 and not self.targets:
+                self.end_reason = self.end_reason or 'done'
+                self._stop.set()
+
+    # ---- 采样 ----
+
+    def _frame_info(self, code):
+        info = self._labels.get(code)
+        if info is None:
+            filename = code.co_filename
+            label = '%s (%s:%d)' % (code.co_name, _short_path(filename), code.co_firstlineno)
+            idle = (os.path.basename(filename), code.co_name) in IDLE_LEAVES
+            info = self._labels[code] = (label.replace(';', ':'), idle)
+        return info
+
+    def _add(self, root, frame, skip_idle):
+        label, idle = self._frame_info(frame.f_code)
+        if skip_idle and idle:
+            self.idle_samples += 1
+            return
+        stack = [label]
+        frame = frame.f_back
+        while frame is not None and len(stack) < MAX_DEPTH:
+            stack.append(self._frame_info(frame.f_code)[0])
+            frame = frame.f_back
+        if frame is not None:
+            stack.append('[truncated]')
+        stack.append(root)
+        stack.reverse()
+        key = ';'.join(stack)
+        self.samples += 1
+        if key in self.stacks or len(self.stacks) < self.max_stacks:
+            self.stacks[key] += 1
+        else:
+            self.stacks[root + ';[other]'] += 1
+            self.overflow_samples += 1
+
+    def sample(self, own_ident):
+        frames = sys._current_frames()
+        try:
+            if self.mode == MODE_REQUESTS:
+                for ident, root in list(self.targets.items()):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self._add(root, frame, False)
+            else:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in frames.items():
+                    if ident != own_ident:
+                        self._add(names.get(ident) or 'thread-%d' % ident, frame, not self.include_idle)
+        finally:
+            # 不持有其他线程的帧对象，避免延长局部变量的生命周期
+            del frames
+
+    def stop(self, reason):
+        self.end_reason = self.end_reason or reason
+        self._stop.set()
+
+    def summary(self):
+        now = self.ended_at or time.time()
+        return {
+            'id': self.id,
+            'pid': os.getpid(),
+            'mode': self.mode,
+            'route': self.route,
+            'requests': self.requests,
+            'completed_requests': self.completed,
+            'active_requests': len(self.targets),
+            'seconds': self.seconds,
+            'interval_ms': self.interval_ms,
+            'include_idle': self.include_idle,
+            'started_at': self.started_at,
+            'elapsed_s': round(now - self.started_at, 3),
+            'running': self.ended_at is None,
+            'end_reason': self.end_reason,
+            'samples': self.samples,
+            'idle_samples': self.idle_samples,
+            'overflow_samples': self.overflow_samples,
+            'unique_stacks': len(self.stacks),
+            'throttled': self.throttled,
+            'cpu_ms': self.cpu_ms
+        }
+
+    def collapsed(self):
+        """折叠栈文本，按次数降序"""
+        return ''.join('%s %d\n' % (stack, count) for stack, count in self.stacks.most_common())
+
+
+class SamplingProfiler:
+    """当前 worker 的采样分析器，同一时间只运行一个会话"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.session = None
+        self.last = None
+        self.directory = os.path.abspath(os.path.join('logs', 'profiles'))
+        self.interval_ms = 10
+        self.max_seconds = 120
+        self.max_requests = 100
+        self.max_stacks = 5000
+        self.max_overhead = 0.02
+        self.keep = 20
+
+    def configure(self, config):
+        self.directory = os.path.abspath(config['PROFILER_DIR'])
+        self.interval_ms = config['PROFILER_INTERVAL_MS']
+        self.max_seconds = config['PROFILER_MAX_SECONDS']
+        self.max_requests = config['PROFILER_MAX_REQUESTS']
+        self.max_stacks = config['PROFILER_MAX_STACKS']
+        self.max_overhead = config['PROFILER_MAX_OVERHEAD']
+        self.keep = config['PROFILER_KEEP']
+
+    def start(self, mode=MODE_DURATION, seconds=10, interval_ms=None, route=None, requests=0, include_idle=False):
+        """开启采样会话；参数不合法或已有会话运行时抛出 ValueError"""
+        if mode not in (MODE_DURATION, MODE_REQUESTS):
+            raise ValueError('未知的采样模式')
+        seconds = float(seconds)
+        if not 0 < seconds <= self.max_seconds:
+            raise ValueError('采样时长必须在 0 到 %d 秒之间' % self.max_seconds)
+        interval_ms = int(interval_ms or self.interval_ms)
+        interval_ms = max(MIN_INTERVAL_MS, min(MAX_INTERVAL_MS, interval_ms))
+        if mode == MODE_REQUESTS:
+            route = (route or '').strip()
+            requests = int(requests or 0)
+            if not route:
+                raise ValueError('请填写要采样的路由')
+            if not 0 < requests <= self.max_requests:
+                raise ValueError('请求数必须在 1 到 %d 之间' % self.max_requests)
+        else:
+            route, requests = None, 0
+
+        with self._lock:
+            if self.session is not None:
+                raise ValueError('当前 worker 已有采样会话在运行')
+            session = ProfileSession(mode, seconds, interval_ms, route, requests,
+                                     include_idle, self.max_stacks)
+            self.session = session
+        thread = threading.Thread(target=self._run, args=(session,), name='profiler', daemon=True)
+        thread.start()
+        logger.info("采样分析开始: %s mode=%s route=%s", session.id, mode, route)
+        return session.summary()
+
+    def stop(self):
+        session = self.session
+        if session is None:
+            return False
+        session.stop('stopped')
+        return True
+
+    def status(self):
+        session = self.session
+        return {
+            'current': session.summary() if session is not None else None,
+            'last': self.last
+        }
+
+    def _run(self, session):
+        own_ident = threading.get_ident()
+        interval = session.interval_ms / 1000.0
+        wall_start = time.monotonic()
+        deadline = wall_start + session.seconds
+        cpu_start = cpu_mark = time.thread_time()
+        wall_mark = wall_start
+        ticks = 0
+        try:
+            while not session._stop.wait(interval):
+                now = time.monotonic()
+                if now >= deadline:
+                    session.stop('timeout')
+                    break
+                session.sample(own_ident)
+                ticks += 1
+                # 每 50 次采样检查一次这段时间内自身的 CPU 占用，超出预算时加大采样间隔；
+                # 第一段包含帧名称缓存的预热，不参与判断
+                if ticks % 50 == 0:
+                    cpu = time.thread_time()
+                    if (ticks > 50 and cpu - cpu_mark > (now - wall_mark) * self.max_overhead
+                            and interval * 1000 < MAX_INTERVAL_MS):
+                        interval = min(interval * 2, MAX_INTERVAL_MS / 1000.0)
+                        session.throttled += 1
+                    cpu_mark, wall_mark = cpu, now
+        except Exception:
+            logger.exception("采样分析异常: %s", session.id)
+            session.stop('error')
+        finally:
+            session.interval_ms = round(interval * 1000)
+            session.cpu_ms = round((time.thread_time() - cpu_start) * 1000, 1)
+            session.ended_at = time.time()
+            self._finish(session)
+
+    def _finish(self, session):
+        summary = session.summary()
+        try:
+            self._write(session, summary)
+        except OSError:
+            logger.exception("保存采样结果失败: %s", session.id)
+        with self._lock:
+            self.session = None
+            self.last = summary
+        metrics.inc('profiler.sessions')
+        metrics.inc('profiler.samples', session.samples)
+        logger.info("采样分析结束: %s samples=%d reason=%s", session.id, session.samples, session.end_reason)
+
+    def _write(self, session, summary):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, session.id)
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            f.write(session.collapsed())
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False)
+        self._prune()
+
+    def _prune(self):
+        names = sorted(name[:-len('.json')] for name in os.listdir(self.directory) if name.endswith('.json'))
+        for name in names[:-self.keep] if self.keep > 0 else []:
+            for suffix in ('.json', '.collapsed'):
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except OSError:
+                    pass
+
+    def list_profiles(self):
+        """已保存的采样结果（所有 worker），按时间倒序"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def profile_path(self, profile_id):
+        """下载文件路径；ID 不合法或文件不存在时返回 None"""
+        name = os.path.basename(profile_id or '')
+        if not name or name != profile_id:
+            return None
+        path = os.path.join(self.directory, name + '.collapsed')
+        return path if os.path.isfile(path) else None
+
+
+# 每个 worker 进程一个实例
+profiler = SamplingProfiler()
+
+
+def _profile_request():
+    session = profiler.session
+    if session is None or session.mode != MODE_REQUESTS:
+        return
+    rule = request.url_rule.rule if request.url_rule is not None else request.path
+    if not session.matches(request.endpoint, rule):
+        return
+    ident = threading.get_ident()
+    if session.claim(ident, '%s %s' % (request.method, rule)):
+        g.profile_release = functools.partial(session.release, ident)
+
+
+def _release_request(response):
+    release = g.pop('profile_release', None)
+    if release is not None:
+        # 流式响应在视图返回后才输出，响应关闭时才结束该请求的采样
+        response.call_on_close(release)
+    return response
+
+
+def init_profiler(app):
+    """读取配置并注册请求钩子"""
+    profiler.configure(app.config)
+    app.before_request(_profile_request)
+    app.after_request(_release_request)
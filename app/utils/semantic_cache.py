@@ -0,0 +1,295 @@
+"""
+语义缓存（近似重复问题的回答缓存）
+
+相当一部分流量是常见问题的不同说法。对新对话的第一条消息（单轮、无历史），先在缓存中
+查找语义相近的问题，相似度达到阈值时直接返回缓存的回答，不再调用上游。
+
+- 向量化：文本经 NFKC 归一化、转小写并去掉空白与标点，统一常见的同义疑问词（怎么/怎样 → 如何），
+  去掉开头的客套词（请问、帮我……）与结尾的语气词（吗、呢……）后，取字符 2-gram 与 3-gram，
+  用 crc32 哈希到固定维度（带符号，减少碰撞的影响），按词频计数后做 L2 归一化。
+  纯 CPU、无需模型文件，对中文与英文都适用。
+- 检索：缓存的问题向量保存在 NumPy 矩阵中，一次矩阵乘法得到与全部条目的余弦相似度，
+  支持多条查询批量检索；未安装 numpy 时退化为稀疏向量逐条计算。
+- 防误命中：只匹配同一模型的条目，且两个问题中的数字必须完全相同
+  （"2+3 等于几" 与 "2+4 等于几" 字面几乎一样，回答却不同）。
+- 容量：超过 SEMANTIC_CACHE_SIZE 时先淘汰过期条目，否则淘汰最久未使用的条目；
+  条目超过 SEMANTIC_CACHE_TTL_SECONDS 后不再命中。
+
+缓存保存在当前进程内，多 worker 部署时每个 worker 各自缓存。管理后台 ``/admin/semantic-cache``
+显示命中率，以及按最高相似度估算的不同阈值下的命中率，便于调整 SEMANTIC_CACHE_THRESHOLD。
+"""
+import logging
+import re
+import threading
+import time
+import unicodedata
+import zlib
+
+from app.utils.metrics import metrics
+
+# numpy 为可选依赖，导入约需 60 毫秒，开启缓存时才导入（见 load_numpy）
+numpy = None
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZES = (2, 3)
+# 相似度分布的统计精度：[0, 1] 按 0.01 分桶
+SCORE_BINS = 100
+# 管理后台估算命中率时列出的阈值
+WHAT_IF_THRESHOLDS = (0.80, 0.84, 0.88, 0.90, 0.92, 0.94, 0.96, 0.98)
+
+_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+# 同义疑问词（按顺序替换，长的在前）
+_SYNONYMS = (('怎么样', '如何'), ('怎么', '如何'), ('怎样', '如何'), ('为啥', '为什么'), ('啥', '什么'))
+_PREFIX_RE = re.compile(r'^(?:请问|麻烦|帮我|please)+')
+_SUFFIX_RE = re.compile(r'(?:吗|呢|啊|呀|吧|谢谢|please|thanks)+$')
+
+
+def load_numpy():
+    """导入 numpy，未安装时返回 None"""
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            return None
+        numpy = module
+    return numpy
+
+
+def normalize(text):
+    """归一化：NFKC、小写，只保留字母、数字与汉字，统一同义疑问词并去掉首尾的客套与语气词"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    text = ''.join(ch for ch in text if ch.isalnum())
+    for old, new in _SYNONYMS:
+        text = text.replace(old, new)
+    return _SUFFIX_RE.sub('', _PREFIX_RE.sub('', text))
+
+
+def vectorize(text, dim):
+    """哈希字符 n-gram 向量（稀疏，{维度: 权重}，已 L2 归一化）"""
+    counts = {}
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            h = zlib.crc32(text[i:i + n].encode('utf-8'))
+            index = h % dim
+            counts[index] = counts.get(index, 0.0) + (1.0 if h & 0x80000000 else -1.0)
+    norm = sum(v * v for v in counts.values()) ** 0.5
+    if not norm:
+        return {}
+    return {index: value / norm for index, value in counts.items() if value}
+
+
+def _sparse_dot(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(index, 0.0) for index, value in a.items())
+
+
+class _Entry:
+    __slots__ = ('key', 'prompt', 'numbers', 'model', 'answer', 'vector', 'created', 'last_used', 'hits')
+
+    def __init__(self, key, prompt, numbers, model, answer, vector, now):
+        self.key = key
+        self.prompt = prompt
+        self.numbers = numbers
+        self.model = model
+        self.answer = answer
+        self.vector = vector
+        self.created = now
+        self.last_used = now
+        self.hits = 0
+
+
+class SemanticCache:
+    """进程内语义缓存"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enabled = False
+        self.threshold = 0.88
+        self.capacity = 2000
+        self.dim = 1024
+        self.ttl = 86400
+        self.max_prompt_chars = 500
+        self.use_numpy = False
+        self._entries = []
+        # (模型, 归一化后的问题) -> 条目下标，同一问题重复写入时覆盖
+        self._keys = {}
+        self._matrix = None
+        self._score_counts = [0] * (SCORE_BINS + 1)
+
+    def init_app(self, app):
+        self.enabled = app.config['SEMANTIC_CACHE_ENABLED']
+        self.threshold = app.config['SEMANTIC_CACHE_THRESHOLD']
+        self.capacity = max(1, app.config['SEMANTIC_CACHE_SIZE'])
+        self.dim = max(16, app.config['SEMANTIC_CACHE_DIM'])
+        self.ttl = app.config['SEMANTIC_CACHE_TTL_SECONDS']
+        self.max_prompt_chars = app.config['SEMANTIC_CACHE_MAX_PROMPT_CHARS']
+        self.use_numpy = self.enabled and load_numpy() is not None
+        self.clear()
+        app.extensions['semantic_cache'] = self
+        if self.enabled:
+            logger.info("语义缓存已启用: 阈值 %.2f, 容量 %d, 维度 %d, 检索 %s",
+                        self.threshold, self.capacity, self.dim, 'numpy' if self.use_numpy else 'python')
+
+    def _prompt(self, messages):
+        """可缓存的请求（单条用户消息）返回其内容，否则返回None"""
+        if not self.enabled or len(messages) != 1 or messages[0].get('role') != 'user':
+            return None
+        content = messages[0].get('content') or ''
+        if not 2 <= len(content) <= self.max_prompt_chars:
+            return None
+        return content
+
+    def _dense(self, vector):
+        row = numpy.zeros(self.dim, dtype=numpy.float32)
+        if vector:
+            row[list(vector.keys())] = list(vector.values())
+        return row
+
+    def search(self, vectors):
+        """批量检索，需持有锁调用
+
+        Returns:
+            tuple: (每个查询达到阈值的 [(相似度, 条目下标), ...]，按相似度降序; 每个查询的最高相似度)
+        """
+        count = len(self._entries)
+        if not count:
+            return [[] for _ in vectors], [0.0 for _ in vectors]
+        if self.use_numpy:
+            queries = numpy.stack([self._dense(v) for v in vectors])
+            scores = self._matrix[:count] @ queries.T
+            results = []
+            for column in scores.T:
+                candidates = numpy.flatnonzero(column >= self.threshold)
+                ordered = candidates[numpy.argsort(-column[candidates])]
+                results.append([(float(column[i]), int(i)) for i in ordered])
+            return results, scores.max(axis=0).tolist()
+        results, best = [], []
+        for vector in vectors:
+            scores = [(_sparse_dot(vector, entry.vector), i) for i, entry in enumerate(self._entries)]
+            best.append(max(score for score, _ in scores))
+            results.append(sorted((item for item in scores if item[0] >= self.threshold), reverse=True))
+        return results, best
+
+    def lookup(self, messages, model):
+        """查找缓存的回答，未命中或请求不可缓存时返回None"""
+        prompt = self._prompt(messages)
+        if prompt is None:
+            return None
+        key = normalize(prompt)
+        vector = vectorize(key, self.dim)
+        if not vector:
+            return None
+        numbers = tuple(_NUMBER_RE.findall(prompt))
+        now = time.time()
+
+        with self._lock:
+            answer = None
+            (candidates,), (best,) = self.search([vector])
+            for score, index in candidates:
+                entry = self._entries[index]
+                if entry.model == model and entry.numbers == numbers and now - entry.created < self.ttl:
+                    entry.hits += 1
+                    entry.last_used = now
+                    answer = entry.answer
+                    break
+            self._score_counts[min(SCORE_BINS, max(0, int(best * SCORE_BINS)))] += 1
+
+        metrics.inc('semantic_cache.lookups')
+        metrics.inc('semantic_cache.hits' if answer is not None else 'semantic_cache.misses')
+        return answer
+
+    def store(self, messages, model, answer):
+        """缓存一次完整的回答"""
+        prompt = self._prompt(messages)
+        if prompt is None or not (answer or '').strip():
+            return False
+        key = normalize(prompt)
+        vector = vectorize(key, self.dim)
+        if not vector:
+            return False
+        now = time.time()
+        # 使用 numpy 时向量只保存在矩阵中
+        entry = _Entry(key, prompt, tuple(_NUMBER_RE.findall(prompt)), model, answer,
+                       None if self.use_numpy else vector, now)
+
+        with self._lock:
+            index = self._keys.get((model, key))
+            if index is None:
+                if len(self._entries) < self.capacity:
+                    index = len(self._entries)
+                    self._entries.append(None)
+                else:
+                    index = self._evict(now)
+            else:
+                self._keys.pop((model, key))
+            self._entries[index] = entry
+            self._keys[(model, key)] = index
+            if self.use_numpy:
+                if self._matrix is None:
+                    self._matrix = numpy.zeros((self.capacity, self.dim), dtype=numpy.float32)
+                self._matrix[index] = self._dense(vector)
+        metrics.inc('semantic_cache.stores')
+        return True
+
+    def _evict(self, now):
+        """腾出一个位置（优先过期条目，否则最久未使用），返回其下标；需持有锁调用"""
+        expired = [i for i, entry in enumerate(self._entries) if now - entry.created >= self.ttl]
+        if expired:
+            index = expired[0]
+            metrics.inc('semantic_cache.expired')
+        else:
+            index = min(range(len(self._entries)), key=lambda i: self._entries[i].last_used)
+            metrics.inc('semantic_cache.evictions')
+        old = self._entries[index]
+        self._keys.pop((old.model, old.key), None)
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._keys = {}
+            self._matrix = None
+            self._score_counts = [0] * (SCORE_BINS + 1)
+
+    def status(self, top=20):
+        """当前进程的缓存状态、命中率与各阈值下的估算命中率"""
+        lookups = metrics.get('semantic_cache.lookups')
+        hits = metrics.get('semantic_cache.hits')
+        with self._lock:
+            score_counts = list(self._score_counts)
+            entries = sorted(self._entries, key=lambda entry: entry.hits, reverse=True)[:top]
+            size = len(self._entries)
+        observed = sum(score_counts)
+        now = time.time()
+        return {
+            'enabled': self.enabled,
+            'backend': 'numpy' if self.use_numpy else 'python',
+            'threshold': self.threshold,
+            'entries': size,
+            'capacity': self.capacity,
+            'dim': self.dim,
+            'ttl': self.ttl,
+            'lookups': lookups,
+            'hits': hits,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'stores': metrics.get('semantic_cache.stores'),
+            'evictions': metrics.get('semantic_cache.evictions') + metrics.get('semantic_cache.expired'),
+            # 最高相似度达到各阈值的查询比例（不计模型与数字校验，为上限估算）
+            'what_if': [
+                {'threshold': t, 'rate': round(sum(score_counts[int(round(t * SCORE_BINS)):]) / observed, 4)
+                 if observed else 0.0}
+                for t in WHAT_IF_THRESHOLDS
+            ],
+            'top_entries': [
+                {'prompt': entry.prompt[:60], 'model': entry.model, 'hits': entry.hits,
+                 'age_s': int(now - entry.created)}
+                for entry in entries
+            ]
+        }
+
+
+# 全局语义缓存
+semantic_cache = SemanticCache()
@@ -0,0 +1,350 @@
+"""
+SSE (Server-Sent Events) 工具
+
+上游：直接处理 ``response.iter_content()`` 产出的原始字节块，不做逐行解码，
+仅在事件完整后才切出 ``data`` 负载；并为 OpenAI 兼容格式提供
+不构建完整字典的增量内容快速提取。
+
+下游：按时间窗口/大小阈值合并文本块，减少推送给浏览器的事件数；
+事件直接编码为字节帧（``encode_event``），``ai_chunk`` 与 ``[DONE]`` 等固定部分预先编码。
+"""
+import contextvars
+import json
+import queue
+import threading
+import time
+from json.decoder import scanstring
+
+from app.utils.json_provider import json_codec
+
+DONE_MARKER = b'[DONE]'
+
+# 下游固定帧与 ai_chunk 帧的预编码前缀（与 encode_event 的输出逐字节一致）
+DONE_FRAME = b'data: [DONE]\n\n'
+_CHUNK_PREFIX = b'data: {"type":"ai_chunk","content":'
+_CHUNK_SUFFIX = b'}\n\n'
+
+# 读取线程放入队列的上游结束标记；close() 放入的唤醒标记
+_UPSTREAM_END = object()
+_WAKE = object()
+
+
+class SSEDecoder:
+    """增量 SSE 解码器
+
+    逐块喂入字节数据，返回已完整的事件 ``data`` 负载（bytes）。
+    支持多行 ``data:`` 字段（按规范以 ``\\n`` 拼接）与 ``:`` 开头的注释行，
+    ``event``/``id``/``retry`` 等其他字段被忽略。
+    """
+
+    def __init__(self):
+        self._tail = b''
+        self._data = []
+
+    def feed(self, chunk):
+        """喂入一个字节块，返回本次解析出的完整事件负载列表"""
+        if not chunk:
+            return []
+
+        data = self._tail + chunk if self._tail else bytes(chunk)
+        if b'\r' in data:
+            # 块末尾的单个 \r 可能是被拆开的 \r\n，留到下一块再判断
+            hold = data.endswith(b'\r')
+            if hold:
+                data = data[:-1]
+            data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        else:
+            hold = False
+
+        lines = data.split(b'\n')
+        self._tail = lines.pop() + b'\r' if hold else lines.pop()
+
+        events = []
+        pending = self._data
+        for line in lines:
+            if not line:
+                # 空行：分派当前事件
+                if pending:
+                    events.append(pending[0] if len(pending) == 1 else b'\n'.join(pending))
+                    pending = []
+            elif line.startswith(b'data:'):
+                pending.append(line[6:] if line[5:6] == b' ' else line[5:])
+            # 其余为注释行（':' 开头）或本解码器不关心的字段
+        self._data = pending
+        return events
+
+    def flush(self):
+        """输入结束时调用，返回尚未以空行结束的事件负载（如有）"""
+        events = self.feed(b'\n\n') if (self._tail or self._data) else []
+        self._tail = b''
+        return events
+
+
+def iter_sse_payloads(chunks):
+    """从字节块迭代器中逐个产出事件负载，遇到 ``[DONE]`` 结束"""
+    decoder = SSEDecoder()
+    for chunk in chunks:
+        for payload in decoder.feed(chunk):
+            if payload.strip() == DONE_MARKER:
+                return
+            yield payload
+
+    for payload in decoder.flush():
+        if payload.strip() == DONE_MARKER:
+            return
+        yield payload
+
+
+def extract_delta_content(payload):
+    """从单个事件负载中提取增量文本
+
+    优先走快速路径：直接定位 ``"delta"`` 之后的 ``"content"`` 字符串并用
+    ``json.decoder.scanstring`` 解码，不构建完整字典；结构不符合预期时
+    回退到完整 JSON 解析并兼容 choices / content / text 三种格式。
+
+    Returns:
+        str or None: 增量文本，无内容时返回 None
+
+    Raises:
+        ValueError: 负载不是合法 JSON（含 UnicodeDecodeError）
+    """
+    text = payload.decode('utf-8') if isinstance(payload, (bytes, bytearray)) else payload
+
+    delta_pos = text.find('"delta":')
+    if delta_pos != -1:
+        key_pos = text.find('"content":', delta_pos)
+        # delta 对象中间出现 '}' 说明 content 可能不属于 delta（如嵌套 tool_calls），走慢路径
+        if key_pos != -1 and text.find('}', delta_pos, key_pos) == -1:
+            value_pos = key_pos + 10
+            while text[value_pos:value_pos + 1] == ' ':
+                value_pos += 1
+            first = text[value_pos:value_pos + 1]
+            if first == '"':
+                try:
+                    return scanstring(text, value_pos + 1)[0] or None
+                except ValueError:
+                    pass
+            elif text.startswith('null', value_pos):
+                return None
+
+    return _extract_content_slow(text)
+
+
+def _extract_content_slow(text):
+    """完整解析 JSON 并按已知格式提取内容"""
+    chunk = json.loads(text)
+    if not isinstance(chunk, dict):
+        return None
+
+    # OpenAI格式
+    if 'choices' in chunk:
+        choices = chunk.get('choices') or [{}]
+        delta = choices[0].get('delta') or {}
+        return delta.get('content') or None
+
+    # 硅基流动格式（可能直接包含content）
+    if 'content' in chunk:
+        return chunk.get('content') or None
+
+    # 其他可能的格式
+    if 'text' in chunk:
+        return chunk.get('text') or None
+
+    return None
+
+
+def extract_usage(payload):
+    """从事件负载（或已解析的响应字典）中提取 OpenAI 格式的 ``usage``
+
+    流式响应只有最后一个事件（``stream_options.include_usage`` 开启时）带用量，
+    调用方先用 ``b'"usage"' in payload`` 过滤，只解析这一个事件。
+
+    Returns:
+        dict or None: prompt_tokens / completion_tokens，缺失或格式不符时返回 None
+    """
+    if isinstance(payload, (bytes, bytearray, str)):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            return None
+    usage = payload.get('usage') if isinstance(payload, dict) else None
+    if not isinstance(usage, dict):
+        return None
+    prompt = usage.get('prompt_tokens')
+    completion = usage.get('completion_tokens')
+    if not isinstance(prompt, int) or not isinstance(completion, int):
+        return None
+    return {'prompt_tokens': prompt, 'completion_tokens': completion}
+
+
+class _UpstreamError:
+    """读取线程中上游迭代器抛出的异常，由迭代方重新抛出"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class ChunkCoalescer:
+    """下游 SSE 增量合并器
+
+    包装上游文本块迭代器，把时间窗口内（或累计达到字符阈值）的多个小块合并为
+    一个块输出，减少下游事件数量与浏览器重绘次数。首个文本块立即输出，
+    不影响首字延迟；迭代结束时输出剩余缓冲。window 为 0 时每个块立即输出。
+
+    由读取线程拉取上游，本迭代器按截止时间等待：窗口到期即输出缓冲，
+    不等待下一个上游块，缓冲内容最多滞后 window。上游迭代器在读取线程中执行
+    与关闭，调用方停止读取时应调用 ``close()``（可在任意线程中调用），不要直接关闭上游迭代器：
+    ``close()`` 唤醒等待中的迭代，调用 abort（如 ``send_chat_request`` 的 abort_hooks）立即断开上游，
+    之后到达的内容与尚未输出的缓冲都被丢弃。
+
+    stop 为可选的停止检查函数（如 ``StreamHandle.cancelled``）：等待上游期间每隔 poll 秒
+    调用一次，返回真时停止迭代并断开上游，上游停顿时排空截止或其他 worker 的停止标记同样及时生效。
+    """
+
+    def __init__(self, chunks, window=0.03, max_chars=512, clock=time.monotonic, abort=None,
+                 stop=None, poll=0.25):
+        self._chunks = chunks
+        self.window = window
+        self.max_chars = max_chars
+        self._clock = clock
+        self._abort = abort
+        self.stop = stop
+        self.poll = poll
+        self._closed = threading.Event()
+        self._queue = queue.SimpleQueue()
+        self._reader = None
+        self.upstream_chunks = 0
+        self.events = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def __iter__(self):
+        clock = self._clock
+        window = self.window
+        max_chars = self.max_chars
+        closed = self._closed
+        chunks = self._queue
+        buffer = []
+        size = 0
+        last_flush = None
+        ended = False
+        self.started_at = clock()
+        # 复制上下文，上游迭代器中的日志仍带有当前请求的 trace_id
+        self._reader = threading.Thread(target=contextvars.copy_context().run, args=(self._read,),
+                                        name='sse-coalescer', daemon=True)
+        self._reader.start()
+
+        try:
+            while not closed.is_set():
+                stop = self.stop
+                timeout = None if stop is None else self.poll
+                if buffer:
+                    remaining = max(last_flush + window - clock(), 0)
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                try:
+                    item = chunks.get(timeout=timeout)
+                except queue.Empty:
+                    if stop is not None and stop():
+                        # 等待上游期间被停止（排空截止、其他 worker 的停止标记）：丢弃缓冲并断开上游
+                        break
+                    if not buffer or clock() - last_flush < window:
+                        continue
+                    # 窗口到期：输出缓冲，不等待下一个上游块
+                    last_flush = clock()
+                    self.events += 1
+                    yield buffer[0] if len(buffer) == 1 else ''.join(buffer)
+                    buffer = []
+                    size = 0
+                    continue
+                if closed.is_set():
+                    # 已关闭（含 close() 放入的唤醒标记）：丢弃之后到达的内容
+                    break
+                if item is _UPSTREAM_END:
+                    ended = True
+                    if buffer:
+                        self.events += 1
+                        yield ''.join(buffer)
+                    break
+                if isinstance(item, _UpstreamError):
+                    raise item.error
+
+                self.upstream_chunks += 1
+                now = clock()
+                if last_flush is None or window <= 0:
+                    # 首块或关闭合并时直接输出
+                    last_flush = now
+                    self.events += 1
+                    yield item
+                    continue
+
+                buffer.append(item)
+                size += len(item)
+                if size >= max_chars or now - last_flush >= window:
+                    last_flush = now
+                    self.events += 1
+                    yield buffer[0] if len(buffer) == 1 else ''.join(buffer)
+                    buffer = []
+                    size = 0
+            self.finished_at = clock()
+        finally:
+            if not ended:
+                # 调用方提前停止迭代（或上游出错）：同样断开上游
+                self.close(timeout=0)
+
+    def _read(self):
+        """读取线程：把上游块放入队列，结束、出错或被关闭后关闭上游迭代器"""
+        upstream = self._chunks
+        chunks = self._queue
+        try:
+            for chunk in upstream:
+                if self._closed.is_set():
+                    break
+                chunks.put(chunk)
+            else:
+                chunks.put(_UPSTREAM_END)
+        except Exception as e:
+            chunks.put(_UpstreamError(e))
+        finally:
+            close = getattr(upstream, 'close', None)
+            if close is not None:
+                close()
+
+    def close(self, timeout=1.0):
+        """停止读取：唤醒等待中的迭代并立即断开上游
+
+        最多等待 timeout 秒让读取线程关闭上游迭代器（写入上游耗时等）；timeout 为 0 时不等待。
+        未开始迭代时直接关闭上游迭代器。
+        """
+        if not self._closed.is_set():
+            self._closed.set()
+            self._queue.put(_WAKE)
+            if self._abort is not None:
+                self._abort()
+        if self._reader is None:
+            close = getattr(self._chunks, 'close', None)
+            if close is not None:
+                close()
+        elif timeout and self._reader is not threading.current_thread():
+            self._reader.join(timeout)
+
+    def stats(self):
+        """返回合并统计：上游块数、下游事件数与各自的每秒速率"""
+        end = self.finished_at if self.finished_at is not None else self._clock()
+        elapsed = max(end - (self.started_at or end), 1e-9)
+        return {
+            'upstream_chunks': self.upstream_chunks,
+            'events': self.events,
+            'upstream_per_sec': self.upstream_chunks / elapsed,
+            'events_per_sec': self.events / elapsed,
+            'elapsed': elapsed
+        }
+
+
+def encode_event(payload):
+    """把事件数据编码为一个下游 SSE 帧（bytes）"""
+    return b'data: ' + json_codec.dumps_bytes(payload) + b'\n\n'
+
+
+def chunk_event(content):
+    """``ai_chunk`` 事件帧：只序列化文本本身，其余部分使用预编码的前后缀"""
+    return _CHUNK_PREFIX + json_codec.dumps_bytes(content) + _CHUNK_SUFFIX
@@ -0,0 +1,268 @@
+"""
+流式生成注册表（停止生成）
+
+每次流式回复开始时登记一个句柄，``stream_id`` 随 ``ai_start`` 事件下发给页面。
+用户点击停止时调用 ``POST /api/chat/cancel/<stream_id>``：句柄在本进程时直接设置
+取消标记；否则（多 worker 部署时停止请求通常落在另一个 worker）在 STREAM_CANCEL_DIR
+下写入以 stream_id 命名、内容为用户ID的标记文件，生成流所在的 worker 每隔
+CHECK_INTERVAL 秒检查一次。
+
+本进程内的取消（停止接口、客户端断开）通过 ``on_cancel`` 登记的回调立即断开上游响应，
+不等待下一个上游块，之后到达的内容被丢弃。
+
+带幂等键的请求登记为可重放的句柄：已发送的 SSE 帧保存在句柄中，同一 worker 上的
+重复请求通过 ``follow()`` 从头重放并继续接收后续帧，不再重复调用上游。
+
+排空（重启/停止部署时）：worker 收到 SIGTERM 后调用 ``begin_drain()``（见 gunicorn.conf.py），
+此后不再接受新的生成，``/readyz`` 返回 503；进行中的生成继续输出，超过 DRAIN_TIMEOUT_SECONDS
+仍未结束的按 ``shutdown`` 原因停止（等待上游期间也每隔 CHECK_INTERVAL 秒检查一次，上游停顿
+不会推迟停止），已生成的部分保存为已停止，不会在 worker 被强制结束时丢失。
+"""
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 标记文件检查间隔（秒）
+CHECK_INTERVAL = 0.25
+# 超过该时长（秒）的标记文件视为过期，写入新标记时顺带清理
+MARKER_TTL = 600
+# 重放时等待新帧超过该时长（秒）则发送一次 SSE 注释，避免代理断开空闲连接
+KEEPALIVE_INTERVAL = 15
+KEEPALIVE_FRAME = b': keepalive\n\n'
+
+REASON_CANCELLED = 'cancelled'
+REASON_DISCONNECTED = 'disconnected'
+REASON_SHUTDOWN = 'shutdown'
+
+_STREAM_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """粗略估算文本的 token 数：中日韩字符每字约 1 个，其余字符每 4 个约 1 个"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class StreamHandle:
+    """一次流式生成的取消句柄"""
+
+    def __init__(self, registry, stream_id, user_id, conversation_id, replayable=False):
+        self._registry = registry
+        self.stream_id = stream_id
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.reason = None
+        self._event = threading.Event()
+        self._next_check = time.monotonic() + CHECK_INTERVAL
+        # 可重放的句柄保存已发送的帧
+        self.frames = [] if replayable else None
+        self.done = False
+        self._cond = threading.Condition()
+        self._cancel_callbacks = []
+
+    def on_cancel(self, callback):
+        """登记取消时调用的函数（在调用 cancel 的线程中执行，如停止接口的请求线程），用于立即断开上游"""
+        self._cancel_callbacks.append(callback)
+
+    def cancel(self, reason=REASON_CANCELLED):
+        if self.reason is None:
+            self.reason = reason
+        if self._event.is_set():
+            return
+        self._event.set()
+        for callback in self._cancel_callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("停止生成回调失败: stream_id=%s", self.stream_id)
+
+    def cancelled(self):
+        """是否已取消（按 CHECK_INTERVAL 节流检查其他 worker 写入的标记文件）"""
+        if self._event.is_set():
+            return True
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + CHECK_INTERVAL
+            deadline = self._registry.drain_deadline
+            if deadline is not None and now >= deadline:
+                self.cancel(REASON_SHUTDOWN)
+                return True
+            if self._registry.take_marker(self.stream_id, self.user_id):
+                self.cancel()
+                return True
+        return False
+
+    def publish(self, frame):
+        """记录一帧（可重放时）并原样返回"""
+        if self.frames is not None:
+            with self._cond:
+                self.frames.append(frame)
+                self._cond.notify_all()
+        return frame
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+    def follow(self):
+        """从第一帧开始重放，并继续输出后续帧直到生成结束"""
+        index = 0
+        while True:
+            with self._cond:
+                if index >= len(self.frames) and not self.done:
+                    self._cond.wait(KEEPALIVE_INTERVAL)
+                frames = self.frames[index:]
+                index += len(frames)
+                done = self.done and index >= len(self.frames)
+            for frame in frames:
+                yield frame
+            if done:
+                return
+            if not frames:
+                yield KEEPALIVE_FRAME
+
+
+class StreamRegistry:
+    """本进程内正在进行的流式生成"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}
+        self.directory = os.path.abspath(os.path.join('instance', 'stream_cancel'))
+        self.drain_timeout = 25
+        # 排空截止时间（time.monotonic()），未排空时为None
+        self.drain_deadline = None
+
+    def init_app(self, app):
+        self.directory = os.path.abspath(
+            app.config['STREAM_CANCEL_DIR'] or os.path.join(app.instance_path, 'stream_cancel')
+        )
+        self.drain_timeout = app.config['DRAIN_TIMEOUT_SECONDS']
+        app.extensions['streams'] = self
+
+    @property
+    def draining(self):
+        return self.drain_deadline is not None
+
+    def begin_drain(self, timeout=None):
+        """进入排空模式（可在信号处理函数中调用：只设置标记，不加锁、不写日志）"""
+        if self.drain_deadline is None:
+            self.drain_deadline = time.monotonic() + (self.drain_timeout if timeout is None else timeout)
+
+    def active_count(self):
+        """本进程内正在进行的生成数"""
+        with self._lock:
+            return len(self._streams)
+
+    @staticmethod
+    def new_stream_id():
+        return uuid.uuid4().hex
+
+    def register(self, user_id, conversation_id, stream_id=None, replayable=False):
+        handle = StreamHandle(self, stream_id or self.new_stream_id(), user_id, conversation_id, replayable)
+        with self._lock:
+            self._streams[handle.stream_id] = handle
+        metrics.add_gauge('stream.active', 1)
+        return handle
+
+    def get(self, stream_id):
+        """本进程内正在进行的流，不存在时返回None"""
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def unregister(self, handle):
+        handle.finish()
+        with self._lock:
+            if self._streams.pop(handle.stream_id, None) is None:
+                return
+        metrics.add_gauge('stream.active', -1)
+        self._remove_marker(handle.stream_id)
+
+    def cancel(self, stream_id, user_id):
+        """请求停止生成
+
+        Returns:
+            str: ``local`` 表示本进程内已设置取消标记；``pending`` 表示已写入标记文件，
+            由生成流所在的 worker 处理
+        """
+        if not _STREAM_ID_RE.match(stream_id or ''):
+            raise ValueError('无效的 stream_id')
+        with self._lock:
+            handle = self._streams.get(stream_id)
+        if handle is not None:
+            if handle.user_id != user_id:
+                raise ValueError('无权停止该回复')
+            handle.cancel()
+            return 'local'
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._prune()
+        with open(os.path.join(self.directory, stream_id), 'w') as f:
+            f.write(str(user_id))
+        return 'pending'
+
+    def take_marker(self, stream_id, user_id):
+        """检查并消费其他 worker 写入的取消标记，用户不匹配时忽略"""
+        path = os.path.join(self.directory, stream_id)
+        try:
+            with open(path) as f:
+                owner = f.read().strip()
+        except OSError:
+            return False
+        self._remove_marker(stream_id)
+        return owner == str(user_id)
+
+    def _remove_marker(self, stream_id):
+        try:
+            os.remove(os.path.join(self.directory, stream_id))
+        except OSError:
+            pass
+
+    def _prune(self):
+        cutoff = time.time() - MARKER_TTL
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                    except OSError:
+                        pass
+        except OSError as e:
+            logger.warning("清理取消标记失败: %s", e)
+
+
+def record_stopped(reason, generated_text):
+    """记录提前结束的生成：次数、已生成 token 与估算节省的 token
+
+    节省量按本进程内完整回复的平均 token 数减去已生成的 token 数估算（不低于0），
+    尚无完整回复时不计。
+    """
+    generated = estimate_tokens(generated_text)
+    metrics.inc('stream.%s' % reason)
+    metrics.inc('stream.tokens_before_stop', generated)
+    completed = metrics.get('stream.completed')
+    if completed:
+        average = metrics.get('stream.completed_tokens') / completed
+        metrics.inc('stream.tokens_saved_estimate', max(0, int(average) - generated))
+
+
+def record_completed(text):
+    """记录一次完整生成的 token 数，作为估算节省量的基准"""
+    metrics.inc('stream.completed')
+    metrics.inc('stream.completed_tokens', estimate_tokens(text))
+
+
+# 全局注册表
+streams = StreamRegistry()
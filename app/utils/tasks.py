@@ -0,0 +1,394 @@
+"""
+后台任务
+
+请求线程中不需要用户等待的工作（更新对话标题、记录用户活跃时间等）提交到进程内的
+有界队列，由后台线程在应用上下文中执行：
+
+* 任务按名称注册（``@background.task('name')``），提交时只传递可 JSON 序列化的
+  位置参数，任务函数需要可以重复执行；
+* 失败后按指数退避重试，超过 TASK_MAX_RETRIES 次后记录错误并放弃；
+* 队列满时（背压）丢弃任务或在调用线程中直接执行，并计数；带 ``key`` 提交的任务
+  在开始执行前只保留一个，重复提交直接合并；
+* 可选的持久化队列（TASK_DURABLE）：``durable=True`` 的任务先写入独立的 SQLite
+  文件，执行成功后删除；进程重启或崩溃后，租约到期的任务由轮询线程重新领取，
+  多个 worker 进程共享同一文件；
+* 指标：tasks.submitted / completed / failed / retried / dropped / coalesced，
+  tasks.queue_depth 瞬时值，task.<名称>_ms 与 tasks.wait_ms 直方图。
+
+后台线程在每个进程第一次使用时启动（兼容 gunicorn --preload 的 fork），进程退出时
+最多等待 TASK_SHUTDOWN_TIMEOUT 秒执行完队列中剩余的任务。TASK_EAGER 开启时任务在
+提交线程中同步执行（测试与命令行使用）。
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """一次任务提交"""
+
+    __slots__ = ('name', 'args', 'key', 'attempts', 'durable_id', 'enqueued_at')
+
+    def __init__(self, name, args, key=None, attempts=0, durable_id=None):
+        self.name = name
+        self.args = args
+        self.key = key
+        self.attempts = attempts
+        self.durable_id = durable_id
+        self.enqueued_at = time.monotonic()
+
+
+class DurableStore:
+    """持久化任务表（SQLite 文件，多个进程共享）
+
+    提交时直接领取（写入租约），由提交的进程立即执行；执行成功后删除。
+    租约到期仍未删除的任务视为执行它的进程已退出，可被任意进程重新领取。
+    """
+
+    def __init__(self, path, lease):
+        self.path = path
+        self.lease = lease
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    args TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    run_at REAL NOT NULL,
+                    locked_until REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_tasks_due ON tasks (status, run_at)")
+
+    def _connect(self):
+        # 每个线程（以及 fork 后的每个进程）使用自己的连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, job, claim=True):
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO tasks (name, args, run_at, locked_until, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job.name, json.dumps(job.args, ensure_ascii=False), now, now + self.lease if claim else 0, now)
+        )
+        return cursor.lastrowid
+
+    def claim_due(self, limit):
+        """领取到期且未被锁定的任务"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                "SELECT id, name, args, attempts FROM tasks "
+                "WHERE status = 'pending' AND run_at <= ? AND locked_until <= ? ORDER BY run_at LIMIT ?",
+                (now, now, limit)
+            ).fetchall()
+            conn.executemany("UPDATE tasks SET locked_until = ? WHERE id = ?",
+                             [(now + self.lease, row[0]) for row in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [Job(name, json.loads(args), attempts=attempts, durable_id=task_id)
+                for task_id, name, args, attempts in rows]
+
+    def release(self, task_id):
+        """放弃租约，由轮询线程稍后领取"""
+        self._connect().execute("UPDATE tasks SET locked_until = 0 WHERE id = ?", (task_id,))
+
+    def complete(self, task_id):
+        self._connect().execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+
+    def retry(self, task_id, attempts, delay, error):
+        self._connect().execute(
+            "UPDATE tasks SET attempts = ?, run_at = ?, locked_until = 0, last_error = ? WHERE id = ?",
+            (attempts, time.time() + delay, error, task_id)
+        )
+
+    def fail(self, task_id, attempts, error):
+        self._connect().execute(
+            "UPDATE tasks SET status = 'failed', attempts = ?, locked_until = 0, last_error = ? WHERE id = ?",
+            (attempts, error, task_id)
+        )
+
+    def counts(self):
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        return dict(rows)
+
+
+class BackgroundExecutor:
+    """进程内的有界后台任务执行器"""
+
+    def __init__(self):
+        self._tasks = {}
+        self._app = None
+        self._store = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._threads = []
+        self._pending_keys = set()
+        self._stop = threading.Event()
+        self.eager = False
+        self.workers = 2
+        self.queue_size = 1000
+        self.max_retries = 3
+        self.retry_backoff = 1.0
+        self.poll_interval = 2.0
+        self.shutdown_timeout = 5.0
+
+    def task(self, name):
+        """注册任务函数"""
+        def decorator(func):
+            self._tasks[name] = func
+            return func
+        return decorator
+
+    def init_app(self, app):
+        config = app.config
+        self._app = app
+        self.eager = config['TASK_EAGER']
+        self.workers = max(1, config['TASK_WORKERS'])
+        self.queue_size = config['TASK_QUEUE_SIZE']
+        self.max_retries = config['TASK_MAX_RETRIES']
+        self.retry_backoff = config['TASK_RETRY_BACKOFF']
+        self.poll_interval = config['TASK_POLL_INTERVAL']
+        self.shutdown_timeout = config['TASK_SHUTDOWN_TIMEOUT']
+        self._store = None
+        if config['TASK_DURABLE'] and not self.eager:
+            path = config['TASK_DB_PATH'] or os.path.join(app.instance_path, 'tasks.db')
+            self._store = DurableStore(path, config['TASK_LEASE_SECONDS'])
+            # 重启后遗留的任务不必等到第一次提交：worker 处理第一个请求时启动轮询线程
+            app.before_request(self._ensure_started)
+        app.extensions['background'] = self
+
+    # ---- 提交 ----
+
+    def submit(self, name, args=(), key=None, durable=False, inline_when_full=False):
+        """提交任务
+
+        Args:
+            name: 已注册的任务名称
+            args: 位置参数（需可 JSON 序列化）
+            key: 合并键，同一键的任务在开始执行前只保留一个
+            durable: 启用持久化队列时写入 SQLite，进程退出后仍会执行
+            inline_when_full: 队列满时在调用线程中执行，而不是丢弃
+
+        Returns:
+            bool: 任务已接受（排队、合并或已执行）时为 True，被丢弃时为 False
+        """
+        if name not in self._tasks:
+            raise ValueError('未注册的后台任务: %s' % name)
+        job = Job(name, list(args), key)
+        metrics.inc('tasks.submitted')
+        if self.eager:
+            self._run(job)
+            return True
+
+        self._ensure_started()
+        if key is not None:
+            with self._lock:
+                if key in self._pending_keys:
+                    metrics.inc('tasks.coalesced')
+                    return True
+                self._pending_keys.add(key)
+
+        if durable and self._store is not None:
+            try:
+                job.durable_id = self._store.add(job)
+            except sqlite3.Error as e:
+                logger.error("写入持久化任务失败，改为内存队列: %s %s", name, e)
+
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._forget_key(job)
+            if job.durable_id is not None:
+                # 已持久化，释放租约后由轮询线程在队列有空位时领取
+                self._store.release(job.durable_id)
+                metrics.inc('tasks.deferred')
+                return True
+            if inline_when_full:
+                metrics.inc('tasks.inline')
+                self._run(job)
+                return True
+            metrics.inc('tasks.dropped')
+            logger.warning("后台任务队列已满，丢弃任务: %s", name)
+            return False
+        metrics.set_gauge('tasks.queue_depth', self._queue.qsize())
+        return True
+
+    def _forget_key(self, job):
+        if job.key is not None:
+            with self._lock:
+                self._pending_keys.discard(job.key)
+
+    # ---- 执行 ----
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # fork 出的子进程中没有后台线程，也不能沿用父进程的队列
+            self._queue = queue.Queue(self.queue_size)
+            self._pending_keys = set()
+            self._stop = threading.Event()
+            self._threads = [threading.Thread(target=self._worker, name='task-worker-%d' % i, daemon=True)
+                             for i in range(self.workers)]
+            if self._store is not None:
+                self._threads.append(threading.Thread(target=self._poll, name='task-poller', daemon=True))
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._run(job)
+            finally:
+                self._queue.task_done()
+                metrics.set_gauge('tasks.queue_depth', self._queue.qsize())
+
+    def _run(self, job):
+        self._forget_key(job)
+        metrics.observe('tasks.wait_ms', (time.monotonic() - job.enqueued_at) * 1000)
+        start = time.perf_counter()
+        try:
+            # 每个任务使用独立的应用上下文，结束时数据库会话随上下文一起释放
+            with self._app.app_context():
+                self._tasks[job.name](*job.args)
+        except Exception as e:
+            self._failed(job, e)
+            return
+        finally:
+            metrics.observe('task.%s_ms' % job.name, (time.perf_counter() - start) * 1000)
+        metrics.inc('tasks.completed')
+        if job.durable_id is not None:
+            self._store_call(self._store.complete, job.durable_id)
+
+    def _failed(self, job, error):
+        job.attempts += 1
+        if job.attempts <= self.max_retries:
+            delay = self.retry_backoff * 2 ** (job.attempts - 1)
+            metrics.inc('tasks.retried')
+            logger.warning("后台任务失败，%.1f 秒后第 %d 次重试: %s %s", delay, job.attempts, job.name, error)
+            if job.durable_id is not None:
+                self._store_call(self._store.retry, job.durable_id, job.attempts, delay, repr(error))
+            elif not self.eager:
+                timer = threading.Timer(delay, self._requeue, (job,))
+                timer.daemon = True
+                timer.start()
+            return
+        metrics.inc('tasks.failed')
+        logger.error("后台任务失败，已放弃: %s args=%.200r %s", job.name, job.args, error,
+                     exc_info=(type(error), error, error.__traceback__))
+        if job.durable_id is not None:
+            self._store_call(self._store.fail, job.durable_id, job.attempts, repr(error))
+
+    def _requeue(self, job):
+        job.enqueued_at = time.monotonic()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            metrics.inc('tasks.dropped')
+            logger.warning("后台任务队列已满，放弃重试: %s", job.name)
+
+    def _poll(self):
+        """领取持久化队列中到期的任务（重启遗留、重试或队列满时暂存的任务）"""
+        while not self._stop.wait(self.poll_interval):
+            free = self.queue_size - self._queue.qsize() if self.queue_size > 0 else 100
+            if free <= 0:
+                continue
+            try:
+                jobs = self._store.claim_due(min(free, 100))
+            except sqlite3.Error as e:
+                logger.error("领取持久化任务失败: %s", e)
+                continue
+            for job in jobs:
+                try:
+                    self._queue.put_nowait(job)
+                except queue.Full:
+                    self._store_call(self._store.release, job.durable_id)
+
+    def _store_call(self, method, *args):
+        try:
+            method(*args)
+        except sqlite3.Error as e:
+            logger.error("更新持久化任务失败: %s", e)
+
+    # ---- 状态与退出 ----
+
+    def join(self, timeout=None):
+        """等待当前队列中的任务执行完（基准与检查脚本使用）"""
+        if self._pid != os.getpid():
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def status(self):
+        data = {
+            'running': self._pid == os.getpid(),
+            'queue_depth': self._queue.qsize() if self._pid == os.getpid() else 0,
+            'workers': self.workers,
+            'durable': None
+        }
+        if self._store is not None:
+            try:
+                data['durable'] = self._store.counts()
+            except sqlite3.Error:
+                pass
+        return data
+
+    def shutdown(self, timeout=None):
+        """停止后台线程；队列中剩余的任务在超时前执行完"""
+        if self._pid != os.getpid():
+            return
+        timeout = self.shutdown_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        self._stop.set()
+        for _ in range(self.workers):
+            try:
+                self._queue.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._pid = None
+
+
+# 全局后台任务执行器
+background = BackgroundExecutor()
+atexit.register(background.shutdown)
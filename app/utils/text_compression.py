@@ -0,0 +1,113 @@
+"""
+消息正文的透明压缩
+
+``Message.content`` 使用 ``CompressedText`` 列类型（app/models/types.py），数据库中为二进制列。
+写入时正文按 UTF-8 编码，不小于 MESSAGE_COMPRESSION_MIN_BYTES 字节的压缩存储；读取时按首字节识别格式：
+
+    0x01 + zlib 数据
+    0x02 + zstd 数据（需安装 zstandard）
+    0x00 + UTF-8 正文（正文首字节本身小于 0x08 时加此前缀，避免误判为压缩格式）
+    其他：UTF-8 正文
+
+短消息以及压缩后没有变小的正文按原样存储，读取时只需解码。格式自描述，修改编码或阈值
+不影响已存储的数据；MESSAGE_COMPRESSION_CODEC=none 时新消息不再压缩，已压缩的照常读取。
+SQLite 中迁移前写入的旧数据仍是 TEXT，读取时原样返回，由后台任务逐批压缩（见 Message.compress_stored）。
+"""
+import logging
+import threading
+import zlib
+
+from .metrics import metrics
+
+try:
+    import zstandard
+except ImportError:  # zstandard 为可选依赖
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+PLAIN = 0x00
+ZLIB = 0x01
+ZSTD = 0x02
+# 首字节小于该值的 UTF-8 正文需要加 PLAIN 前缀
+MARKER_LIMIT = 0x08
+
+CODECS = ('zlib', 'zstd', 'none')
+DEFAULT_LEVELS = {'zlib': 6, 'zstd': 3}
+
+
+class TextCompressor:
+    """正文的编码与解码（进程内共享，配置见 init_app）"""
+
+    def __init__(self):
+        self.codec = 'zlib'
+        self.level = DEFAULT_LEVELS['zlib']
+        self.min_bytes = 1024
+        self._local = threading.local()
+
+    def init_app(self, app):
+        codec = app.config['MESSAGE_COMPRESSION_CODEC']
+        if codec not in CODECS:
+            raise ValueError('MESSAGE_COMPRESSION_CODEC 只能是 %s: %r' % (' / '.join(CODECS), codec))
+        if codec == 'zstd' and zstandard is None:
+            logger.warning("未安装 zstandard，消息正文改用 zlib 压缩")
+            codec = 'zlib'
+        self.codec = codec
+        self.level = app.config['MESSAGE_COMPRESSION_LEVEL'] or DEFAULT_LEVELS.get(codec)
+        self.min_bytes = app.config['MESSAGE_COMPRESSION_MIN_BYTES']
+        app.extensions['text_compressor'] = self
+
+    @property
+    def enabled(self):
+        return self.codec != 'none'
+
+    def _zstd(self):
+        # ZstdCompressor / ZstdDecompressor 不是线程安全的，每个线程各用一组
+        if not hasattr(self._local, 'zstd'):
+            self._local.zstd = (zstandard.ZstdCompressor(level=self.level), zstandard.ZstdDecompressor())
+        return self._local.zstd
+
+    def encode(self, text):
+        """正文 → 存储的字节"""
+        data = text.encode('utf-8')
+        if self.enabled and len(data) >= self.min_bytes:
+            if self.codec == 'zstd':
+                packed = bytes((ZSTD,)) + self._zstd()[0].compress(data)
+            else:
+                packed = bytes((ZLIB,)) + zlib.compress(data, self.level)
+            if len(packed) < len(data):
+                metrics.inc('messages.compressed')
+                metrics.inc('messages.compression.saved_bytes', len(data) - len(packed))
+                return packed
+        if data and data[0] < MARKER_LIMIT:
+            return bytes((PLAIN,)) + data
+        return data
+
+    def decode(self, value):
+        """存储的值（bytes / memoryview，SQLite 旧数据为 str）→ 正文"""
+        if isinstance(value, str):
+            return value
+        data = value if isinstance(value, bytes) else bytes(value)
+        if not data or data[0] >= MARKER_LIMIT:
+            return data.decode('utf-8')
+        marker = data[0]
+        if marker == ZLIB:
+            return zlib.decompress(data[1:]).decode('utf-8')
+        if marker == ZSTD:
+            if zstandard is None:
+                raise RuntimeError('消息正文使用 zstd 压缩，需要安装 zstandard')
+            return self._zstd()[1].decompress(data[1:]).decode('utf-8')
+        if marker == PLAIN:
+            return data[1:].decode('utf-8')
+        raise ValueError('未知的消息正文格式: 0x%02x' % marker)
+
+    @staticmethod
+    def is_compressed(value):
+        """存储的值是否已压缩"""
+        if value is None or isinstance(value, str):
+            return False
+        return len(value) > 0 and bytes(value[:1])[0] in (ZLIB, ZSTD)
+
+
+# 全局正文压缩器
+text_compressor = TextCompressor()
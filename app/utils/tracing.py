@@ -0,0 +1,393 @@
+"""
+请求链路追踪
+
+轻量的 span 追踪：每个被追踪的请求创建一个 trace（根 span 覆盖到响应关闭为止，
+包括流式输出），业务代码通过 ``span()`` / ``traced()`` 创建子 span，SQLAlchemy
+查询自动记录为 ``db.query`` 子 span。当前 span 保存在 contextvars 中，
+没有活动 trace 时所有接口都是空操作。
+
+trace 结束后整批交给后台线程导出，队列满时丢弃并计数（``trace.dropped``）：
+
+* ``file``: 每个 span 一行 JSON，写入 TRACE_FILE
+* ``otlp``: 以 OTLP/HTTP JSON 格式 POST 到本地采集器（如 OpenTelemetry Collector 的 4318 端口）
+
+trace_id 通过响应头 ``X-Trace-Id`` 返回；请求带有 W3C ``traceparent`` 头时沿用其中的 trace_id。
+"""
+import functools
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import request
+from sqlalchemy import event
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TRACE_ID_HEADER = 'X-Trace-Id'
+_TRACEPARENT_RE = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+# span 类型（与 OTLP SpanKind 一致）
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+_current_span = ContextVar('current_span', default=None)
+
+
+class Trace:
+    """一次请求的全部 span"""
+
+    __slots__ = ('trace_id', 'spans', 'marks', 'root')
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.spans = []
+        self.marks = {}
+        self.root = None
+
+
+class Span:
+    __slots__ = ('name', 'trace', 'span_id', 'parent_id', 'kind', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, name, trace, parent_id=None, kind=KIND_INTERNAL, attributes=None):
+        self.name = name
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.trace.spans.append(self)
+
+    @property
+    def duration_ms(self):
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self):
+        data = {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start_ns / 1e9,
+            'duration_ms': round(self.duration_ms, 3),
+            'attributes': self.attributes
+        }
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class _NoopSpan:
+    """没有活动 trace 时返回的空 span"""
+
+    def set(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def current_trace():
+    span = _current_span.get()
+    return span.trace if span is not None else None
+
+
+def current_trace_id():
+    span = _current_span.get()
+    return span.trace.trace_id if span is not None else None
+
+
+def mark(name):
+    """在当前 trace 上记录一个时间点（如首个 token 到达），同名只记录第一次"""
+    span = _current_span.get()
+    if span is not None:
+        span.trace.marks.setdefault(name, time.time_ns())
+
+
+@contextmanager
+def span(name, kind=KIND_INTERNAL, **attributes):
+    """创建当前 span 的子 span；没有活动 trace 时为空操作"""
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+
+    child = Span(name, parent.trace, parent.span_id, kind, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = repr(e)
+        raise
+    finally:
+        child.finish()
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # 生成器在其他上下文中恢复执行时无法 reset，直接恢复父 span
+            _current_span.set(parent)
+
+
+def traced(name, kind=KIND_INTERNAL):
+    """函数装饰器：以一个 span 包裹整个调用"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return func(*args, **kwargs)
+            with span(name, kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_trace(name, trace_id=None, parent_id=None, **attributes):
+    """开始一个新的 trace 并把根 span 设为当前 span"""
+    trace = Trace(trace_id)
+    root = Span(name, trace, parent_id, KIND_SERVER, attributes)
+    trace.root = root
+    _current_span.set(root)
+    return root
+
+
+def end_trace(exporter=None):
+    """结束当前 trace，并交给导出器"""
+    span = _current_span.get()
+    if span is None:
+        return None
+    trace = span.trace
+    _current_span.set(None)
+    trace.root.finish()
+    for finished in trace.spans:
+        if finished.name != 'db.query':
+            metrics.observe(f'span.{finished.name}_ms', finished.duration_ms)
+    if exporter is not None:
+        exporter.submit(trace.spans)
+    return trace
+
+
+def trace_timings():
+    """按当前 trace 中已完成的 span 汇总各阶段耗时（毫秒），用于保存到消息上"""
+    trace = current_trace()
+    if trace is None:
+        return None
+
+    now = time.time_ns()
+    timings = {
+        'trace_id': trace.trace_id,
+        'total_ms': round((now - trace.root.start_ns) / 1e6, 1)
+    }
+    db_ms = 0.0
+    db_queries = 0
+    for finished in trace.spans:
+        if finished.name == 'db.query':
+            db_ms += finished.duration_ms
+            db_queries += 1
+        elif finished.name in STAGE_NAMES:
+            key = STAGE_NAMES[finished.name]
+            timings[key] = round(timings.get(key, 0.0) + finished.duration_ms, 1)
+    timings['db_ms'] = round(db_ms, 1)
+    timings['db_queries'] = db_queries
+    first_token = trace.marks.get('first_token')
+    if first_token is not None:
+        timings['ttft_ms'] = round((first_token - trace.root.start_ns) / 1e6, 1)
+    return timings
+
+
+# 参与消息耗时汇总的 span 及其字段名
+STAGE_NAMES = {
+    'chat.get_user': 'user_ms',
+    'chat.prepare': 'prepare_ms',
+    'upstream.request': 'upstream_ms',
+    'upstream.stream': 'stream_ms'
+}
+
+
+class FileExporter:
+    """每个 span 一行 JSON 追加到文件"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for finished in spans:
+                f.write(json.dumps(finished.to_dict(), ensure_ascii=False, default=str) + '\n')
+
+
+class OTLPHttpExporter:
+    """以 OTLP/HTTP JSON 格式发送到采集器"""
+
+    def __init__(self, endpoint, service_name, timeout=2.0):
+        import requests
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    @staticmethod
+    def _attribute(key, value):
+        if isinstance(value, bool):
+            encoded = {'boolValue': value}
+        elif isinstance(value, int):
+            encoded = {'intValue': str(value)}
+        elif isinstance(value, float):
+            encoded = {'doubleValue': value}
+        else:
+            encoded = {'stringValue': str(value)}
+        return {'key': key, 'value': encoded}
+
+    def encode(self, spans):
+        encoded = []
+        for finished in spans:
+            item = {
+                'traceId': finished.trace.trace_id,
+                'spanId': finished.span_id,
+                'name': finished.name,
+                'kind': finished.kind,
+                'startTimeUnixNano': str(finished.start_ns),
+                'endTimeUnixNano': str(finished.end_ns),
+                'attributes': [self._attribute(k, v) for k, v in finished.attributes.items()]
+            }
+            if finished.parent_id:
+                item['parentSpanId'] = finished.parent_id
+            if finished.error:
+                item['status'] = {'code': 2, 'message': finished.error}
+            encoded.append(item)
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': [self._attribute('service.name', self.service_name)]},
+                'scopeSpans': [{'scope': {'name': __name__}, 'spans': encoded}]
+            }]
+        }
+
+    def export(self, spans):
+        response = self._session.post(self.endpoint, json=self.encode(spans), timeout=self.timeout)
+        response.raise_for_status()
+
+
+class BackgroundExporter:
+    """在后台线程中调用实际的导出器，请求线程只负责入队"""
+
+    def __init__(self, exporter, queue_size=1000):
+        self.exporter = exporter
+        self.queue_size = queue_size
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, spans):
+        if self._pid != os.getpid():
+            # 首次使用或 fork 之后，在当前进程中启动导出线程
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(self.queue_size)
+                    threading.Thread(target=self._run, args=(self._queue,), name='trace-exporter', daemon=True).start()
+                    self._pid = os.getpid()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            metrics.inc('trace.dropped')
+
+    def _run(self, pending):
+        while True:
+            spans = pending.get()
+            try:
+                self.exporter.export(spans)
+                metrics.inc('trace.exported')
+            except Exception as e:
+                metrics.inc('trace.export_errors')
+                logger.warning('导出追踪数据失败: %s', e)
+
+
+def create_exporter(config):
+    """根据配置创建导出器，TRACE_EXPORTER 为 none 时返回 None"""
+    kind = config['TRACE_EXPORTER']
+    if kind == 'file':
+        return BackgroundExporter(FileExporter(config['TRACE_FILE']))
+    if kind == 'otlp':
+        return BackgroundExporter(OTLPHttpExporter(config['TRACE_OTLP_ENDPOINT'], config['TRACE_SERVICE_NAME']))
+    return None
+
+
+def instrument_engine(engine):
+    """把 SQLAlchemy 查询记录为当前 span 的子 span"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        parent = _current_span.get()
+        if parent is not None:
+            context._trace_span = Span('db.query', parent.trace, parent.span_id, KIND_CLIENT, {
+                'db.operation': statement.lstrip().split(None, 1)[0].upper() if statement.strip() else '',
+                'db.statement': ' '.join(statement.split())[:300]
+            })
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        query_span = getattr(context, '_trace_span', None)
+        if query_span is not None:
+            query_span.finish()
+
+
+def init_tracing(app, engine):
+    """为指定蓝图的请求开启追踪
+
+    配置项：
+        TRACE_ENABLED: 是否启用
+        TRACE_BLUEPRINTS: 需要追踪的蓝图，逗号分隔
+        TRACE_EXPORTER: none / file / otlp
+        TRACE_FILE / TRACE_OTLP_ENDPOINT / TRACE_SERVICE_NAME
+    """
+    config = app.config
+    if not config['TRACE_ENABLED']:
+        return
+
+    blueprints = {name.strip() for name in config['TRACE_BLUEPRINTS'].split(',') if name.strip()}
+    exporter = create_exporter(config)
+    instrument_engine(engine)
+
+    @app.before_request
+    def _start_request_trace():
+        _current_span.set(None)
+        if request.blueprint not in blueprints:
+            return
+        trace_id = parent_id = None
+        match = _TRACEPARENT_RE.match(request.headers.get('traceparent', ''))
+        if match:
+            trace_id, parent_id = match.groups()
+        start_trace(f'{request.method} {request.url_rule.rule if request.url_rule else request.path}',
+                    trace_id, parent_id, **{'http.method': request.method, 'http.target': request.path})
+
+    @app.after_request
+    def _finish_request_trace(response):
+        root = _current_span.get()
+        if root is None or root.trace.root is not root:
+            return response
+        root.set('http.status_code', response.status_code)
+        response.headers[TRACE_ID_HEADER] = root.trace.trace_id
+        # 流式响应在视图返回后才输出，直到响应关闭时才结束 trace
+        response.call_on_close(functools.partial(end_trace, exporter))
+        return response
@@ -1,9 +1,17 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, abort
 from flask_login import login_user, logout_user, login_required, current_user
-from app.services import UserService, api_service
+from app.services import UserService, UsageService, api_service
 from app.models import Config
+from app.utils.metrics import metrics
+from app.utils.db_pool import describe_pool
+from app.utils.profiler import profiler
+from app.utils.semantic_cache import semantic_cache
+from app.utils.tasks import background
+from app import db
 import logging
 
+logger = logging.getLogger(__name__)
+
 admin = Blueprint('admin', __name__)
 
 @admin.route('/login', methods=['GET', 'POST'])
@@ -54,7 +62,7 @@ def dashboard():
                              conversation_stats=conversation_stats,
                              recent_activities=recent_activities)
     except Exception as e:
-        logging.error(f"获取仪表板数据失败: {str(e)}")
+        logger.error("获取仪表板数据失败: %s", e)
         flash('获取数据失败', 'error')
         return render_template('admin/dashboard.html',
                              user_stats={},
@@ -75,7 +83,7 @@ def users():
         
         return render_template('admin/users.html', users=users)
     except Exception as e:
-        logging.error(f"获取用户列表失败: {str(e)}")
+        logger.error("获取用户列表失败: %s", e)
         flash('获取用户列表失败', 'error')
         return render_template('admin/users.html', users=None)
 
@@ -100,12 +108,43 @@ def conversations():
                              conversations=conversations, 
                              selected_user_id=user_id)
     except Exception as e:
-        logging.error(f"获取对话记录失败: {str(e)}")
+        logger.error("获取对话记录失败: %s", e)
         flash('获取对话记录失败', 'error')
         return render_template('admin/conversations.html', 
                              conversations=None, 
                              selected_user_id=None)
 
+@admin.route('/usage')
+@login_required
+def usage():
+    """用量统计：按天、按模型与按用户汇总；?user_id= 查看单个用户"""
+    if not current_user.is_admin:
+        flash('无权限访问', 'error')
+        return redirect(url_for('main.index'))
+    
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    user_id = request.args.get('user_id', type=int)
+    try:
+        data = {
+            'days': days,
+            'user_id': user_id,
+            'daily': UsageService.get_daily_usage(days, user_id),
+            'models': UsageService.get_model_usage(days, user_id)
+        }
+        if user_id is None:
+            data['top_users'] = UsageService.get_top_users(days)
+        else:
+            data['user'] = UsageService.get_user_label(user_id)
+            data['conversations'] = UsageService.get_user_conversations(user_id)
+        
+        if request.args.get('format') == 'json':
+            return jsonify(dict(data, success=True))
+        return render_template('admin/usage.html', **data)
+    except Exception as e:
+        logger.error("获取用量统计失败: %s", e)
+        flash('获取用量统计失败', 'error')
+        return redirect(url_for('admin.dashboard'))
+
 @admin.route('/config', methods=['GET', 'POST'])
 @login_required
 def config():
@@ -135,7 +174,7 @@ def config():
                 flash(f'配置测试失败: {test_result["message"]}', 'error')
                 
         except Exception as e:
-            logging.error(f"保存配置失败: {str(e)}")
+            logger.error("保存配置失败: %s", e)
             flash('保存配置失败', 'error')
     
     try:
@@ -143,7 +182,7 @@ def config():
         current_config = Config.get_openai_config()
         return render_template('admin/config.html', config=current_config)
     except Exception as e:
-        logging.error(f"获取配置失败: {str(e)}")
+        logger.error("获取配置失败: %s", e)
         flash('获取配置失败', 'error')
         return render_template('admin/config.html', config={})
 
@@ -171,7 +210,7 @@ def test_api():
         return jsonify(result)
         
     except Exception as e:
-        logging.error(f"API测试失败: {str(e)}")
+        logger.error("API测试失败: %s", e)
         return jsonify({
             'success': False,
             'message': f'测试失败: {str(e)}'
@@ -197,6 +236,121 @@ def view_conversation(conversation_id):
                              conversation=conversation_detail['conversation'],
                              messages=conversation_detail['messages'])
     except Exception as e:
-        logging.error(f"获取对话详情失败: {str(e)}")
+        logger.error("获取对话详情失败: %s", e)
         flash('获取对话详情失败', 'error')
-        return redirect(url_for('admin.conversations'))
\ No newline at end of file
+        return redirect(url_for('admin.conversations'))
+
+@admin.route('/metrics')
+@login_required
+def metrics_view():
+    """运行指标（当前 worker 进程）"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': '无权限访问'}), 403
+    
+    data = metrics.snapshot()
+    data['pool'] = describe_pool(db.engine.pool)
+    data['tasks'] = background.status()
+    data['semantic_cache'] = semantic_cache.status(top=0)
+    return jsonify({'success': True, 'metrics': data})
+
+@admin.route('/semantic-cache')
+@login_required
+def semantic_cache_view():
+    """语义缓存：当前 worker 的命中率、各阈值下的估算命中率与命中最多的条目"""
+    if not current_user.is_admin:
+        flash('无权限访问', 'error')
+        return redirect(url_for('main.index'))
+    
+    status = semantic_cache.status()
+    if request.args.get('format') == 'json':
+        return jsonify({'success': True, 'status': status})
+    return render_template('admin/semantic_cache.html', status=status)
+
+@admin.route('/semantic-cache/clear', methods=['POST'])
+@login_required
+def semantic_cache_clear():
+    """清空当前 worker 的语义缓存"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': '无权限访问'}), 403
+    
+    semantic_cache.clear()
+    if request.is_json:
+        return jsonify({'success': True})
+    flash('已清空当前 worker 的语义缓存', 'success')
+    return redirect(url_for('admin.semantic_cache_view'))
+
+@admin.route('/profiler')
+@login_required
+def profiler_view():
+    """采样分析：当前 worker 的会话状态与已保存的结果"""
+    if not current_user.is_admin:
+        flash('无权限访问', 'error')
+        return redirect(url_for('main.index'))
+    
+    return render_template('admin/profiler.html',
+                         status=profiler.status(),
+                         profiles=profiler.list_profiles(),
+                         limits={'max_seconds': profiler.max_seconds,
+                                 'max_requests': profiler.max_requests,
+                                 'interval_ms': profiler.interval_ms})
+
+@admin.route('/profiler/start', methods=['POST'])
+@login_required
+def profiler_start():
+    """在处理本请求的 worker 上开启采样"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': '无权限访问'}), 403
+    
+    data = request.get_json(silent=True) or request.form
+    try:
+        session = profiler.start(mode=data.get('mode', 'duration'),
+                                 seconds=data.get('seconds') or 10,
+                                 interval_ms=data.get('interval_ms'),
+                                 route=data.get('route'),
+                                 requests=data.get('requests'),
+                                 include_idle=str(data.get('include_idle', '')).lower() in ('1', 'true', 'on'))
+    except ValueError as e:
+        if request.is_json:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        flash(str(e), 'error')
+        return redirect(url_for('admin.profiler_view'))
+    
+    if request.is_json:
+        return jsonify({'success': True, 'session': session})
+    flash(f'已在 worker {session["pid"]} 上开始采样', 'success')
+    return redirect(url_for('admin.profiler_view'))
+
+@admin.route('/profiler/stop', methods=['POST'])
+@login_required
+def profiler_stop():
+    """提前结束当前 worker 的采样"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': '无权限访问'}), 403
+    
+    stopped = profiler.stop()
+    if request.is_json:
+        return jsonify({'success': stopped})
+    flash('已停止采样' if stopped else '当前 worker 没有运行中的采样', 'info')
+    return redirect(url_for('admin.profiler_view'))
+
+@admin.route('/profiler/status')
+@login_required
+def profiler_status():
+    """当前 worker 的采样状态"""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': '无权限访问'}), 403
+    
+    return jsonify({'success': True, 'status': profiler.status()})
+
+@admin.route('/profiler/<profile_id>.collapsed')
+@login_required
+def profiler_download(profile_id):
+    """下载折叠栈文件（flamegraph.pl / speedscope 可直接读取）"""
+    if not current_user.is_admin:
+        abort(403)
+    
+    path = profiler.profile_path(profile_id)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='text/plain', as_attachment=True,
+                     download_name=profile_id + '.collapsed')
@@ -1,37 +1,115 @@
-from flask import Blueprint, request, jsonify, session, Response
-from flask import Blueprint, request, jsonify, session, Response
-from app.services import ChatService
-from app.models import Conversation, Message
+from flask import Blueprint, request, jsonify, session, Response, current_app
+from app.services import ChatService, UsageService, QuotaExceededError
+from app.models import Conversation, Message, IdempotencyConflictError
+from app.utils.log import bind_conversation
+from app.utils.streams import streams
 import logging
+import re
+
+logger = logging.getLogger(__name__)
 
 chat = Blueprint('chat', __name__)
 
+# 幂等键格式：页面生成的 UUID，也接受其他客户端的字母、数字、下划线与连字符
+_IDEMPOTENCY_KEY_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def _idempotency_key():
+    """读取请求头中的幂等键，格式不正确时抛出 ValueError"""
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        return None
+    if not _IDEMPOTENCY_KEY_RE.match(key):
+        raise ValueError('Idempotency-Key 格式不正确')
+    return key
+
+def _draining():
+    """本 worker 正在排空（重启/停止中）：不再接受新的发送，客户端稍后重试会落到其他 worker"""
+    response = jsonify({
+        'success': False,
+        'error': '服务正在重启，请稍后重试'
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+def _quota_exceeded(error):
+    """超出每日配额：429，Retry-After 为距离配额重置的秒数"""
+    response = jsonify({
+        'success': False,
+        'error': str(error)
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def _idempotency_conflict(error):
+    """幂等键已用于内容不同的请求：422；并发登记失败：409，客户端可用同一个键重试"""
+    return jsonify({
+        'success': False,
+        'error': str(error)
+    }), 409 if error.retryable else 422
+
 @chat.route('/conversations')
 def get_conversations():
-    """获取用户的对话列表"""
+    """获取用户的对话列表
+    
+    支持 ?since=<版本号> 增量同步（只返回变化和删除的对话），
+    以及 If-None-Match 条件请求（无变化时返回304）。
+    """
     try:
-        logging.info("开始获取对话列表")
-        user = ChatService.get_or_create_user()
-        logging.info(f"用户获取成功: {user.id}")
+        user = ChatService.get_current_user()
         
-        conversations = ChatService.get_user_conversations(user.id)
-        logging.info(f"找到 {len(conversations)} 个对话")
+        # 同一URL下，相同的同步版本号总是对应相同的响应内容
+        etag = f'c{user.id}.{user.sync_version}' if user else 'c0.0'
+        if request.if_none_match.contains_weak(etag):
+            return _conversations_response(Response(status=304), etag)
         
-        conversations_data = []
-        for conv in conversations:
-            conversations_data.append(conv.to_dict())
+        # 尚未发送过消息的访问者没有用户记录，直接返回空列表
+        if user is None:
+            return _conversations_response(jsonify({
+                'success': True,
+                'full': True,
+                'version': 0,
+                'conversations': []
+            }), etag)
         
-        return jsonify({
-            'success': True,
-            'conversations': conversations_data
-        })
+        since = request.args.get('since', type=int)
+        changes = ChatService.get_conversation_changes(user, since) if since is not None else None
+        
+        if changes is not None:
+            logger.debug("增量同步: %d 个变化, %d 个删除", len(changes['conversations']), len(changes['deleted']))
+            payload = {
+                'success': True,
+                'full': False,
+                'version': user.sync_version,
+                'conversations': changes['conversations'],
+                'deleted': changes['deleted']
+            }
+        else:
+            conversations = ChatService.get_user_conversations(user.id)
+            payload = {
+                'success': True,
+                'full': True,
+                'version': user.sync_version,
+                'conversations': ChatService.serialize_conversations(conversations)
+            }
+        
+        return _conversations_response(jsonify(payload), etag)
     except Exception as e:
-        logging.error(f"获取对话列表失败: {str(e)}", exc_info=True)
+        logger.error("获取对话列表失败: %s", e, exc_info=True)
         return jsonify({
             'success': False,
             'error': f'获取对话列表失败: {str(e)}'
         }), 500
 
+def _conversations_response(response, etag):
+    """为对话列表响应设置缓存校验头"""
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
 @chat.route('/new', methods=['POST'])
 def create_conversation():
     """创建新对话"""
@@ -45,7 +123,7 @@ def create_conversation():
             'message': '新对话创建成功'
         })
     except Exception as e:
-        logging.error(f"创建对话失败: {str(e)}")
+        logger.error("创建对话失败: %s", e)
         return jsonify({
             'success': False,
             'error': '创建对话失败'
@@ -53,26 +131,31 @@ def create_conversation():
 
 @chat.route('/messages/<int:conversation_id>')
 def get_messages(conversation_id):
-    """获取对话的消息列表"""
+    """获取对话的消息列表（游标分页，最新的一页优先）"""
+    bind_conversation(conversation_id)
     try:
-        user = ChatService.get_or_create_user()
+        user = ChatService.get_current_user()
+        if user is None:
+            return jsonify({
+                'success': False,
+                'error': '对话不存在或无权限访问'
+            }), 404
         
-        # 获取对话详情
-        conversation_detail = ChatService.get_conversation_detail(conversation_id, user.id)
+        before = request.args.get('before', type=int)
+        limit = request.args.get('limit', current_app.config['MESSAGE_PAGE_SIZE'], type=int)
+        limit = max(1, min(limit, current_app.config['MESSAGE_PAGE_MAX']))
         
-        if not conversation_detail:
+        page = ChatService.get_conversation_page(conversation_id, user.id, before=before, limit=limit)
+        
+        if not page:
             return jsonify({
                 'success': False,
                 'error': '对话不存在或无权限访问'
             }), 404
         
-        return jsonify({
-            'success': True,
-            'conversation': conversation_detail['conversation'],
-            'messages': conversation_detail['messages']
-        })
+        return jsonify(dict(page, success=True))
     except Exception as e:
-        logging.error(f"获取消息失败: {str(e)}")
+        logger.error("获取消息失败: %s", e)
         return jsonify({
             'success': False,
             'error': '获取消息失败'
@@ -82,12 +165,10 @@ def get_messages(conversation_id):
 def send_message():
     """发送消息（备用非流式端点）"""
     try:
-        logging.info("收到发送消息请求")
         data = request.get_json()
-        logging.info(f"请求数据: {data}")
         
         if not data or 'message' not in data or 'conversation_id' not in data:
-            logging.error("请求参数不完整")
+            logger.warning("请求参数不完整")
             return jsonify({
                 'success': False,
                 'error': '请求参数不完整'
@@ -95,33 +176,46 @@ def send_message():
         
         conversation_id = data['conversation_id']
         message = data['message'].strip()
+        bind_conversation(conversation_id)
         
         if not message:
-            logging.error("消息内容为空")
+            logger.warning("消息内容为空")
             return jsonify({
                 'success': False,
                 'error': '消息内容不能为空'
             }), 400
         
-        logging.info(f"处理消息: conversation_id={conversation_id}, message='{message[:50]}...'")
+        try:
+            idempotency_key = _idempotency_key()
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        if streams.draining:
+            return _draining()
         
         user = ChatService.get_or_create_user()
-        logging.info(f"用户ID: {user.id}")
+        try:
+            UsageService.check_quota(user.id)
+        except QuotaExceededError as e:
+            return _quota_exceeded(e)
         
         # 使用原有的非流式方法确保保存
-        logging.info("开始调用ChatService.send_message")
-        result = ChatService.send_message(conversation_id, message, user.id)
-        logging.info(f"ChatService.send_message返回结果: {result.get('success', False)}")
+        try:
+            result = ChatService.send_message(conversation_id, message, user.id, idempotency_key)
+        except IdempotencyConflictError as e:
+            return _idempotency_conflict(e)
         
         if result['success']:
-            logging.info("消息发送成功，返回结果")
             return jsonify(result)
         else:
-            logging.error(f"消息发送失败: {result.get('error', 'Unknown error')}")
+            logger.error("消息发送失败: %s", result.get('error', 'Unknown error'))
             return jsonify(result), 500
             
     except Exception as e:
-        logging.error(f"发送消息异常: {str(e)}", exc_info=True)
+        logger.error("发送消息异常: %s", e, exc_info=True)
         return jsonify({
             'success': False,
             'error': '发送消息失败'
@@ -130,10 +224,11 @@ def send_message():
 @chat.route('/delete/<int:conversation_id>', methods=['DELETE'])
 def delete_conversation(conversation_id):
     """删除对话"""
+    bind_conversation(conversation_id)
     try:
-        user = ChatService.get_or_create_user()
+        user = ChatService.get_current_user()
         
-        if ChatService.delete_conversation(conversation_id, user.id):
+        if user is not None and ChatService.delete_conversation(conversation_id, user.id):
             return jsonify({
                 'success': True,
                 'message': '对话删除成功'
@@ -145,7 +240,7 @@ def delete_conversation(conversation_id):
             }), 404
             
     except Exception as e:
-        logging.error(f"删除对话失败: {str(e)}")
+        logger.error("删除对话失败: %s", e)
         return jsonify({
             'success': False,
             'error': '删除对话失败'
@@ -165,6 +260,7 @@ def send_message_stream():
         
         conversation_id = data['conversation_id']
         message = data['message'].strip()
+        bind_conversation(conversation_id)
         
         if not message:
             return jsonify({
@@ -172,25 +268,44 @@ def send_message_stream():
                 'error': '消息内容不能为空'
             }), 400
         
+        try:
+            idempotency_key = _idempotency_key()
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        if streams.draining:
+            return _draining()
+        
         user = ChatService.get_or_create_user()
+        try:
+            UsageService.check_quota(user.id)
+        except QuotaExceededError as e:
+            return _quota_exceeded(e)
         
-        # 获取流式生成器
-        stream_generator = ChatService.send_message_stream(conversation_id, message, user.id)
+        # 获取流式生成器（带幂等键的重复请求接到原来的流上或重放结果）
+        try:
+            stream_generator = ChatService.send_message_stream(conversation_id, message, user.id, idempotency_key)
+        except IdempotencyConflictError as e:
+            return _idempotency_conflict(e)
         
         def generate_with_logging():
             """包装生成器以添加日志"""
-            logging.info(f"开始流式响应: conversation_id={conversation_id}, message_len={len(message)}")
+            logger.debug("开始流式响应: message_len=%d", len(message))
             chunk_count = 0
             try:
                 for chunk in stream_generator:
                     chunk_count += 1
-                    if chunk_count % 10 == 0:  # 每10个chunk记录一次
-                        logging.info(f"已发送 {chunk_count} 个chunk")
                     yield chunk
-                logging.info(f"流式响应完成: 总共发送 {chunk_count} 个chunk")
+                logger.debug("流式响应完成: 共发送 %d 个事件", chunk_count)
             except Exception as e:
-                logging.error(f"流式生成器错误: {str(e)}", exc_info=True)
+                logger.error("流式生成器错误: %s", e, exc_info=True)
                 raise
+            finally:
+                # 客户端断开时服务器关闭本生成器，需一并关闭内层生成器以停止读取上游
+                stream_generator.close()
         
         return Response(
             generate_with_logging(),
@@ -203,8 +318,32 @@ def send_message_stream():
         )
             
     except Exception as e:
-        logging.error(f"发送流式消息失败: {str(e)}", exc_info=True)
+        logger.error("发送流式消息失败: %s", e, exc_info=True)
         return jsonify({
             'success': False,
             'error': '发送消息失败'
+        }), 500
+
+@chat.route('/cancel/<stream_id>', methods=['POST'])
+def cancel_stream(stream_id):
+    """停止生成：关闭上游响应，已生成的部分回复保存为已停止"""
+    try:
+        user = ChatService.get_current_user()
+        if user is None:
+            raise ValueError('无权停止该回复')
+        result = streams.cancel(stream_id, user.id)
+        return jsonify({
+            'success': True,
+            'result': result
+        })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error("停止生成失败: %s", e)
+        return jsonify({
+            'success': False,
+            'error': '停止生成失败'
         }), 500
\ No newline at end of file
@@ -0,0 +1,37 @@
+from flask import Blueprint, jsonify
+from app.utils.health import health as checker
+from app.utils.streams import streams
+
+health = Blueprint('health', __name__)
+
+
+@health.route('/healthz')
+def healthz():
+    """存活检查：数据库与上游是否可达（结果按项缓存，见 app/utils/health.py）
+
+    只有数据库不可达时返回 503；上游不可达时返回 200、status 为 degraded，
+    避免上游故障时编排系统反复重启所有实例。
+    """
+    status = checker.status()
+    checks = status['checks']
+    if not checks['database']['ok']:
+        state, code = 'error', 503
+    elif not checks['upstream']['ok']:
+        state, code = 'degraded', 200
+    else:
+        state, code = 'ok', 200
+    return jsonify({'status': state, 'checks': checks}), code
+
+
+@health.route('/readyz')
+def readyz():
+    """就绪检查：排空（重启/停止中）或数据库不可达时返回 503，负载均衡不再分配新请求"""
+    database = checker.database.get()
+    draining = streams.draining
+    ready = database['ok'] and not draining
+    return jsonify({
+        'ready': ready,
+        'draining': draining,
+        'active_streams': streams.active_count(),
+        'database': database['ok']
+    }), 200 if ready else 503
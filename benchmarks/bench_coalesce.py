@@ -0,0 +1,70 @@
+"""
+下游 SSE 合并基准
+
+以给定速率模拟上游 token 流（带抖动），对比不合并与不同合并窗口下
+每秒下发给浏览器的事件数、首个事件的延迟，以及 token 从上游产出到下发的最大滞后
+（应不超过合并窗口；--stall-ms 在中途插入一次上游停顿，检查停顿期间缓冲仍按窗口输出）。
+
+用法:
+    python benchmarks/bench_coalesce.py [--tokens-per-sec 150] [--tokens 600] [--windows 0,20,30,50] [--stall-ms 500]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.utils.sse import ChunkCoalescer  # noqa: E402
+
+
+def token_stream(count, tokens_per_sec, emitted, stall=0.0, seed=0):
+    """按速率产出 token，间隔服从指数分布；产出时刻记录到 emitted，stall 秒的停顿插在中间"""
+    rng = random.Random(seed)
+    for i in range(count):
+        time.sleep(rng.expovariate(tokens_per_sec) + (stall if i == count // 2 else 0))
+        emitted.append(time.monotonic())
+        yield f'tok{i % 10} '
+
+
+def run(window_ms, args):
+    emitted = []
+    coalescer = ChunkCoalescer(
+        token_stream(args.tokens, args.tokens_per_sec, emitted, args.stall_ms / 1000.0),
+        window=window_ms / 1000.0,
+        max_chars=args.max_chars
+    )
+    start = time.monotonic()
+    first_event = None
+    received = 0
+    max_lag = 0.0
+    for event in coalescer:
+        now = time.monotonic()
+        if first_event is None:
+            first_event = now - start
+        # 事件中每个 token 以空格结尾，按顺序对应 emitted 中的产出时刻
+        count = event.count(' ')
+        max_lag = max(max_lag, now - emitted[received])
+        received += count
+    return coalescer.stats(), first_event, max_lag
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下游 SSE 合并基准')
+    parser.add_argument('--tokens-per-sec', type=float, default=150.0)
+    parser.add_argument('--tokens', type=int, default=600)
+    parser.add_argument('--max-chars', type=int, default=512)
+    parser.add_argument('--windows', default='0,20,30,50', help='合并窗口（毫秒），逗号分隔，0 表示不合并')
+    parser.add_argument('--stall-ms', type=float, default=500.0, help='中途上游停顿的时长（毫秒），0 表示不停顿')
+    args = parser.parse_args()
+
+    print(f"{'窗口(ms)':>10}{'上游块/s':>12}{'下发事件/s':>14}{'事件数':>10}{'首事件(ms)':>14}{'最大滞后(ms)':>16}")
+    for window_ms in (int(w) for w in args.windows.split(',')):
+        stats, first_event, max_lag = run(window_ms, args)
+        print(f"{window_ms:>10}{stats['upstream_per_sec']:>12.1f}{stats['events_per_sec']:>14.1f}"
+              f"{stats['events']:>10}{first_event * 1000:>14.1f}{max_lag * 1000:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
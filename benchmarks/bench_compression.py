@@ -0,0 +1,102 @@
+"""
+响应压缩基准
+
+统计历史消息 JSON 与下游 SSE 流在 identity / gzip / br 下的传输字节数
+与每个响应的压缩 CPU 耗时。SSE 流按事件逐个同步刷新，与线上行为一致。
+
+用法:
+    python benchmarks/bench_compression.py [--messages 200] [--repeat 20]
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.utils.compression import _GzipStream, _BrotliStream, brotli  # noqa: E402
+from app.utils.sse import iter_sse_payloads, extract_delta_content  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def history_body(count):
+    """构造一个长对话的消息列表响应"""
+    with open(os.path.join(DATA_DIR, 'qwen_stream.sse'), 'rb') as f:
+        reply = ''.join(filter(None, (extract_delta_content(p) for p in iter_sse_payloads([f.read()]))))
+    messages = []
+    for i in range(count):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        messages.append({
+            'id': i + 1,
+            'role': role,
+            'content': f'第{i // 2 + 1}个问题：如何优化接口性能？' if role == 'user' else reply[:400 + (i * 37) % 800],
+            'created_at': '2024-06-10T08:%02d:%02d.123456' % (i // 60 % 60, i % 60)
+        })
+    body = {'success': True, 'conversation': {'id': 1, 'title': '性能优化'}, 'messages': messages}
+    return json.dumps(body, ensure_ascii=False).encode('utf-8')
+
+
+def sse_frames():
+    """把录制的上游流转换成下游 ai_chunk 事件帧"""
+    with open(os.path.join(DATA_DIR, 'qwen_stream.sse'), 'rb') as f:
+        payloads = list(iter_sse_payloads([f.read()]))
+    frames = [b'data: {"type": "ai_start"}\n\n']
+    for payload in payloads:
+        content = extract_delta_content(payload)
+        if content:
+            frame = {'type': 'ai_chunk', 'content': content}
+            frames.append(f'data: {json.dumps(frame, ensure_ascii=False)}\n\n'.encode('utf-8'))
+    frames.append(b'data: [DONE]\n\n')
+    return frames
+
+
+def encoders():
+    result = [('gzip', lambda: _GzipStream(6), gzip.decompress)]
+    if brotli is not None:
+        result.append(('br', lambda: _BrotliStream(4), brotli.decompress))
+    return result
+
+
+def measure(frames, make_stream, repeat):
+    best = float('inf')
+    size = 0
+    output = b''
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stream = make_stream()
+        parts = [stream.compress(frame) for frame in frames]
+        parts.append(stream.finish())
+        best = min(best, time.perf_counter() - start)
+        output = b''.join(parts)
+        size = len(output)
+    return size, best, output
+
+
+def report(name, frames, repeat):
+    raw = b''.join(frames)
+    print(f'{name}（{len(frames)} 个写入, 原始 {len(raw)} 字节）')
+    print(f"    {'编码':<10}{'字节数':>10}{'压缩率':>10}{'CPU µs/响应':>14}")
+    print(f"    {'identity':<10}{len(raw):>10}{1.0:>10.2f}{0.0:>14.1f}")
+    for encoding, make_stream, decompress in encoders():
+        size, elapsed, output = measure(frames, make_stream, repeat)
+        if decompress(output) != raw:
+            print(f'    {encoding}: 解压结果与原文不一致', file=sys.stderr)
+            sys.exit(1)
+        print(f'    {encoding:<10}{size:>10}{size / len(raw):>10.2f}{elapsed * 1e6:>14.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='响应压缩基准')
+    parser.add_argument('--messages', type=int, default=200, help='历史消息条数')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    report('消息历史 JSON', [history_body(args.messages)], args.repeat)
+    report('SSE 流（逐事件同步刷新）', sse_frames(), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
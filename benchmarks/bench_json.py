@@ -0,0 +1,138 @@
+"""
+JSON 序列化基准
+
+1. SSE 帧：以录制回复的增量文本为 ai_chunk 内容，比较原来的 f-string + json.dumps（再按 UTF-8 编码，
+   与 WSGI 输出一致）与 encode_event / chunk_event 在 stdlib、orjson 两种后端下的单核帧/秒；
+2. API 响应：50 个会话的列表与 50 条消息的一页，比较 Flask 默认 provider 与 AppJSONProvider 的
+   ``jsonify`` 耗时与响应字节数。
+
+单核：单线程运行，按进程 CPU 时间计算。
+
+用法:
+    python benchmarks/bench_json.py [--frames 200000] [--repeat 2000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.utils.json_provider import json_codec, orjson, AppJSONProvider  # noqa: E402
+from app.utils.sse import iter_sse_payloads, extract_delta_content, encode_event, chunk_event  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+PAGE_SIZE = 50
+
+
+def recorded_chunks():
+    chunks = []
+    for name in ('qwen_stream.sse', 'openai_stream.sse'):
+        with open(os.path.join(DATA_DIR, name), 'rb') as f:
+            chunks.extend(filter(None, (extract_delta_content(p) for p in iter_sse_payloads([f.read()]))))
+    return chunks
+
+
+def old_chunk_frame(content):
+    return f"data: {json.dumps({'type': 'ai_chunk', 'content': content}, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+def new_chunk_frame_generic(content):
+    return encode_event({'type': 'ai_chunk', 'content': content})
+
+
+def backends():
+    return ['stdlib'] + (['orjson'] if orjson is not None else [])
+
+
+def frames_per_sec(fn, contents, frames):
+    count = len(contents)
+    start = time.process_time()
+    for i in range(frames):
+        fn(contents[i % count])
+    return frames / max(time.process_time() - start, 1e-9)
+
+
+def bench_frames(frames):
+    contents = recorded_chunks()
+    size = sum(len(c) for c in contents) / len(contents)
+    print(f'ai_chunk 内容：录制回复的 {len(contents)} 个增量，平均 {size:.1f} 字')
+    print(f"\n{'方式':<36}{'帧/秒（单核）':>14}{'相对':>8}")
+    baseline = frames_per_sec(old_chunk_frame, contents, frames)
+    print(f"{'f-string + json.dumps':<36}{baseline:>14,.0f}{1:>8.2f}")
+    for backend in backends():
+        json_codec.backend = backend
+        for name, fn in (('encode_event', new_chunk_frame_generic), ('chunk_event', chunk_event)):
+            rate = frames_per_sec(fn, contents, frames)
+            print(f"{name + ' (' + backend + ')':<36}{rate:>14,.0f}{rate / baseline:>8.2f}")
+
+
+def api_payloads():
+    """与 to_dict 输出结构一致的会话列表与消息页"""
+    rng = random.Random(3)
+    now = datetime(2026, 10, 1, 12, 0, 0, 123456)
+    text = ''.join(recorded_chunks())
+    conversations = {'success': True, 'full': True, 'version': 1024, 'conversations': [{
+        'id': 1000 + i,
+        'title': text[i * 7:i * 7 + 16],
+        'message_count': rng.randrange(2, 80),
+        'created_at': (now - timedelta(days=i)).isoformat(),
+        'updated_at': (now - timedelta(hours=i)).isoformat(),
+        'last_message_time': (now - timedelta(hours=i)).isoformat()
+    } for i in range(PAGE_SIZE)]}
+    messages = []
+    for i in range(PAGE_SIZE):
+        length = 60 if i % 2 == 0 else rng.randrange(200, 1500)
+        start = rng.randrange(0, max(1, len(text) - length))
+        messages.append({
+            'id': 5000 + i,
+            'role': 'user' if i % 2 == 0 else 'assistant',
+            'content': text[start:start + length],
+            'status': 'complete',
+            'created_at': (now + timedelta(seconds=i)).isoformat()
+        })
+    page = {'success': True, 'messages': messages, 'has_more': True, 'next_before': 5000,
+            'conversation': conversations['conversations'][0]}
+    return (('会话列表', conversations), ('消息页', page))
+
+
+def bench_api(repeat):
+    app = Flask(__name__)
+    default = DefaultJSONProvider(app)
+    fast = AppJSONProvider(app)
+    print(f"\n{'响应':<10}{'provider':<24}{'us/次':>10}{'字节':>10}{'相对':>8}")
+    with app.app_context():
+        for label, payload in api_payloads():
+            baseline = None
+            runs = [('Flask 默认', None, default)] + [(f'AppJSONProvider ({b})', b, fast) for b in backends()]
+            for name, backend, provider in runs:
+                if backend:
+                    json_codec.backend = backend
+                start = time.process_time()
+                for _ in range(repeat):
+                    body = provider.response(payload).get_data()
+                us = (time.process_time() - start) * 1e6 / repeat
+                baseline = baseline or us
+                print(f'{label:<10}{name:<24}{us:>10.1f}{len(body):>10}{baseline / us:>8.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON 序列化基准')
+    parser.add_argument('--frames', type=int, default=200000, help='每种方式编码的 SSE 帧数')
+    parser.add_argument('--repeat', type=int, default=2000, help='每种 API 响应的序列化次数')
+    args = parser.parse_args()
+
+    bench_frames(args.frames)
+    bench_api(args.repeat)
+    if orjson is None:
+        print('（未安装 orjson，只测试标准库后端）')
+
+
+if __name__ == '__main__':
+    main()
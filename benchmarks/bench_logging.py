@@ -0,0 +1,139 @@
+"""
+日志开销基准
+
+1. 单次调用（请求线程内耗时）：同步处理器与队列处理器写文件、输出端变慢时两者的差异、
+   f-string 与 %-style、被禁用级别的调用开销；
+2. 单个请求：通过测试客户端反复调用 /api/chat/send（未配置 API 密钥时为模拟回复）与
+   /api/chat/conversations，统计 INFO / DEBUG 级别下每个请求产生的日志条数与估算开销。
+
+用法:
+    python benchmarks/bench_logging.py [--calls 20000] [--requests 300]
+"""
+import argparse
+import logging
+import os
+import queue
+import sys
+import tempfile
+import time
+from logging.handlers import QueueListener
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# 配置在导入 app 时读取，需先于导入设置
+TMPDIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMPDIR, 'bench.db')
+os.environ['OPENAI_API_KEY'] = ''
+
+from app.utils.log import ContextFilter, DroppingQueueHandler, JsonFormatter  # noqa: E402
+
+
+class SlowFileHandler(logging.FileHandler):
+    """模拟输出端阻塞（如日志管道被采集端拖慢），每次写入额外等待"""
+
+    delay = 0.0002
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        super().emit(record)
+
+
+def file_handler(path, slow=False):
+    handler = (SlowFileHandler if slow else logging.FileHandler)(path, encoding='utf-8')
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def build_logger(name, mode, path, level=logging.INFO, slow=False):
+    """mode: sync 为请求线程内同步写文件；queue 为队列 + 后台线程写文件"""
+    logger = logging.getLogger(name)
+    logger.handlers[:] = []
+    logger.propagate = False
+    logger.setLevel(level)
+    listener = None
+    if mode == 'sync':
+        handler = file_handler(path, slow)
+    else:
+        handler = DroppingQueueHandler(queue.Queue(100000))
+        listener = QueueListener(handler.queue, file_handler(path, slow))
+        listener.start()
+    handler.addFilter(ContextFilter())
+    logger.addHandler(handler)
+    return logger, listener
+
+
+def per_call(calls, tmpdir):
+    user = {'id': 42, 'session_id': 'a' * 36}
+    info_fstring = lambda log, i: log.info(f"用户创建/获取成功: {user['id']} {i}")  # noqa: E731
+    info_lazy = lambda log, i: log.info("用户创建/获取成功: %s %d", user['id'], i)  # noqa: E731
+    cases = [
+        ('同步 INFO f-string', 'sync', False, info_fstring),
+        ('同步 INFO %-style', 'sync', False, info_lazy),
+        ('队列 INFO %-style', 'queue', False, info_lazy),
+        ('慢输出 同步 INFO', 'sync', True, info_lazy),
+        ('慢输出 队列 INFO', 'queue', True, info_lazy),
+        ('禁用 DEBUG f-string', 'queue', False, lambda log, i: log.debug(f"请求数据: {user} {i}")),
+        ('禁用 DEBUG %-style', 'queue', False, lambda log, i: log.debug("请求数据: %s %d", user, i)),
+    ]
+    results = {}
+    print(f"{'单次调用（请求线程耗时）':<22}{'µs/次':>10}")
+    for index, (name, mode, slow, call) in enumerate(cases):
+        logger, listener = build_logger(f'bench.call{index}', mode, os.path.join(tmpdir, f'call{index}.log'), slow=slow)
+        # 慢输出时按请求的节奏间隔写入，队列有时间被后台线程消费
+        pause = SlowFileHandler.delay * 2 if slow else 0
+        n = calls // 20 if slow else calls
+        elapsed = 0.0
+        for i in range(n):
+            start = time.perf_counter()
+            call(logger, i)
+            elapsed += time.perf_counter() - start
+            if pause:
+                time.sleep(pause)
+        if listener is not None:
+            listener.stop()
+        results[name] = elapsed / n * 1e6
+        print(f'{name:<22}{results[name]:>10.2f}')
+    return results
+
+
+def per_request(count, tmpdir, call_cost):
+    """统计每个请求实际产生的日志条数，并按单次调用开销估算每个请求的日志耗时
+
+    请求本身的耗时（SQLite 提交等）波动远大于日志开销，直接对比请求耗时看不出差异。
+    """
+    from app import create_app
+    from app.cli import bootstrap_database
+    app = create_app('production')
+    with app.app_context():
+        bootstrap_database()
+    client = app.test_client()
+
+    print(f"\n{'单个请求':<22}{'级别':>8}{'记录/请求':>10}{'估算µs/请求':>14}")
+    for path, body in (('/api/chat/send', True), ('/api/chat/conversations', False)):
+        for level in (logging.INFO, logging.DEBUG):
+            log_path = os.path.join(tmpdir, f'request-{body}-{level}.log')
+            logger, listener = build_logger('app', 'queue', log_path, level)
+            conversation_id = client.post('/api/chat/new').get_json()['conversation_id']
+            for _ in range(count):
+                if body:
+                    client.post(path, json={'conversation_id': conversation_id, 'message': '你好'})
+                else:
+                    client.get(path)
+            listener.stop()
+            with open(log_path, encoding='utf-8') as f:
+                records = sum(1 for _ in f) / count
+            print(f'{path:<22}{logging.getLevelName(level):>8}{records:>10.1f}{records * call_cost:>14.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='日志开销基准')
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+
+    results = per_call(args.calls, TMPDIR)
+    per_request(args.requests, TMPDIR, results['队列 INFO %-style'])
+
+
+if __name__ == '__main__':
+    main()
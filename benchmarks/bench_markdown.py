@@ -0,0 +1,116 @@
+"""
+Markdown 渲染基准
+
+1. 渲染：从项目 README（中文 Markdown，含标题、列表、表格、代码块）按 AI 回复的长度分布截取正文，
+   统计每条的渲染耗时与 HTML 大小（Pygments 已安装时包含代码高亮）；
+2. 读取一页：50 条消息每次读取都重新渲染，与保存时渲染一次、读取时只解码存储的 HTML 的耗时对比；
+3. 流式：按录制流的平均增量大小（约 3 字）把正文切块，比较只下发 ai_chunk 与同时增量渲染（MarkdownStream）的每块耗时。
+
+用法:
+    python benchmarks/bench_markdown.py [--messages 2000]
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.utils.markdown import render_markdown, MarkdownStream, highlight  # noqa: E402
+from app.utils.sse import chunk_event  # noqa: E402
+from app.utils.text_compression import text_compressor  # noqa: E402
+
+README = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'README.md')
+PAGE_SIZE = 50
+CHUNK_CHARS = 3
+
+
+def corpus(count, seed=11):
+    """按行边界截取 README 片段，长度为对数正态分布（中位数约 600 字）"""
+    with open(README, encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        target = max(20, int(rng.lognormvariate(math.log(600), 0.8)))
+        start = rng.randrange(len(lines))
+        text = []
+        size = 0
+        for line in lines[start:]:
+            text.append(line)
+            size += len(line) + 1
+            if size >= target:
+                break
+        messages.append('\n'.join(text))
+    return messages
+
+
+def bench_render(messages):
+    timings = []
+    html_bytes = 0
+    for text in messages:
+        start = time.perf_counter()
+        html = render_markdown(text)
+        timings.append((time.perf_counter() - start) * 1000)
+        html_bytes += len(html.encode('utf-8'))
+    raw_bytes = sum(len(m.encode('utf-8')) for m in messages)
+    timings.sort()
+    print(f'{len(messages)} 条消息，平均 {raw_bytes / len(messages):.0f} 字节，'
+          f'代码高亮: {"开启" if highlight is not None else "未安装 Pygments"}')
+    print(f'渲染: p50 {statistics.median(timings):.3f} ms，p95 {timings[int(len(timings) * 0.95)]:.3f} ms，'
+          f'HTML 为原文的 {html_bytes / raw_bytes:.2f} 倍')
+
+
+def bench_page(messages):
+    pages = [messages[i:i + PAGE_SIZE] for i in range(0, len(messages) - PAGE_SIZE + 1, PAGE_SIZE)]
+    # 按列中的存储形式（CompressedText，默认 zlib、1024 字节以上压缩）读取
+    stored = [[text_compressor.encode(render_markdown(text)) for text in page] for page in pages]
+
+    start = time.perf_counter()
+    for page in pages:
+        [render_markdown(text) for text in page]
+    render_ms = (time.perf_counter() - start) * 1000 / len(pages)
+
+    start = time.perf_counter()
+    for page in stored:
+        [text_compressor.decode(value) for value in page]
+    cached_ms = (time.perf_counter() - start) * 1000 / len(pages)
+    print(f'\n读取一页 {PAGE_SIZE} 条：每次渲染 {render_ms:.2f} ms，读取保存的 HTML {cached_ms:.3f} ms')
+
+
+def bench_stream(messages):
+    chunks = 0
+    plain_s = rendered_s = 0.0
+    for text in messages:
+        pieces = [text[i:i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_CHARS)]
+        chunks += len(pieces)
+        start = time.perf_counter()
+        for piece in pieces:
+            chunk_event(piece)
+        plain_s += time.perf_counter() - start
+        stream = MarkdownStream()
+        start = time.perf_counter()
+        for piece in pieces:
+            chunk_event(piece)
+            stream.feed(piece)
+        rendered_s += time.perf_counter() - start
+    print(f'\n流式（每块 {CHUNK_CHARS} 字，共 {chunks} 块）：只编码 ai_chunk {plain_s * 1e6 / chunks:.2f} us/块，'
+          f'同时增量渲染 {rendered_s * 1e6 / chunks:.2f} us/块')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Markdown 渲染基准')
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    messages = corpus(args.messages)
+    bench_render(messages)
+    bench_page(messages)
+    bench_stream(messages)
+
+
+if __name__ == '__main__':
+    main()
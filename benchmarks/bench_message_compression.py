@@ -0,0 +1,158 @@
+"""
+消息正文压缩基准
+
+1. 编码：按线上的长度分布（对数正态，用户消息中位数约 60 字、AI 回复约 400 字）从录制的
+   回复与项目 README（中文技术文档，接近 AI 回复的 Markdown 内容）中截取正文，
+   统计各编码 / 阈值下的存储字节、被压缩的消息比例与每条的编解码耗时；
+2. 存储与读取：同样的消息分别写入 TEXT 列与 CompressedText 列的 SQLite 文件，
+   比较 VACUUM 后的文件大小，以及读取一页消息（50 条）与全表扫描的耗时。
+
+用法:
+    python benchmarks/bench_message_compression.py [--messages 20000] [--thresholds 256,1024,4096]
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.models.types import CompressedText  # noqa: E402
+from app.utils.sse import iter_sse_payloads, extract_delta_content  # noqa: E402
+from app.utils.text_compression import text_compressor, zstandard  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+PAGE_SIZE = 50
+
+
+def corpus(count, seed=7):
+    """按长度分布截取正文，奇数条为 AI 回复"""
+    parts = []
+    for name in ('qwen_stream.sse', 'openai_stream.sse'):
+        with open(os.path.join(DATA_DIR, name), 'rb') as f:
+            parts.append(''.join(filter(None, (extract_delta_content(p) for p in iter_sse_payloads([f.read()])))))
+    with open(os.path.join(DATA_DIR, '..', '..', 'README.md'), encoding='utf-8') as f:
+        parts.append(f.read())
+    text = '\n\n'.join(parts)
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        median = 400 if i % 2 else 60
+        length = min(len(text), max(1, int(rng.lognormvariate(math.log(median), 0.9))))
+        start = rng.randrange(0, len(text) - length + 1)
+        messages.append(text[start:start + length])
+    return messages
+
+
+def configure(codec, level=None, min_bytes=1024):
+    text_compressor.codec = codec
+    text_compressor.level = level
+    text_compressor.min_bytes = min_bytes
+    text_compressor._local = type(text_compressor._local)()
+
+
+def codecs():
+    result = [('zlib', 1), ('zlib', 6)]
+    if zstandard is not None:
+        result += [('zstd', 3), ('zstd', 9)]
+    return result
+
+
+def bench_codecs(messages, thresholds):
+    raw = sum(len(m.encode('utf-8')) for m in messages)
+    print(f'{len(messages)} 条消息，UTF-8 共 {raw / 1048576:.2f} MB')
+    print(f"\n{'编码':>8}{'阈值':>8}{'存储(MB)':>10}{'节省':>8}{'压缩比例':>10}{'编码(us/条)':>13}{'解码(us/条)':>13}")
+    for codec, level in codecs():
+        for threshold in thresholds:
+            configure(codec, level, threshold)
+            start = time.perf_counter()
+            stored = [text_compressor.encode(m) for m in messages]
+            encode_us = (time.perf_counter() - start) * 1e6 / len(messages)
+            start = time.perf_counter()
+            for value in stored:
+                text_compressor.decode(value)
+            decode_us = (time.perf_counter() - start) * 1e6 / len(messages)
+            size = sum(len(v) for v in stored)
+            compressed = sum(1 for v in stored if text_compressor.is_compressed(v))
+            print(f'{codec + "-" + str(level):>8}{threshold:>8}{size / 1048576:>10.2f}{1 - size / raw:>8.0%}'
+                  f'{compressed / len(messages):>10.0%}{encode_us:>13.1f}{decode_us:>13.1f}')
+    if zstandard is None:
+        print('（未安装 zstandard，只测试 zlib）')
+
+
+def build_db(path, column_type, messages):
+    engine = sa.create_engine('sqlite:///' + path)
+    metadata = sa.MetaData()
+    table = sa.Table(
+        'messages', metadata,
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('conversation_id', sa.Integer, nullable=False, index=True),
+        sa.Column('content', column_type, nullable=False)
+    )
+    metadata.create_all(engine)
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(table.insert(), [
+            {'conversation_id': i // PAGE_SIZE, 'content': m} for i, m in enumerate(messages)
+        ])
+    write_s = time.perf_counter() - start
+    with engine.connect() as conn:
+        conn.exec_driver_sql('VACUUM')
+    return engine, table, write_s
+
+
+def bench_reads(engine, table, conversations, repeat):
+    page = sa.select(table.c.id, table.c.content).where(table.c.conversation_id == sa.bindparam('cid'))\
+        .order_by(table.c.id.desc()).limit(PAGE_SIZE)
+    rng = random.Random(1)
+    timings = []
+    with engine.connect() as conn:
+        for _ in range(repeat):
+            cid = rng.randrange(conversations)
+            start = time.perf_counter()
+            conn.execute(page, {'cid': cid}).all()
+            timings.append((time.perf_counter() - start) * 1000)
+        scan_ms = float('inf')
+        for _ in range(3):
+            start = time.perf_counter()
+            conn.execute(sa.select(table.c.content)).all()
+            scan_ms = min(scan_ms, (time.perf_counter() - start) * 1000)
+    return statistics.median(timings), sorted(timings)[int(len(timings) * 0.95)], scan_ms
+
+
+def bench_storage(messages, codec, level, threshold, repeat):
+    configure(codec, level, threshold)
+    print(f'\nSQLite：TEXT 与 CompressedText（{codec}-{level}，阈值 {threshold} 字节）')
+    print(f"{'列类型':>16}{'文件(MB)':>10}{'写入(s)':>10}{'单页p50(ms)':>13}{'单页p95(ms)':>13}{'全表读取(ms)':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, column_type in (('Text', sa.Text), ('CompressedText', CompressedText)):
+            path = os.path.join(tmp, name + '.db')
+            engine, table, write_s = build_db(path, column_type, messages)
+            p50, p95, scan_ms = bench_reads(engine, table, len(messages) // PAGE_SIZE, repeat)
+            engine.dispose()
+            print(f'{name:>16}{os.path.getsize(path) / 1048576:>10.2f}{write_s:>10.2f}'
+                  f'{p50:>13.3f}{p95:>13.3f}{scan_ms:>14.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='消息正文压缩基准')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--thresholds', default='256,1024,4096', help='逗号分隔的压缩阈值（字节）')
+    parser.add_argument('--repeat', type=int, default=500, help='读取单页的次数')
+    args = parser.parse_args()
+
+    messages = corpus(args.messages)
+    bench_codecs(messages, [int(t) for t in args.thresholds.split(',')])
+    bench_storage(messages, 'zlib', 6, 1024, args.repeat)
+    if zstandard is not None:
+        bench_storage(messages, 'zstd', 3, 1024, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
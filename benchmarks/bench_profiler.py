@@ -0,0 +1,66 @@
+"""
+采样分析器开销基准
+
+通过测试客户端反复调用 /api/chat/send（未配置 API 密钥时为模拟回复），对比不开启
+采样与按时长采样（不同采样间隔）时的每秒请求数，以及采样线程自身的 CPU 时间。
+
+用法:
+    python benchmarks/bench_profiler.py [--seconds 3]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# 配置在导入 app 时读取，需先于导入设置
+TMPDIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMPDIR, 'bench.db')
+os.environ['PROFILER_DIR'] = os.path.join(TMPDIR, 'profiles')
+os.environ['OPENAI_API_KEY'] = ''
+os.environ['LOG_LEVEL'] = 'ERROR'
+
+from app import create_app  # noqa: E402
+from app.cli import bootstrap_database  # noqa: E402
+from app.utils.profiler import profiler  # noqa: E402
+
+
+def run_requests(client, conversation_id, seconds):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        client.post('/api/chat/send', json={'conversation_id': conversation_id, 'message': '你好'}).close()
+        count += 1
+    return count / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='采样分析器开销基准')
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+
+    app = create_app('production')
+    with app.app_context():
+        bootstrap_database()
+    client = app.test_client()
+    conversation_id = client.post('/api/chat/new').get_json()['conversation_id']
+    run_requests(client, conversation_id, 0.5)
+
+    print(f"{'场景':<16}{'请求/秒':>10}{'相对':>8}{'样本数':>8}{'采样CPU(ms)':>13}{'间隔(ms)':>10}")
+    baseline = run_requests(client, conversation_id, args.seconds)
+    print(f"{'不采样':<16}{baseline:>10.1f}{'100%':>8}")
+    for interval_ms in (20, 10, 5):
+        profiler.start(seconds=args.seconds + 1, interval_ms=interval_ms)
+        rate = run_requests(client, conversation_id, args.seconds)
+        profiler.stop()
+        while profiler.session is not None:
+            time.sleep(0.01)
+        last = profiler.last
+        print(f"{'按时长 %dms' % interval_ms:<16}{rate:>10.1f}{rate / baseline:>8.0%}"
+              f"{last['samples']:>8}{last['cpu_ms']:>13.1f}{last['interval_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+语义缓存基准
+
+1. 检索耗时：不同缓存条目数下单条查询与批量查询（NumPy 矩阵乘法）的耗时，
+   以及未安装 numpy 时稀疏向量逐条计算的耗时；
+2. 阈值：一组人工标注的问题对在各阈值下的命中率与误命中率，用于选择 SEMANTIC_CACHE_THRESHOLD。
+   问题对分三类：近似重复（多一两个字、换个虚词，归一化后仍不相同）、改写（同义但换了说法）、
+   不同（字面相近但含义不同）。
+
+用法:
+    python benchmarks/bench_semantic_cache.py [--sizes 1000,10000] [--dim 1024]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.utils import semantic_cache as module  # noqa: E402
+from app.utils.semantic_cache import SemanticCache, normalize, vectorize  # noqa: E402
+
+# (已缓存的问题, 新问题, 类别)：近似重复（应命中）/ 改写（同义但换了说法）/ 不同（不应命中）。
+# 近似重复只选归一化后仍不相同的问题对，只差标点、大小写、客套词的问题归一化后完全相同，不能用来选阈值
+VARIANT, PARAPHRASE, DIFFERENT = '近似重复', '改写', '不同'
+PAIRS = (
+    ('如何优化数据库查询的性能？', '如何优化一下数据库查询的性能', VARIANT),
+    ('如何优化数据库查询的性能？', '如何优化数据库的查询性能', VARIANT),
+    ('推荐几本学习 Python 的书', '推荐几本学习Python的好书', VARIANT),
+    ('HTTP 和 HTTPS 有什么区别', 'HTTP 和 HTTPS 之间有什么区别', VARIANT),
+    ('解释一下 TCP 三次握手', '详细解释一下 TCP 三次握手', VARIANT),
+    ('How do I reverse a list in Python?', 'How can I reverse a list in Python?', VARIANT),
+    ('What is the difference between a process and a thread?',
+     'What is the difference between processes and threads?', VARIANT),
+    ('用Python写一个读取CSV文件的例子', '用Python写个读取CSV文件的例子', VARIANT),
+    ('Linux 下如何查看端口被哪个进程占用', 'Linux 下如何查看端口被哪个进程占用了', VARIANT),
+    ('什么是机器学习', '机器学习是什么', PARAPHRASE),
+    ('介绍一下你自己', '你是谁', PARAPHRASE),
+    ('如何优化数据库查询的性能？', '数据库查询很慢，怎么提升性能', PARAPHRASE),
+    ('Python怎么读取文件', '用python读文件的方法', PARAPHRASE),
+    ('What is machine learning?', 'Explain machine learning', PARAPHRASE),
+    ('HTTP 和 HTTPS 有什么区别', 'HTTPS 与 HTTP 的区别是什么', PARAPHRASE),
+    ('进程和线程的区别', '线程和进程有什么不同', PARAPHRASE),
+    ('如何学习英语', '怎样才能学好英语', PARAPHRASE),
+    ('如何优化数据库查询的性能？', '如何优化数据库写入的性能', DIFFERENT),
+    ('帮我写一个快速排序', '帮我写一个冒泡排序', DIFFERENT),
+    ('Python怎么读取文件', 'Python怎么写入文件', DIFFERENT),
+    ('Python怎么读取文件', 'Java怎么读取文件', DIFFERENT),
+    ('2+3等于几', '2+4等于几', DIFFERENT),
+    ('北京今天天气怎么样', '上海今天天气怎么样', DIFFERENT),
+    ('如何学习英语', '如何学习日语', DIFFERENT),
+    ('解释一下 TCP 三次握手', '解释一下 TCP 四次挥手', DIFFERENT),
+    ('进程和线程的区别', '协程和线程的区别', DIFFERENT),
+    ('What is machine learning?', 'What is deep learning?', DIFFERENT),
+    ('How do I reverse a list in Python?', 'How do I reverse a string in Python?', DIFFERENT),
+    ('What is the difference between a process and a thread?',
+     'What is the difference between a thread and a coroutine?', DIFFERENT),
+    ('在Linux上如何查看某个端口被哪个进程占用', '在Windows上如何查看某个端口被哪个进程占用', DIFFERENT),
+    ('用Python写一个读取CSV文件的例子', '用Python写一个读取JSON文件的例子', DIFFERENT),
+    ('HTTP 和 HTTPS 有什么区别', 'HTTP/1.1 和 HTTP/2 有什么区别', DIFFERENT),
+    ('如何在 React 中使用 useEffect', '如何在 React 中使用 useMemo', DIFFERENT),
+    ('把这段话翻译成英文', '把这段话翻译成日文', DIFFERENT)
+)
+THRESHOLDS = (0.70, 0.75, 0.80, 0.84, 0.86, 0.88, 0.90, 0.92, 0.94)
+WORDS = ('数据库', '性能', '如何', '优化', 'python', '学习', '区别', '实现', '什么', '模型', '接口', '部署',
+         '缓存', '索引', '排序', '算法', '文件', '读取', '网络', '协议', 'api', 'http', '线程', '进程')
+
+
+def random_prompt(rng):
+    return ''.join(rng.choice(WORDS) for _ in range(rng.randint(3, 10)))
+
+
+def fill(cache, size, rng):
+    for i in range(size):
+        cache.store([{'role': 'user', 'content': random_prompt(rng) + str(i)}], 'm', 'answer')
+
+
+def bench_lookup(use_numpy, size, dim, batch):
+    """返回平均每条查询的检索耗时（毫秒）"""
+    cache = SemanticCache()
+    cache.enabled = True
+    cache.capacity = size
+    cache.dim = dim
+    cache.use_numpy = use_numpy
+    rng = random.Random(1)
+    fill(cache, size, rng)
+
+    queries = [vectorize(normalize(random_prompt(rng)), dim) for _ in range(batch)]
+    rounds = 20 if use_numpy else 2
+    start = time.perf_counter()
+    for _ in range(rounds):
+        with cache._lock:
+            cache.search(queries)
+    return (time.perf_counter() - start) * 1000 / (rounds * batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='语义缓存基准')
+    parser.add_argument('--sizes', default='1000,10000', help='逗号分隔的缓存条目数')
+    parser.add_argument('--dim', type=int, default=1024, help='向量维度')
+    args = parser.parse_args()
+
+    text = '如何优化数据库查询的性能？请给出几个具体的例子'
+    start = time.perf_counter()
+    for _ in range(2000):
+        vectorize(normalize(text), args.dim)
+    print('向量化: %.1f 微秒/条（%d 字）' % ((time.perf_counter() - start) * 1e6 / 2000, len(text)))
+
+    print(f"\n{'条目数':>8}{'检索方式':>12}{'单条(ms)':>12}{'批量32(ms/条)':>16}")
+    for size in (int(float(s)) for s in args.sizes.split(',')):
+        backends = [('numpy', True)] if module.load_numpy() is not None else []
+        if size <= 10000:
+            backends.append(('python', False))
+        for name, use_numpy in backends:
+            single = bench_lookup(use_numpy, size, args.dim, 1)
+            batched = bench_lookup(use_numpy, size, args.dim, 32)
+            print(f'{size:>8}{name:>12}{single:>12.3f}{batched:>16.3f}')
+    if module.numpy is None:
+        print('（未安装 numpy，只测试稀疏向量检索）')
+
+    # 余弦相似度（数字不同的问题对按未命中处理，与 lookup 一致）
+    dim = module.SemanticCache().dim
+    scores = []
+    for cached, query, kind in PAIRS:
+        a, b = normalize(cached), normalize(query)
+        if a == b:
+            print(f'问题对归一化后相同，不能用来选阈值: {cached} / {query}', file=sys.stderr)
+        same_numbers = module._NUMBER_RE.findall(cached) == module._NUMBER_RE.findall(query)
+        scores.append((kind, module._sparse_dot(vectorize(a, dim), vectorize(b, dim)) if same_numbers else 0.0))
+
+    kinds = (VARIANT, PARAPHRASE, DIFFERENT)
+    counts = {kind: sum(1 for k, _ in scores if k == kind) for kind in kinds}
+    print('\n' + '，'.join(f'{kind} {counts[kind]} 对，相似度 {min(v for k, v in scores if k == kind):.2f}～'
+                           f'{max(v for k, v in scores if k == kind):.2f}' for kind in kinds))
+    print(f"\n{'阈值':>6}{'近似重复命中率':>16}{'改写命中率':>12}{'误命中率':>10}")
+    for threshold in THRESHOLDS:
+        rates = [sum(1 for k, v in scores if k == kind and v >= threshold) / counts[kind] for kind in kinds]
+        print(f'{threshold:>6.2f}{rates[0]:>16.0%}{rates[1]:>12.0%}{rates[2]:>10.0%}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+SSE 解析微基准
+
+对比旧的 ``iter_lines() + decode + json.loads`` 逐行解析与新的增量字节解码器
+在录制的上游流上的吞吐。录制文件按随机大小切块回放，模拟网络分片。
+
+用法:
+    python benchmarks/bench_sse_decoder.py [录制文件 ...] [--repeat N]
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.utils.sse import iter_sse_payloads, extract_delta_content  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def split_chunks(raw, seed=0, low=64, high=1024):
+    """把录制内容切成随机大小的字节块"""
+    rng = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(raw):
+        size = rng.randint(low, high)
+        chunks.append(raw[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def iter_lines(chunks):
+    """与 requests.Response.iter_lines 等价的行切分"""
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
+            pending = lines.pop()
+        else:
+            pending = None
+        for line in lines:
+            yield line
+    if pending is not None:
+        yield pending
+
+
+def legacy_parse(chunks):
+    """旧实现：逐行解码、json.loads 每一帧并逐一尝试各格式"""
+    out = []
+    for line in iter_lines(chunks):
+        if line:
+            line = line.decode('utf-8')
+            if line.startswith('data: '):
+                data = line[6:]
+                if data.strip() == '[DONE]':
+                    break
+                try:
+                    chunk = json.loads(data)
+                    content = None
+                    if 'choices' in chunk:
+                        delta = chunk.get('choices', [{}])[0].get('delta', {})
+                        content = delta.get('content')
+                    elif 'content' in chunk:
+                        content = chunk.get('content')
+                    elif 'text' in chunk:
+                        content = chunk.get('text')
+                    if content:
+                        out.append(content)
+                except json.JSONDecodeError:
+                    continue
+    return out
+
+
+def decoder_parse(chunks):
+    """新实现：增量字节解码 + 快速路径提取"""
+    out = []
+    for payload in iter_sse_payloads(chunks):
+        content = extract_delta_content(payload)
+        if content:
+            out.append(content)
+    return out
+
+
+def bench(func, chunks, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(chunks)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SSE 解析微基准')
+    parser.add_argument('files', nargs='*', help='录制的 SSE 文件，默认使用 benchmarks/data/*.sse')
+    parser.add_argument('--repeat', type=int, default=50, help='每个实现的重复次数（取最优）')
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(DATA_DIR, '*.sse')))
+    if not files:
+        parser.error('未找到录制文件')
+
+    print(f"{'录制文件':<24}{'事件数':>8}{'旧实现 µs/事件':>18}{'新实现 µs/事件':>18}{'加速比':>10}")
+    for path in files:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        chunks = split_chunks(raw)
+
+        legacy_out = legacy_parse(chunks)
+        decoder_out = decoder_parse(chunks)
+        if ''.join(legacy_out) != ''.join(decoder_out):
+            print(f'{os.path.basename(path)}: 两种实现的输出不一致', file=sys.stderr)
+            sys.exit(1)
+
+        events = raw.count(b'data: ')
+        legacy_time = bench(legacy_parse, chunks, args.repeat)
+        decoder_time = bench(decoder_parse, chunks, args.repeat)
+        print(f'{os.path.basename(path):<24}{events:>8}'
+              f'{legacy_time / events * 1e6:>18.2f}{decoder_time / events * 1e6:>18.2f}'
+              f'{legacy_time / decoder_time:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+启动耗时基准
+
+在独立的子进程中多次冷启动，分别统计：
+    import      导入 app 包（含 Flask / SQLAlchemy 等依赖）
+    create_app  创建应用实例（注册蓝图时导入视图、服务与模型）
+    worker      import + create_app，即 worker 启动时的全部工作
+    bootstrap   对已初始化的数据库执行 flask bootstrap 的耗时（含导入 Flask-Migrate / alembic），
+                即旧版本每个 worker 启动时在 create_app 中额外付出的数据库开销
+
+用法:
+    python benchmarks/bench_startup.py [--runs 5] [--importtime 15]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = r'''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app('development')
+created = time.perf_counter()
+from app.cli import bootstrap_database
+with application.app_context():
+    bootstrap_database()
+bootstrapped = time.perf_counter()
+print(json.dumps({
+    'import': (imported - start) * 1000,
+    'create_app': (created - imported) * 1000,
+    'worker': (created - start) * 1000,
+    'bootstrap': (bootstrapped - created) * 1000
+}))
+'''
+
+
+def run_child(env):
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_time(env, top):
+    """使用 -X importtime 列出累计耗时最高的模块"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app; app.create_app("development")'],
+                            cwd=ROOT, env=env, check=True, capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = (part.strip() for part in line[len('import time:'):].split('|'))
+        rows.append((int(cumulative), module.strip()))
+    rows.sort(reverse=True)
+    print(f'\n累计导入耗时最高的 {top} 个模块（µs）')
+    for cumulative, module in rows[:top]:
+        print(f'    {cumulative:>10}  {module}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动耗时基准')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--importtime', type=int, default=0, help='额外列出累计导入耗时最高的 N 个模块')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'startup.db')
+    env['FLASK_ENV'] = 'development'
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    # 预热：初始化数据库并生成字节码缓存
+    run_child(env)
+    results = [run_child(env) for _ in range(args.runs)]
+
+    print(f"{'阶段':<12}{'中位数(ms)':>12}{'最小(ms)':>12}")
+    for stage in ('import', 'create_app', 'worker', 'bootstrap'):
+        values = [r[stage] for r in results]
+        print(f'{stage:<12}{statistics.median(values):>12.1f}{min(values):>12.1f}')
+
+    if args.importtime:
+        import_time(env, args.importtime)
+
+
+if __name__ == '__main__':
+    main()
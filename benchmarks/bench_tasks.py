@@ -0,0 +1,97 @@
+"""
+后台任务基准
+
+对比标题生成与活跃时间更新在请求线程中同步执行（TASK_EAGER）与提交到后台任务时，
+新对话第一条消息从发出 /api/chat/send-stream 到收到 ai_start 事件（即开始等待上游）
+的耗时，以及请求线程中执行的 SQL 条数。未配置 API 密钥时走内置的模拟流式输出。
+
+用法:
+    python benchmarks/bench_tasks.py [--conversations 50]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# 配置在导入 app 时读取，需先于导入设置
+TMPDIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMPDIR, 'bench.db')
+os.environ['OPENAI_API_KEY'] = ''
+os.environ['LOG_LEVEL'] = 'ERROR'
+
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.cli import bootstrap_database  # noqa: E402
+from app.models import User  # noqa: E402
+from app.utils.tasks import background  # noqa: E402
+
+
+def time_to_start(client, statements):
+    """返回 (到 ai_start 的毫秒数, 其间请求线程执行的 SQL 条数)"""
+    conversation_id = client.post('/api/chat/new').get_json()['conversation_id']
+    before = statements['count']
+    start = time.perf_counter()
+    response = client.post('/api/chat/send-stream',
+                           json={'conversation_id': conversation_id, 'message': '你好，请介绍一下自己'},
+                           buffered=False)
+    elapsed = None
+    for frame in response.response:
+        if isinstance(frame, bytes):
+            frame = frame.decode('utf-8')
+        for line in frame.splitlines():
+            if line.startswith('data: {') and json.loads(line[6:])['type'] == 'ai_start':
+                elapsed = (time.perf_counter() - start) * 1000
+                queries = statements['count'] - before
+                break
+        if elapsed is not None:
+            break
+    response.close()
+    return elapsed, queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='后台任务基准')
+    parser.add_argument('--conversations', type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_app('production')
+    with app.app_context():
+        bootstrap_database()
+        engine = db.engine
+    client = app.test_client()
+    client.post('/api/chat/new')
+
+    request_thread = threading.get_ident()
+    statements = {'count': 0}
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == request_thread:
+            statements['count'] += 1
+
+    print(f"{'模式':<10}{'到 ai_start 中位数(ms)':>22}{'p95(ms)':>10}{'请求线程 SQL':>14}")
+    for name, eager in (('同步执行', True), ('后台任务', False)):
+        background.eager = eager
+        results = []
+        for _ in range(args.conversations):
+            # 每次都让活跃时间过期，两种模式下都会触发一次更新
+            with app.app_context():
+                db.session.execute(db.update(User).values(last_active=None))
+                db.session.commit()
+            results.append(time_to_start(client, statements))
+            background.join(5)
+        times = sorted(r[0] for r in results)
+        p95 = times[int(len(times) * 0.95) - 1]
+        print(f'{name:<10}{statistics.median(times):>22.2f}{p95:>10.2f}'
+              f'{statistics.mean(r[1] for r in results):>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
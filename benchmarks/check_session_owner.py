@@ -0,0 +1,78 @@
+"""
+会话归属检查
+
+SQLite 会把被删除的最大 rowid 分配给下一条新记录。检查清理空用户（flask prune-users）后，
+新访问者复用了原用户的ID时，原访问者的会话不能列出、读取或删除新访问者的对话：
+
+1. 访问者 A 新建对话后删除，成为没有对话的空用户并被清理；
+2. 访问者 B 新建对话并发送消息，得到与 A 相同的用户ID；
+3. 用 A 的会话请求对话列表、B 的消息与删除接口。
+
+用法:
+    python benchmarks/check_session_owner.py
+"""
+import os
+import sys
+import tempfile
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def main():
+    db_path = os.path.join(tempfile.mkdtemp(), 'owner_check.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['OPENAI_API_KEY'] = ''
+
+    from app import create_app, db
+    from app.cli import prune_empty_users
+    from app.models import User
+    from app.utils.tasks import background
+    app = create_app('development')
+
+    with app.app_context():
+        db.create_all()
+
+    visitor_a = app.test_client()
+    conversation_id = visitor_a.post('/api/chat/new').get_json()['conversation_id']
+    visitor_a.delete(f'/api/chat/delete/{conversation_id}')
+    with visitor_a.session_transaction() as sess:
+        user_a = sess['chat_user_id']
+    background.join(5)
+    with app.app_context():
+        pruned = prune_empty_users(min_age=timedelta(0))
+
+    visitor_b = app.test_client()
+    conversation_id = visitor_b.post('/api/chat/new').get_json()['conversation_id']
+    visitor_b.post('/api/chat/send', json={'conversation_id': conversation_id, 'message': '你好'})
+    with visitor_b.session_transaction() as sess:
+        user_b = sess['chat_user_id']
+    background.join(5)
+
+    listed = visitor_a.get('/api/chat/conversations').get_json()['conversations']
+    read = visitor_a.get(f'/api/chat/messages/{conversation_id}').status_code
+    deleted = visitor_a.delete(f'/api/chat/delete/{conversation_id}').status_code
+    with app.app_context():
+        users = db.session.execute(db.select(db.func.count()).select_from(User)).scalar()
+    remaining = visitor_b.get('/api/chat/conversations').get_json()['conversations']
+
+    print(f'清理的空用户数: {pruned}')
+    print(f'A 的用户ID: {user_a}，B 的用户ID: {user_b}')
+    print(f'A 列出的对话数: {len(listed)}')
+    print(f'A 读取 B 的对话: {read}，删除 B 的对话: {deleted}')
+    print(f'B 的对话数: {len(remaining)}，用户数: {users}')
+
+    if pruned != 1:
+        print('失败: 空用户没有被清理', file=sys.stderr)
+        sys.exit(1)
+    if user_a != user_b:
+        print('跳过: 新用户没有复用被删除的用户ID，无法验证', file=sys.stderr)
+        sys.exit(1)
+    if listed or read == 200 or deleted == 200 or len(remaining) != 1:
+        print('失败: 原访问者的会话可以访问复用其用户ID的新用户的对话', file=sys.stderr)
+        sys.exit(1)
+    print('通过')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+流式对话连接池检查
+
+通过 SQLAlchemy 连接池事件统计一次 /api/chat/send-stream 请求中的连接签出情况，
+断言在发起上游请求时以及上游生成（ai_chunk 事件）期间没有任何连接处于签出状态，
+并输出整个请求的签出次数。未配置 API 密钥时走内置的模拟流式输出。
+只统计请求线程签出的连接；后台任务（如生成标题）在自己的线程中使用连接，不计入。
+
+用法:
+    python benchmarks/check_stream_pool.py
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import event  # noqa: E402
+
+
+def main():
+    db_path = os.path.join(tempfile.mkdtemp(), 'pool_check.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['OPENAI_API_KEY'] = ''
+
+    from app import create_app, db
+    from app.services.api_service import APIService
+    from app.utils.tasks import background
+    app = create_app('development')
+
+    with app.app_context():
+        db.create_all()
+        engine = db.engine
+
+    stats = {'checkouts': 0, 'checked_out': 0}
+    request_thread = threading.get_ident()
+    held_records = set()
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        if threading.get_ident() != request_thread:
+            return
+        held_records.add(id(connection_record))
+        stats['checkouts'] += 1
+        stats['checked_out'] += 1
+
+    @event.listens_for(engine, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        if id(connection_record) in held_records:
+            held_records.discard(id(connection_record))
+            stats['checked_out'] -= 1
+
+    # 上游请求在构造流式生成器时发出，记录此刻签出中的连接数
+    held_at_upstream = []
+    original_generator = APIService._stream_response_generator
+
+    def recording_generator(self, response):
+        held_at_upstream.append(stats['checked_out'])
+        return original_generator(self, response)
+
+    APIService._stream_response_generator = recording_generator
+
+    client = app.test_client()
+    conversation_id = client.post('/api/chat/new').get_json()['conversation_id']
+
+    stats['checkouts'] = 0
+    response = client.post('/api/chat/send-stream',
+                           json={'conversation_id': conversation_id, 'message': '你好'},
+                           buffered=False)
+
+    held_during_stream = []
+    chunk_events = 0
+    for frame in response.response:
+        if isinstance(frame, bytes):
+            frame = frame.decode('utf-8')
+        for line in frame.splitlines():
+            if not line.startswith('data: ') or line == 'data: [DONE]':
+                continue
+            payload = json.loads(line[6:])
+            if payload['type'] == 'ai_chunk':
+                chunk_events += 1
+                held_during_stream.append(stats['checked_out'])
+    response.close()
+    background.join(5)
+
+    print(f'ai_chunk 事件数: {chunk_events}')
+    print(f'整个请求的连接签出次数: {stats["checkouts"]}')
+    print(f'发起上游请求时签出中的连接数: {max(held_at_upstream or [0])}')
+    print(f'流式期间签出中的连接数（最大值）: {max(held_during_stream or [0])}')
+    print(f'请求结束后仍签出的连接数: {stats["checked_out"]}')
+
+    if chunk_events == 0:
+        print('失败: 没有收到任何 ai_chunk 事件', file=sys.stderr)
+        sys.exit(1)
+    if any(held_at_upstream):
+        print('失败: 等待上游响应期间仍持有数据库连接', file=sys.stderr)
+        sys.exit(1)
+    if any(held_during_stream):
+        print('失败: 上游生成期间仍持有数据库连接', file=sys.stderr)
+        sys.exit(1)
+    if stats['checked_out']:
+        print('失败: 请求结束后有连接未归还', file=sys.stderr)
+        sys.exit(1)
+    print('通过')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+停止生成检查
+
+模拟上游输出若干 token 后停顿（--stall-ms），在停顿期间分别以三种方式停止：
+- 停止接口（本 worker）；
+- 其他 worker 写入的停止标记文件（STREAM_CANCEL_DIR）；
+- 排空（``streams.begin_drain``，截止时间为 DRAIN_TIMEOUT 秒）。
+
+检查：
+- 停止生效后很快收到 ai_complete（不等待上游停顿结束），排空时原因为 shutdown；
+- 上游连接立即断开：保存的 upstream_ms 远小于停顿时长；
+- 停止之后上游再输出的内容既不下发也不保存。
+
+分别在开启合并（STREAM_COALESCE_WINDOW_MS=30）与关闭合并（0）时检查。
+
+用法:
+    python benchmarks/check_stream_stop.py [--stall-ms 8000]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mock_upstream  # noqa: E402
+
+STALL_AFTER = 5
+TOKENS_PER_SEC = 50
+# 收到首块后等待该时长（秒）再停止：此时上游已进入停顿，合并器的缓冲已输出、正在等待上游
+STOP_DELAY = STALL_AFTER / TOKENS_PER_SEC + 0.5
+# 排空截止时间（秒）
+DRAIN_TIMEOUT = 1.0
+# 停止生效后应在该时长（秒）内收到 ai_complete（标记文件与排空截止每 0.25 秒检查一次）
+COMPLETE_LIMIT = 0.6
+
+
+def read_events(response):
+    for frame in response.response:
+        if isinstance(frame, bytes):
+            frame = frame.decode('utf-8')
+        for line in frame.splitlines():
+            if line.startswith('data: {'):
+                yield json.loads(line[6:])
+
+
+def stop_local(client, stream_id):
+    client.post(f'/api/chat/cancel/{stream_id}')
+    return time.monotonic()
+
+
+def stop_marker(client, stream_id):
+    # 停止请求落在其他 worker：只写入标记文件
+    from app.utils.streams import streams
+    with client.session_transaction() as sess:
+        user_id = sess['chat_user_id']
+    os.makedirs(streams.directory, exist_ok=True)
+    with open(os.path.join(streams.directory, stream_id), 'w') as f:
+        f.write(str(user_id))
+    return time.monotonic()
+
+
+def stop_drain(client, stream_id):
+    from app.utils.streams import streams
+    streams.begin_drain(timeout=DRAIN_TIMEOUT)
+    return time.monotonic() + DRAIN_TIMEOUT
+
+
+def run(app, window_ms, stopper):
+    """返回 (停止生效后收到 ai_complete 的耗时, ai_complete 事件, 下发的文本, 保存的消息)"""
+    from app.models import Message
+    app.config['STREAM_COALESCE_WINDOW_MS'] = window_ms
+    client = app.test_client()
+    conversation_id = client.post('/api/chat/new').get_json()['conversation_id']
+    response = client.post('/api/chat/send-stream', json={'conversation_id': conversation_id, 'message': '你好'},
+                           buffered=False)
+    streamed = []
+    stopped_at = None
+    complete = None
+    for event in read_events(response):
+        if event['type'] == 'ai_start':
+            stream_id = event['stream_id']
+        elif event['type'] == 'ai_chunk':
+            streamed.append(event['content'])
+            if len(streamed) == 1:
+                def stop():
+                    nonlocal stopped_at
+                    time.sleep(STOP_DELAY)
+                    stopped_at = stopper(client, stream_id)
+                threading.Thread(target=stop, daemon=True).start()
+        elif event['type'] == 'ai_complete':
+            complete = event
+            completed_at = time.monotonic()
+    response.close()
+    with app.app_context():
+        from app import db
+        message = db.session.get(Message, complete['message']['id'])
+        saved = (message.content, message.upstream_ms)
+    return completed_at - stopped_at, complete, ''.join(streamed), saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='停止生成检查')
+    parser.add_argument('--stall-ms', type=float, default=8000)
+    args = parser.parse_args()
+
+    options = mock_upstream.MockOptions(ttft_ms=0, ttft_jitter_ms=0, tokens_per_sec=TOKENS_PER_SEC, reply_tokens=40,
+                                        reply_sigma=0, stall_after=STALL_AFTER, stall_ms=args.stall_ms, seed=1)
+    _, url, _ = mock_upstream.start(options=options)
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(directory, 'stop_check.db')
+    os.environ['STREAM_CANCEL_DIR'] = os.path.join(directory, 'stream_cancel')
+    os.environ['OPENAI_API_URL'] = url
+    os.environ['OPENAI_API_KEY'] = 'mock'
+
+    from app import create_app, db
+    from app.utils.tasks import background
+    app = create_app('development')
+    with app.app_context():
+        db.create_all()
+
+    from app.utils.streams import streams
+    failed = False
+    for name, stopper, reason in (('停止接口', stop_local, 'cancelled'), ('其他 worker', stop_marker, 'cancelled'),
+                                  ('排空', stop_drain, 'shutdown')):
+        for window_ms in (30, 0):
+            try:
+                elapsed, complete, streamed, (content, upstream_ms) = run(app, window_ms, stopper)
+            finally:
+                streams.drain_deadline = None
+            print(f'{name}，合并窗口 {window_ms}ms: 停止生效后 {elapsed * 1000:.0f}ms 收到 ai_complete'
+                  f'（{complete["status"]}/{complete["reason"]}），上游耗时 {upstream_ms}ms，'
+                  f'下发 {len(streamed)} 字，保存 {len(content)} 字')
+            if complete['status'] != 'cancelled' or complete['reason'] != reason or elapsed > COMPLETE_LIMIT:
+                print('失败: 停止没有及时生效', file=sys.stderr)
+                failed = True
+            if upstream_ms is None or upstream_ms >= args.stall_ms / 2:
+                print('失败: 停止后上游连接没有立即断开', file=sys.stderr)
+                failed = True
+            if content != streamed:
+                print('失败: 保存的回复与下发的内容不一致', file=sys.stderr)
+                failed = True
+    background.join(5)
+    if failed:
+        sys.exit(1)
+    print('通过')
+
+
+if __name__ == '__main__':
+    main()
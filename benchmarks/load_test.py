@@ -0,0 +1,312 @@
+"""
+端到端压测
+
+模拟 N 个并发的聊天会话：每个会话先读取对话列表、新建对话，然后循环发送消息
+（/api/chat/send-stream），每轮结束后增量同步对话列表并读取消息页，两轮之间按
+--think-ms 停顿。统计各接口的 p50/p95/p99 延迟、首字延迟（发出请求到收到第一个
+ai_chunk）、整轮耗时与吞吐，输出为 JSON 报告，可用 --compare 与之前的报告逐项对比。
+
+默认（不指定 --base-url）在本进程内启动模拟上游（见 mock_upstream.py）与应用
+（临时 SQLite 库、多线程开发服务器），不需要任何外部服务；结果适合比较同一台机器上
+不同提交之间的差异。压测部署环境时先启动 mock_upstream.py，让 gunicorn 指向它，
+再用 --base-url 指定服务地址。
+
+用法:
+    python benchmarks/load_test.py [--sessions 20] [--duration 30] [--output report.json]
+    python benchmarks/load_test.py --base-url http://127.0.0.1:8000 --sessions 50
+    python benchmarks/load_test.py --output new.json --compare old.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+import mock_upstream  # noqa: E402
+
+MESSAGES = (
+    '你好，请介绍一下你自己',
+    '如何优化数据库查询的性能？',
+    '帮我写一个快速排序的 Python 实现',
+    'Explain the difference between processes and threads.',
+    '总结一下刚才的内容'
+)
+
+
+def percentile(values, q):
+    """最近秩法分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), 2),
+        'p50': round(percentile(values, 0.50), 2),
+        'p95': round(percentile(values, 0.95), 2),
+        'p99': round(percentile(values, 0.99), 2),
+        'max': round(max(values), 2)
+    }
+
+
+class Recorder:
+    """线程安全的耗时与计数记录"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+
+    def add(self, name, ms):
+        with self.lock:
+            self.timings.setdefault(name, []).append(ms)
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+def timed(recorder, name, func, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = func(*args, **kwargs)
+    except requests.RequestException:
+        recorder.inc(name + '.errors')
+        return None
+    recorder.add(name, (time.perf_counter() - start) * 1000)
+    if response.status_code >= 400:
+        recorder.inc(name + '.errors')
+    return response
+
+
+def stream_turn(session, base_url, conversation_id, message, recorder, timeout):
+    """发送一条消息并读取完整的流式回复"""
+    start = time.perf_counter()
+    try:
+        # 流式响应带 Connection: keep-alive 但没有 Content-Length，开发服务器写完后会继续读取
+        # 同一连接上的剩余数据；流式请求单独建连接，避免下一个请求复用该连接而互相等待
+        response = requests.post(base_url + '/api/chat/send-stream',
+                                 json={'conversation_id': conversation_id, 'message': message},
+                                 headers={'Idempotency-Key': uuid.uuid4().hex, 'Connection': 'close'},
+                                 cookies=session.cookies, stream=True, timeout=timeout)
+    except requests.RequestException:
+        recorder.inc('send_stream.errors')
+        return
+    if response.status_code != 200:
+        recorder.inc('send_stream.errors')
+        response.close()
+        return
+
+    first_chunk = None
+    chars = 0
+    status = None
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data: {'):
+                continue
+            event = json.loads(line[6:])
+            kind = event['type']
+            if kind == 'ai_start':
+                recorder.add('send_stream.ai_start', (time.perf_counter() - start) * 1000)
+            elif kind == 'ai_chunk':
+                if first_chunk is None:
+                    first_chunk = time.perf_counter()
+                chars += len(event['content'])
+            elif kind == 'ai_complete':
+                status = event.get('status', 'complete')
+            elif kind == 'error':
+                status = 'error'
+    except requests.RequestException:
+        status = 'error'
+    finally:
+        response.close()
+
+    if status != 'complete' or first_chunk is None:
+        recorder.inc('send_stream.errors')
+        return
+    recorder.add('send_stream.ttft', (first_chunk - start) * 1000)
+    recorder.add('send_stream', (time.perf_counter() - start) * 1000)
+    recorder.inc('reply_chars', chars)
+    recorder.inc('turns')
+
+
+def run_session(index, base_url, deadline, args, recorder):
+    session = requests.Session()
+    timeout = args.request_timeout
+    response = timed(recorder, 'conversations', session.get, base_url + '/api/chat/conversations', timeout=timeout)
+    response = timed(recorder, 'new', session.post, base_url + '/api/chat/new', timeout=timeout)
+    if response is None or response.status_code != 200:
+        return
+    conversation_id = response.json()['conversation_id']
+
+    version, etag = 0, None
+    turn = 0
+    while time.monotonic() < deadline and (not args.turns or turn < args.turns):
+        message = MESSAGES[(index + turn) % len(MESSAGES)]
+        stream_turn(session, base_url, conversation_id, message, recorder, timeout)
+        turn += 1
+
+        headers = {'If-None-Match': etag} if etag else {}
+        response = timed(recorder, 'conversations_since', session.get,
+                         base_url + '/api/chat/conversations?since=%d' % version, headers=headers, timeout=timeout)
+        if response is not None and response.status_code == 200:
+            version = response.json()['version']
+            etag = response.headers.get('ETag')
+        timed(recorder, 'messages', session.get,
+              base_url + '/api/chat/messages/%d?limit=50' % conversation_id, timeout=timeout)
+
+        if args.think_ms:
+            time.sleep(args.think_ms / 1000.0)
+
+
+def start_local_app(args):
+    """在本进程内启动模拟上游与应用，返回应用地址与模拟上游的统计对象"""
+    _, upstream_url, stats = mock_upstream.start(options=mock_upstream.MockOptions.from_args(args))
+
+    # 配置在导入 app 时读取，需先于导入设置
+    tmpdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmpdir, 'load.db')
+    os.environ['OPENAI_API_URL'] = upstream_url
+    os.environ['OPENAI_API_KEY'] = 'mock'
+    os.environ['LOG_LEVEL'] = 'ERROR'
+    os.environ['TASK_DB_PATH'] = os.path.join(tmpdir, 'tasks.db')
+
+    import logging
+    from werkzeug.serving import make_server
+    from app import create_app
+    from app.cli import bootstrap_database
+
+    app = create_app('production')
+    with app.app_context():
+        bootstrap_database()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='load-test-app', daemon=True).start()
+    return 'http://127.0.0.1:%d' % server.server_port, stats
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def build_report(args, recorder, elapsed, mock_stats):
+    endpoints = {}
+    for name in sorted(recorder.timings):
+        endpoints[name] = summarize(recorder.timings[name])
+    for name, value in recorder.counters.items():
+        if name.endswith('.errors'):
+            endpoints.setdefault(name[:-len('.errors')], {'count': 0})['errors'] = value
+    for summary in endpoints.values():
+        summary.setdefault('errors', 0)
+
+    requests_total = sum(len(values) for name, values in recorder.timings.items() if '.' not in name)
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'base_url': args.base_url or 'local',
+            'sessions': args.sessions,
+            'duration': round(elapsed, 2),
+            'think_ms': args.think_ms
+        },
+        'endpoints': endpoints,
+        'throughput': {
+            'requests_per_sec': round(requests_total / elapsed, 2),
+            'turns_per_sec': round(recorder.counters.get('turns', 0) / elapsed, 2),
+            'reply_chars_per_sec': round(recorder.counters.get('reply_chars', 0) / elapsed, 1)
+        },
+        'upstream': mock_stats
+    }
+
+
+def compare(report, baseline):
+    """逐项打印与基线报告的差异"""
+    print('\n与基线对比（%s -> %s）' % (baseline['meta'].get('commit'), report['meta'].get('commit')))
+    print(f"{'指标':<34}{'基线':>10}{'本次':>10}{'变化':>9}")
+    rows = []
+    for name, summary in report['endpoints'].items():
+        old = baseline['endpoints'].get(name, {})
+        for key in ('p50', 'p95', 'p99'):
+            if key in summary and key in old:
+                rows.append(('%s.%s (ms)' % (name, key), old[key], summary[key]))
+    for key, value in report['throughput'].items():
+        if key in baseline.get('throughput', {}):
+            rows.append((key, baseline['throughput'][key], value))
+    for name, old, new in rows:
+        change = (new - old) / old * 100 if old else 0.0
+        print(f'{name:<34}{old:>10}{new:>10}{change:>+8.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端压测')
+    parser.add_argument('--base-url', help='被测服务地址；不指定时在本进程内启动模拟上游与应用')
+    parser.add_argument('--sessions', type=int, default=20, help='并发会话数')
+    parser.add_argument('--duration', type=float, default=30, help='压测时长（秒）')
+    parser.add_argument('--turns', type=int, default=0, help='每个会话最多发送的消息数（0 表示不限）')
+    parser.add_argument('--think-ms', type=float, default=500, help='两轮之间的停顿')
+    parser.add_argument('--request-timeout', type=float, default=120)
+    parser.add_argument('--output', help='JSON 报告输出路径')
+    parser.add_argument('--compare', help='与之前的 JSON 报告对比')
+    mock_upstream.add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    mock_stats = None
+    base_url = args.base_url
+    if base_url:
+        base_url = base_url.rstrip('/')
+    else:
+        base_url, mock_stats = start_local_app(args)
+
+    recorder = Recorder()
+    start = time.monotonic()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=run_session, args=(i, base_url, deadline, args, recorder), daemon=True)
+               for i in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    report = build_report(args, recorder, elapsed, mock_stats.snapshot() if mock_stats else None)
+
+    print(f"{'接口':<24}{'次数':>7}{'错误':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    for name, summary in report['endpoints'].items():
+        print(f"{name:<24}{summary['count']:>7}{summary['errors']:>6}"
+              f"{summary.get('p50', '-'):>10}{summary.get('p95', '-'):>10}{summary.get('p99', '-'):>10}")
+    throughput = report['throughput']
+    print('吞吐: %.1f 请求/秒, %.2f 轮/秒, %.0f 字/秒' % (
+        throughput['requests_per_sec'], throughput['turns_per_sec'], throughput['reply_chars_per_sec']))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print('报告已写入 %s' % args.output)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
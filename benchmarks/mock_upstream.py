@@ -0,0 +1,292 @@
+"""
+模拟上游（OpenAI 兼容接口）
+
+用于压测与本地联调，不产生真实的模型调用费用。``POST .../chat/completions`` 按配置的
+首字延迟、生成速度与回复长度分布输出流式或非流式回复，并可按比例注入 500 错误、
+429 限流与超时（接受请求后不再响应），以及生成中途的停顿（--stall-after 个 token 后停顿 --stall-ms）。
+客户端提前断开时停止生成，计入 ``disconnects``。
+``GET /stats`` 返回累计统计（JSON）。
+
+回复长度（token 数）服从对数正态分布，中位数为 --reply-tokens，离散程度为 --reply-sigma，
+并受请求中 max_tokens 限制；每个 token 为一个中文词或英文单词。标题批量请求
+（用户消息为 ``编号: 内容`` 的多行文本）返回以编号为键的 JSON。
+
+用法:
+    python benchmarks/mock_upstream.py [--port 8400] [--ttft-ms 300] [--tokens-per-sec 40]
+        [--reply-tokens 200] [--error-rate 0.01] [--rate-limit-rate 0.02] [--timeout-rate 0]
+
+然后让应用指向该地址：
+    OPENAI_API_URL=http://127.0.0.1:8400/v1/chat/completions OPENAI_API_KEY=mock
+"""
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    '我们', '可以', '这个', '问题', '需要', '考虑', '以下', '几个', '方面', '首先', '其次', '最后',
+    '性能', '数据', '模型', '用户', '系统', '因为', '所以', '例如', '通过', '实现', '优化', '方法',
+    'the', 'model', 'data', 'request', 'latency', 'cache', 'stream', 'token', 'server', 'query',
+    '，', '。', '\n'
+)
+TITLE_LINE_RE = re.compile(r'^(\d+): (.*)$')
+
+
+class MockOptions:
+    """模拟参数"""
+
+    def __init__(self, ttft_ms=300, ttft_jitter_ms=100, tokens_per_sec=40, reply_tokens=200, reply_sigma=0.6,
+                 error_rate=0.0, rate_limit_rate=0.0, timeout_rate=0.0, hang_seconds=120, stall_after=0,
+                 stall_ms=0, seed=None):
+        self.ttft_ms = ttft_ms
+        self.ttft_jitter_ms = ttft_jitter_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.reply_sigma = reply_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.hang_seconds = hang_seconds
+        self.stall_after = stall_after
+        self.stall_ms = stall_ms
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(ttft_ms=args.ttft_ms, ttft_jitter_ms=args.ttft_jitter_ms, tokens_per_sec=args.tokens_per_sec,
+                   reply_tokens=args.reply_tokens, reply_sigma=args.reply_sigma, error_rate=args.error_rate,
+                   rate_limit_rate=args.rate_limit_rate, timeout_rate=args.timeout_rate,
+                   hang_seconds=args.hang_seconds, stall_after=args.stall_after, stall_ms=args.stall_ms,
+                   seed=args.seed)
+
+    def draw(self, max_tokens):
+        """抽取一次请求的注入结果、首字延迟（秒）与回复 token 数"""
+        with self.lock:
+            r = self.random.random()
+            if r < self.error_rate:
+                fault = 'error'
+            elif r < self.error_rate + self.rate_limit_rate:
+                fault = 'rate_limit'
+            elif r < self.error_rate + self.rate_limit_rate + self.timeout_rate:
+                fault = 'timeout'
+            else:
+                fault = None
+            ttft = max(0.0, self.ttft_ms + self.random.uniform(-1, 1) * self.ttft_jitter_ms) / 1000.0
+            tokens = int(self.random.lognormvariate(math.log(max(self.reply_tokens, 1)), self.reply_sigma))
+            words = [self.random.choice(WORDS) for _ in range(max(1, min(tokens, max_tokens)))]
+        return fault, ttft, words
+
+
+class MockStats:
+    """累计统计"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+def _title_reply(messages):
+    """标题批量请求：为每个编号返回截取的标题"""
+    content = (messages[-1].get('content') or '') if messages else ''
+    titles = {}
+    for line in content.splitlines():
+        match = TITLE_LINE_RE.match(line)
+        if not match:
+            return None
+        titles[match.group(1)] = match.group(2)[:12] or '对话'
+    return json.dumps(titles, ensure_ascii=False) if titles else None
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    options = None
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            self._send_json(200, self.stats.snapshot())
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        messages = body.get('messages') or []
+        stream = bool(body.get('stream'))
+        self.stats.inc('requests')
+        self.stats.inc('stream_requests' if stream else 'requests_non_stream')
+
+        fault, ttft, words = self.options.draw(int(body.get('max_tokens') or 2000))
+        if fault == 'error':
+            self.stats.inc('injected_errors')
+            self._send_json(500, {'error': {'message': 'mock internal error', 'type': 'server_error'}})
+            return
+        if fault == 'rate_limit':
+            self.stats.inc('injected_rate_limits')
+            self._send_json(429, {'error': {'message': 'rate limit exceeded', 'type': 'rate_limit'}},
+                            {'Retry-After': '1'})
+            return
+        if fault == 'timeout':
+            self.stats.inc('injected_timeouts')
+            time.sleep(self.options.hang_seconds)
+            self.close_connection = True
+            return
+
+        prompt_tokens = sum(len(m.get('content') or '') for m in messages) // 2
+        model = body.get('model') or 'mock'
+        if not stream:
+            content = _title_reply(messages) or ''.join(words)
+            time.sleep(ttft + len(words) / self.options.tokens_per_sec)
+            self.stats.inc('tokens_sent', len(words))
+            self._send_json(200, {
+                'id': 'chatcmpl-' + uuid.uuid4().hex,
+                'object': 'chat.completion',
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(words),
+                          'total_tokens': prompt_tokens + len(words)}
+            })
+            return
+        self._stream(model, words, ttft, prompt_tokens)
+
+    def _stream(self, model, words, ttft, prompt_tokens):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        completion_id = 'chatcmpl-' + uuid.uuid4().hex
+        interval = 1.0 / self.options.tokens_per_sec
+        sent = 0
+        try:
+            time.sleep(ttft)
+            next_at = time.monotonic()
+            for word in words:
+                self._write_event({'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+                                   'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}]})
+                sent += 1
+                next_at += interval
+                if sent == self.options.stall_after and self.options.stall_ms:
+                    time.sleep(self.options.stall_ms / 1000.0)
+                    next_at = time.monotonic()
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            self._write_event({'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+                               'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+                               'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': sent,
+                                         'total_tokens': prompt_tokens + sent}})
+            self._write_chunk(b'data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+            self.stats.inc('streams_completed')
+        except OSError:
+            # 客户端断开（停止生成或连接关闭）
+            self.stats.inc('disconnects')
+            self.close_connection = True
+        finally:
+            self.stats.inc('tokens_sent', sent)
+            self.stats.inc('tokens_not_sent', len(words) - sent)
+
+    def _write_event(self, payload):
+        self._write_chunk(('data: ' + json.dumps(payload, ensure_ascii=False) + '\n\n').encode('utf-8'))
+
+    def _write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端断开（停止生成、关闭连接池中的空闲连接）是压测中的正常情况，不打印堆栈；
+        # 生成中的断开已计入 disconnects
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def start(host='127.0.0.1', port=0, options=None):
+    """在后台线程中启动模拟上游
+
+    Returns:
+        tuple: (server, chat/completions 地址, 统计对象)
+    """
+    handler = type('BoundMockHandler', (MockHandler,), {
+        'options': options or MockOptions(),
+        'stats': MockStats()
+    })
+    server = MockServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='mock-upstream', daemon=True).start()
+    url = 'http://%s:%d/v1/chat/completions' % (host, server.server_address[1])
+    return server, url, handler.stats
+
+
+def add_mock_arguments(parser):
+    """模拟参数（压测脚本同时使用）"""
+    group = parser.add_argument_group('模拟上游')
+    group.add_argument('--ttft-ms', type=float, default=300, help='首字延迟（毫秒）')
+    group.add_argument('--ttft-jitter-ms', type=float, default=100, help='首字延迟的均匀抖动范围')
+    group.add_argument('--tokens-per-sec', type=float, default=40, help='每秒生成的 token 数')
+    group.add_argument('--reply-tokens', type=int, default=200, help='回复 token 数的中位数')
+    group.add_argument('--reply-sigma', type=float, default=0.6, help='回复长度对数正态分布的 sigma')
+    group.add_argument('--error-rate', type=float, default=0.0, help='返回 500 的比例')
+    group.add_argument('--rate-limit-rate', type=float, default=0.0, help='返回 429 的比例')
+    group.add_argument('--timeout-rate', type=float, default=0.0, help='接受请求后不再响应的比例')
+    group.add_argument('--hang-seconds', type=float, default=120, help='超时注入时的挂起时长')
+    group.add_argument('--stall-after', type=int, default=0, help='流式回复输出该数量的 token 后停顿')
+    group.add_argument('--stall-ms', type=float, default=0, help='生成中途停顿的时长（毫秒），0 表示不停顿')
+    group.add_argument('--seed', type=int, default=None, help='随机种子')
+    return group
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模拟上游（OpenAI 兼容接口）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8400)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server, url, _ = start(args.host, args.port, MockOptions.from_args(args))
+    print('模拟上游已启动: %s （统计: http://%s:%d/stats）' % (url, args.host, server.server_address[1]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,123 @@ class Config:
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY') or ''
     OPENAI_MODEL = os.environ.get('OPENAI_MODEL') or 'Qwen/Qwen2-7B-Instruct'
     
+    # 日志配置（json 或 text 格式；采样率与每秒上限按 logger 前缀配置，如 app.models=0.1）
+    LOG_LEVEL = (os.environ.get('LOG_LEVEL') or 'INFO').upper()
+    LOG_FORMAT = (os.environ.get('LOG_FORMAT') or 'json').lower()
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE') or 10000)
+    LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES') or ''
+    LOG_RATE_LIMITS = os.environ.get('LOG_RATE_LIMITS') or ''
+    
+    # 请求链路追踪（导出器: none 只保存消息耗时 / file 写入 JSON 行 / otlp 发送到本地采集器）
+    TRACE_ENABLED = os.environ.get('TRACE_ENABLED', 'true').lower() == 'true'
+    TRACE_BLUEPRINTS = os.environ.get('TRACE_BLUEPRINTS') or 'chat'
+    TRACE_EXPORTER = (os.environ.get('TRACE_EXPORTER') or 'none').lower()
+    TRACE_FILE = os.environ.get('TRACE_FILE') or 'logs/traces.jsonl'
+    TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT') or 'http://localhost:4318/v1/traces'
+    TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME') or 'simplechat'
+    
+    # 后台任务（标题生成、活跃时间等不需要用户等待的工作）
+    TASK_EAGER = os.environ.get('TASK_EAGER', 'false').lower() == 'true'
+    TASK_WORKERS = int(os.environ.get('TASK_WORKERS') or 2)
+    TASK_QUEUE_SIZE = int(os.environ.get('TASK_QUEUE_SIZE') or 1000)
+    TASK_MAX_RETRIES = int(os.environ.get('TASK_MAX_RETRIES') or 3)
+    TASK_RETRY_BACKOFF = float(os.environ.get('TASK_RETRY_BACKOFF') or 1.0)
+    TASK_SHUTDOWN_TIMEOUT = float(os.environ.get('TASK_SHUTDOWN_TIMEOUT') or 5)
+    # 持久化队列：任务写入独立的 SQLite 文件（默认 instance/tasks.db），重启后继续执行
+    TASK_DURABLE = os.environ.get('TASK_DURABLE', 'false').lower() == 'true'
+    TASK_DB_PATH = os.environ.get('TASK_DB_PATH') or ''
+    TASK_POLL_INTERVAL = float(os.environ.get('TASK_POLL_INTERVAL') or 2)
+    TASK_LEASE_SECONDS = int(os.environ.get('TASK_LEASE_SECONDS') or 60)
+    
+    # 对话标题：后台批量调用上游生成（TITLE_MODEL 为空时使用对话模型），失败时截取第一条消息
+    TITLE_LLM_ENABLED = os.environ.get('TITLE_LLM_ENABLED', 'true').lower() == 'true'
+    TITLE_MODEL = os.environ.get('TITLE_MODEL') or ''
+    TITLE_BATCH_SIZE = int(os.environ.get('TITLE_BATCH_SIZE') or 8)
+    TITLE_BATCH_WAIT_MS = int(os.environ.get('TITLE_BATCH_WAIT_MS') or 1500)
+    TITLE_MAX_CHARS = int(os.environ.get('TITLE_MAX_CHARS') or 20)
+    
+    # 采样分析器（管理后台按需开启，结果目录所有 worker 共享）
+    PROFILER_DIR = os.environ.get('PROFILER_DIR') or 'logs/profiles'
+    PROFILER_INTERVAL_MS = int(os.environ.get('PROFILER_INTERVAL_MS') or 10)
+    PROFILER_MAX_SECONDS = int(os.environ.get('PROFILER_MAX_SECONDS') or 120)
+    PROFILER_MAX_REQUESTS = int(os.environ.get('PROFILER_MAX_REQUESTS') or 100)
+    PROFILER_MAX_STACKS = int(os.environ.get('PROFILER_MAX_STACKS') or 5000)
+    # 采样线程 CPU 占用上限（单核比例），超出时自动加大采样间隔
+    PROFILER_MAX_OVERHEAD = float(os.environ.get('PROFILER_MAX_OVERHEAD') or 0.02)
+    PROFILER_KEEP = int(os.environ.get('PROFILER_KEEP') or 20)
+    
+    # 数据库连接池配置（SQLite 忽略连接池参数）
+    # DB_POOL_MODE: session 为应用内连接池；transaction 用于前置 PgBouncer 事务池，应用侧不保留连接
+    DB_POOL_MODE = (os.environ.get('DB_POOL_MODE') or 'session').lower()
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 5)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 10)
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT') or 10)
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    # 慢查询日志阈值（毫秒，0 表示关闭）
+    DB_SLOW_QUERY_MS = int(os.environ.get('DB_SLOW_QUERY_MS') or 500)
+    
+    # 消息分页配置
+    MESSAGE_PAGE_SIZE = int(os.environ.get('MESSAGE_PAGE_SIZE') or 50)
+    MESSAGE_PAGE_MAX = int(os.environ.get('MESSAGE_PAGE_MAX') or 200)
+    
+    # 侧边栏增量同步：删除记录保留天数
+    SYNC_TOMBSTONE_DAYS = int(os.environ.get('SYNC_TOMBSTONE_DAYS') or 30)
+    
+    # 流式输出合并配置（窗口为0时关闭合并）
+    STREAM_COALESCE_WINDOW_MS = int(os.environ.get('STREAM_COALESCE_WINDOW_MS') or 30)
+    STREAM_COALESCE_MAX_CHARS = int(os.environ.get('STREAM_COALESCE_MAX_CHARS') or 512)
+    # 停止生成：跨 worker 的取消标记目录（默认 instance/stream_cancel，需所有 worker 共享）
+    STREAM_CANCEL_DIR = os.environ.get('STREAM_CANCEL_DIR') or ''
+    
+    # 发送消息的幂等键（请求头 Idempotency-Key）：保留时长、执行中状态的最长时长、重复请求最长等待时间（秒）
+    IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS') or 86400)
+    IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS') or 300)
+    IDEMPOTENCY_WAIT_SECONDS = int(os.environ.get('IDEMPOTENCY_WAIT_SECONDS') or 120)
+    
+    # 语义缓存：新对话第一条消息与已缓存问题的相似度达到阈值时直接返回缓存的回答（安装 numpy 后矩阵检索）
+    SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+    SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD') or 0.88)
+    SEMANTIC_CACHE_SIZE = int(os.environ.get('SEMANTIC_CACHE_SIZE') or 2000)
+    SEMANTIC_CACHE_DIM = int(os.environ.get('SEMANTIC_CACHE_DIM') or 1024)
+    SEMANTIC_CACHE_TTL_SECONDS = int(os.environ.get('SEMANTIC_CACHE_TTL_SECONDS') or 86400)
+    SEMANTIC_CACHE_MAX_PROMPT_CHARS = int(os.environ.get('SEMANTIC_CACHE_MAX_PROMPT_CHARS') or 500)
+    
+    # 用量统计：流式请求时要求上游在最后一个事件中返回用量（stream_options.include_usage）
+    UPSTREAM_STREAM_USAGE = os.environ.get('UPSTREAM_STREAM_USAGE', 'true').lower() == 'true'
+    # 每个用户每天（UTC）的 token 数与请求数上限，0 表示不限制
+    USAGE_DAILY_TOKEN_QUOTA = int(os.environ.get('USAGE_DAILY_TOKEN_QUOTA') or 0)
+    USAGE_DAILY_REQUEST_QUOTA = int(os.environ.get('USAGE_DAILY_REQUEST_QUOTA') or 0)
+    
+    # 排空：worker 收到 SIGTERM 后进行中的生成最多再继续的秒数，之后停止并保存已生成的部分
+    DRAIN_TIMEOUT_SECONDS = float(os.environ.get('DRAIN_TIMEOUT_SECONDS') or 25)
+    # 健康检查结果的缓存时长（数据库 / 上游，秒）与上游检查的超时
+    HEALTH_CACHE_SECONDS = float(os.environ.get('HEALTH_CACHE_SECONDS') or 10)
+    HEALTH_UPSTREAM_CACHE_SECONDS = float(os.environ.get('HEALTH_UPSTREAM_CACHE_SECONDS') or 30)
+    HEALTH_UPSTREAM_TIMEOUT = float(os.environ.get('HEALTH_UPSTREAM_TIMEOUT') or 2)
+    
+    # 消息表按月分区（仅 PostgreSQL，见 app/utils/partitioning.py）与提前创建的未来月份数
+    MESSAGES_PARTITIONING = os.environ.get('MESSAGES_PARTITIONING', 'false').lower() == 'true'
+    MESSAGES_PARTITION_MONTHS_AHEAD = int(os.environ.get('MESSAGES_PARTITION_MONTHS_AHEAD') or 3)
+    # flask partitions prune 默认保留的月数（0 表示需在命令中指定）
+    MESSAGES_RETENTION_MONTHS = int(os.environ.get('MESSAGES_RETENTION_MONTHS') or 0)
+    
+    # 消息正文压缩存储（见 app/utils/text_compression.py）：编码 zlib / zstd（需安装 zstandard）/ none，
+    # 压缩级别（留空使用编码的默认级别）与参与压缩的最小字节数（UTF-8）
+    MESSAGE_COMPRESSION_CODEC = (os.environ.get('MESSAGE_COMPRESSION_CODEC') or 'zlib').lower()
+    MESSAGE_COMPRESSION_LEVEL = int(os.environ.get('MESSAGE_COMPRESSION_LEVEL') or 0) or None
+    MESSAGE_COMPRESSION_MIN_BYTES = int(os.environ.get('MESSAGE_COMPRESSION_MIN_BYTES') or 1024)
+    
+    # JSON 序列化后端（API 响应与 SSE 帧，见 app/utils/json_provider.py）：auto / orjson / stdlib，
+    # auto 在安装 orjson 时使用 orjson
+    JSON_BACKEND = (os.environ.get('JSON_BACKEND') or 'auto').lower()
+    
+    # 响应压缩配置（按 Accept-Encoding 协商 br/gzip）
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', 'true').lower() == 'true'
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE') or 500)
+    COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL') or 6)
+    COMPRESS_BR_QUALITY = int(os.environ.get('COMPRESS_BR_QUALITY') or 4)
+    
     # 管理员配置
     ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME') or 'admin'
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD') or 'admin123'
@@ -25,6 +142,7 @@ class Config:
 class DevelopmentConfig(Config):
     """开发环境配置"""
     DEBUG = True
+    LOG_FORMAT = (os.environ.get('LOG_FORMAT') or 'text').lower()
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///simplechat_dev.db'
 
 class ProductionConfig(Config):
@@ -35,6 +153,7 @@ class ProductionConfig(Config):
 class TestingConfig(Config):
     """测试环境配置"""
     TESTING = True
+    TASK_EAGER = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///simplechat_test.db'
 
 # 配置字典
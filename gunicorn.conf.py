@@ -0,0 +1,51 @@
+"""
+gunicorn 配置
+
+使用 --preload：应用在主进程中只创建一次，worker 通过 fork 共享已导入的代码，
+启动更快、内存占用更少。create_app 不访问数据库（初始化见 flask bootstrap），
+fork 之后再丢弃从主进程继承的连接池与 HTTP 连接，每个 worker 各自重新建立。
+
+停止/重启时（SIGTERM），worker 先进入排空模式：不再接受新的生成，进行中的生成最多再继续
+DRAIN_TIMEOUT_SECONDS 秒，之后停止并保存已生成的部分（见 app/utils/streams.py）。
+graceful_timeout 在此基础上多留几秒用于保存，超过后 gunicorn 才强制结束 worker；
+容器编排的停止等待时间（如 docker-compose 的 stop_grace_period）需不短于 graceful_timeout。
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+"""
+import os
+import signal
+
+bind = '0.0.0.0:' + (os.environ.get('PROD_PORT') or '80')
+workers = int(os.environ.get('GUNICORN_WORKERS') or 4)
+preload_app = True
+graceful_timeout = int(float(os.environ.get('DRAIN_TIMEOUT_SECONDS') or 25)) + 5
+
+
+def post_fork(server, worker):
+    """worker fork 后重建数据库连接池与上游 HTTP 会话"""
+    from app import db
+    from app.services import api_service
+
+    application = server.app.wsgi()
+    with application.app_context():
+        for engine in db.engines.values():
+            # close=False：不关闭主进程持有的连接，只让当前 worker 不再复用它们
+            engine.dispose(close=False)
+    api_service.reset_session()
+
+
+def post_worker_init(worker):
+    """在 gunicorn 的 SIGTERM 处理之前先进入排空模式
+
+    gunicorn 收到 SIGTERM 后只把 worker 标记为退出，当前请求（包括流式响应）会继续执行完，
+    排空模式负责在截止时间后停止仍在进行的生成。
+    """
+    from app.utils.streams import streams
+
+    handle_exit = worker.handle_exit
+
+    def drain_and_exit(sig, frame):
+        streams.begin_drain()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, drain_and_exit)
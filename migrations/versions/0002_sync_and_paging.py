@@ -0,0 +1,64 @@
+"""消息分页索引与侧边栏增量同步（sync_version、删除记录表）
+
+Revision ID: 0002_sync_and_paging
+Revises: 0001_baseline
+Create Date: 2026-10-19 11:24:37.118240
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_sync_and_paging'
+down_revision = '0001_baseline'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 增量同步先于迁移发布，删除记录表可能已由当时的 create_all 建出（已有表的新增列则没有建出）
+    if not sa.inspect(op.get_bind()).has_table('conversation_tombstones'):
+        op.create_table('conversation_tombstones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('conversation_id', sa.Integer(), nullable=False),
+        sa.Column('sync_version', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        with op.batch_alter_table('conversation_tombstones', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_conversation_tombstones_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sync_version', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.create_index(batch_op.f('ix_conversations_sync_version'), ['sync_version'], unique=False)
+
+    # 分页索引可能已由旧版本的 create_all 建出
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('messages')}
+    if 'ix_messages_conversation_id' not in indexes:
+        with op.batch_alter_table('messages', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_messages_conversation_id'), ['conversation_id'], unique=False)
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sync_version', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('sync_floor', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('sync_floor')
+        batch_op.drop_column('sync_version')
+
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_messages_conversation_id'))
+
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_conversations_sync_version'))
+        batch_op.drop_column('sync_version')
+
+    with op.batch_alter_table('conversation_tombstones', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_conversation_tombstones_user_id'))
+
+    op.drop_table('conversation_tombstones')
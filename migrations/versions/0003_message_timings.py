@@ -0,0 +1,26 @@
+"""消息耗时明细（messages.timings）
+
+Revision ID: 0003_message_timings
+Revises: 0002_sync_and_paging
+Create Date: 2026-10-19 11:41:08.530117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_message_timings'
+down_revision = '0002_sync_and_paging'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('timings', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_column('timings')
@@ -0,0 +1,26 @@
+"""消息状态（messages.status）
+
+Revision ID: 0004_message_status
+Revises: 0003_message_timings
+Create Date: 2026-10-19 16:02:47.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_message_status'
+down_revision = '0003_message_timings'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status', sa.String(length=20), nullable=False, server_default='complete'))
+
+
+def downgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_column('status')
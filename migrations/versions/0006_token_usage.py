@@ -0,0 +1,56 @@
+"""用量统计：消息上的用量字段与按天汇总表（usage_daily）
+
+Revision ID: 0006_token_usage
+Revises: 0005_idempotency_keys
+Create Date: 2026-10-19 21:14:36.502817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_token_usage'
+down_revision = '0005_idempotency_keys'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('prompt_tokens', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('completion_tokens', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('model', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('upstream_ms', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('endpoint', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('usage_source', sa.String(length=10), nullable=True))
+
+    op.create_table('usage_daily',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('model', sa.String(length=100), nullable=False),
+    sa.Column('requests', sa.Integer(), nullable=False),
+    sa.Column('prompt_tokens', sa.BigInteger(), nullable=False),
+    sa.Column('completion_tokens', sa.BigInteger(), nullable=False),
+    sa.Column('estimated_requests', sa.Integer(), nullable=False),
+    sa.Column('cached_requests', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('day', 'user_id', 'model', name='uq_usage_daily_day_user_model')
+    )
+    with op.batch_alter_table('usage_daily', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_usage_daily_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('usage_daily', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_usage_daily_user_id'))
+
+    op.drop_table('usage_daily')
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_column('usage_source')
+        batch_op.drop_column('endpoint')
+        batch_op.drop_column('upstream_ms')
+        batch_op.drop_column('model')
+        batch_op.drop_column('completion_tokens')
+        batch_op.drop_column('prompt_tokens')
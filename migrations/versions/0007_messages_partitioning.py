@@ -0,0 +1,42 @@
+"""消息表按月分区（仅 PostgreSQL 且 MESSAGES_PARTITIONING=true 时执行，其余情况不做任何改动）
+
+空表直接切换为分区表；已有数据时创建分区表并同步新写入，之后执行
+``flask partitions convert`` 分批复制已有数据并完成切换，见 app/utils/partitioning.py。
+
+Revision ID: 0007_messages_partitioning
+Revises: 0006_token_usage
+Create Date: 2026-10-19 23:02:51.118264
+
+"""
+from alembic import op
+from flask import current_app
+from sqlalchemy import text
+
+from app.utils import partitioning
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_messages_partitioning'
+down_revision = '0006_token_usage'
+branch_labels = None
+depends_on = None
+
+
+def _enabled(bind):
+    return partitioning.is_postgresql(bind) and current_app.config['MESSAGES_PARTITIONING']
+
+
+def upgrade():
+    bind = op.get_bind()
+    if _enabled(bind):
+        partitioning.setup(bind, current_app.config['MESSAGES_PARTITION_MONTHS_AHEAD'])
+
+
+def downgrade():
+    # 只撤销尚未完成的转换；已切换的分区表与普通表的结构兼容，保持不变
+    bind = op.get_bind()
+    if not partitioning.is_postgresql(bind) or partitioning.is_partitioned(bind):
+        return
+    op.execute(text('DROP TRIGGER IF EXISTS %s ON %s' % (partitioning.MIRROR_TRIGGER, partitioning.TABLE)))
+    op.execute(text('DROP FUNCTION IF EXISTS %s()' % partitioning.MIRROR_TRIGGER))
+    op.execute(text('DROP TABLE IF EXISTS %s' % partitioning.SHADOW_TABLE))
@@ -0,0 +1,41 @@
+"""消息正文改为二进制列，超过阈值的正文压缩存储（见 app/utils/text_compression.py）
+
+PostgreSQL 把已有正文按 UTF-8 转为 bytea（未压缩，仍可直接读取），已有的长消息由后台任务或
+``flask compress-messages`` 逐批压缩。
+SQLite 按值存储类型，原有 TEXT 值可以直接读取，不修改表结构。
+
+Revision ID: 0008_compressed_message_content
+Revises: 0007_messages_partitioning
+Create Date: 2026-10-20 00:12:40.275113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.utils import partitioning
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_compressed_message_content'
+down_revision = '0007_messages_partitioning'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        return
+    for table in partitioning.message_tables(bind):
+        op.alter_column(table, 'content', type_=sa.LargeBinary(), existing_nullable=False,
+                        postgresql_using="convert_to(content, 'UTF8')")
+
+
+def downgrade():
+    # 已压缩的正文无法在 SQL 中还原，降级前需确认没有压缩过的消息（MESSAGE_COMPRESSION_CODEC=none 且从未启用）
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        return
+    for table in partitioning.message_tables(bind):
+        op.alter_column(table, 'content', type_=sa.Text(), existing_nullable=False,
+                        postgresql_using="convert_from(content, 'UTF8')")
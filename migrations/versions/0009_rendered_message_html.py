@@ -0,0 +1,34 @@
+"""AI回复渲染后的 HTML 与渲染器版本（见 app/utils/markdown.py）
+
+已有的消息两列为空，读取时即时渲染并由后台任务写回。
+
+Revision ID: 0009_rendered_message_html
+Revises: 0008_compressed_message_content
+Create Date: 2026-10-20 01:05:18.630274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.utils import partitioning
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_rendered_message_html'
+down_revision = '0008_compressed_message_content'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in partitioning.message_tables(op.get_bind()):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('content_html', sa.LargeBinary(), nullable=True))
+            batch_op.add_column(sa.Column('render_version', sa.SmallInteger(), nullable=True))
+
+
+def downgrade():
+    for table in partitioning.message_tables(op.get_bind()):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('render_version')
+            batch_op.drop_column('content_html')
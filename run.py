@@ -1,4 +1,5 @@
 from app import create_app
+from app.cli import bootstrap_database
 import os
 
 app = create_app()
@@ -14,6 +15,10 @@ if __name__ == '__main__':
         port = app.config.get('PROD_PORT', 80)
         debug = False
     
+    # 单进程直接运行时顺带初始化数据库（gunicorn 部署请先执行 flask bootstrap）
+    with app.app_context():
+        bootstrap_database()
+    
     print(f"启动 SimpleChat 应用...")
     print(f"环境: {env}")
     print(f"端口: {port}")
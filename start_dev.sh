@@ -34,7 +34,7 @@ fi
 # 初始化数据库
 echo "初始化数据库..."
 export FLASK_ENV=development
-python -c "from app import create_app, db; app = create_app(); app.app_context().push(); db.create_all(); print('数据库初始化完成')"
+flask --app run bootstrap
 
 # 启动应用
 echo "启动 SimpleChat 开发服务器..."